@@ -0,0 +1,30 @@
+"""Add push_outbox.claimed_at for claim leases
+
+Revision ID: ae4f5a6b7c8d
+Revises: 9d2e3f4a5b6c
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ae4f5a6b7c8d'
+down_revision: Union[str, Sequence[str], None] = '9d2e3f4a5b6c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('push_outbox', sa.Column('claimed_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # 還沒送完的認領改回 pending，舊版程式重啟時才會補送
+    op.execute("UPDATE push_outbox SET status = 'pending' WHERE status = 'sending'")
+    op.drop_column('push_outbox', 'claimed_at')
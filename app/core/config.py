@@ -2,6 +2,7 @@
 
 import os
 from pathlib import Path
+from typing import Dict, List
 from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 
@@ -33,6 +34,68 @@ class Settings(BaseSettings):
     # 如果 .env 中定義了 DATABASE_URL，Pydantic 會使用 .env 中的值。
     # 如果 .env 中沒有定義，Pydantic 會使用下面這個預設的 SQLite 路徑。
     DATABASE_URL: str
+    # 是否啟用非同步引擎 (asyncpg / aiosqlite)。啟用後，熱門路由改用 AsyncSession 執行資料庫操作，
+    # 不再佔用 AnyIO 的執行緒池；關閉時行為與原本的同步引擎完全相同。
+    DB_ASYNC_ENABLED: bool = False
+
+    # --- 資料庫連線池 ---
+    DB_POOL_SIZE: int = 5           # 常駐的連線數
+    DB_MAX_OVERFLOW: int = 10       # 尖峰時可額外建立的連線數
+    DB_POOL_TIMEOUT: int = 30       # 等待可用連線的秒數，超過即拋出 TimeoutError
+    DB_POOL_RECYCLE: int = 1800     # 連線存活超過此秒數就重建，避免被雲端資料庫單方面斷線
+    DB_POOL_PRE_PING: bool = True   # 借出前先 ping，自動汰換失效的連線
+
+    # --- WebSocket ---
+    # 每條連線的傳送佇列長度；滿了之後依 WS_SLOW_CONSUMER_POLICY 處理慢速接收者：
+    # "drop_oldest" = 丟掉最舊的訊息 (降級)，"disconnect" = 主動斷線讓客戶端重連
+    WS_SEND_QUEUE_SIZE: int = 64
+    WS_SLOW_CONSUMER_POLICY: str = "drop_oldest"
+    # 跨 worker 扇出的後端："memory" = 單一 worker，"postgres" = LISTEN/NOTIFY，
+    # "unix" = 本機 Unix datagram socket (測試用替身，各 worker 共用 WS_BROKER_UNIX_DIR)
+    WS_BROKER_BACKEND: str = "memory"
+    WS_BROKER_UNIX_DIR: str = "/tmp/pickup-ws-broker"
+    # 斷線重連的補送：每個房間保留最近幾則訊息；沒有連線的房間緩衝區再保留一段時間
+    WS_REPLAY_BUFFER_SIZE: int = 256
+    WS_REPLAY_DORMANT_ROOMS: int = 1024
+    WS_REPLAY_DORMANT_TTL_SECONDS: int = 600
+    # ETA 合併的時間窗 (秒)：同一位學生在時間窗內只送出最新一筆，每個房間每輪只送一個訊框
+    WS_ETA_COALESCE_WINDOW_SECONDS: float = 2.0
+    # 心跳：閒置超過 PING_INTERVAL 就送應用層 ping，PONG_TIMEOUT 內沒有回應即視為半開連線並回收；
+    # 完全沒有任何訊框超過 IDLE_TIMEOUT 也會回收。設為 0 表示停用該項檢查。
+    WS_PING_INTERVAL_SECONDS: float = 25
+    WS_PONG_TIMEOUT_SECONDS: float = 10
+    WS_IDLE_TIMEOUT_SECONDS: float = 120
+    # 連線上限 (每個 worker)：同一使用者超過上限時關閉他最舊的連線；機構超過上限時拒絕新連線
+    WS_MAX_CONNECTIONS_PER_USER: int = 5
+    WS_MAX_CONNECTIONS_PER_INSTITUTION: int = 1000
+
+    # --- 推播派送 ---
+    # "log" = 只寫日誌 (開發用)，"fake" = 模擬延遲與失敗的假供應商 (壓力測試用)
+    PUSH_PROVIDER: str = "log"
+    PUSH_WORKERS: int = 2                  # 派送執行緒數
+    PUSH_QUEUE_SIZE: int = 10_000          # 記憶體佇列上限，滿了會記錄並丟棄 (啟用外寄匣時會在重啟後補送)
+    PUSH_BATCH_SIZE: int = 100             # 每批最多幾則 (也受供應商的上限限制)
+    PUSH_BATCH_WAIT_SECONDS: float = 0.05  # 湊一批最多等多久
+    PUSH_MAX_ATTEMPTS: int = 5             # 可重試的錯誤最多嘗試幾次
+    PUSH_RETRY_BASE_SECONDS: float = 1.0   # 指數退避的起始間隔
+    PUSH_RETRY_MAX_SECONDS: float = 60.0
+    PUSH_DEDUP_TTL_SECONDS: int = 3600     # 同一個 dedup_key 在這段時間內只會送出一次
+    PUSH_OUTBOX_ENABLED: bool = False      # 推播先寫入 push_outbox 資料表，與狀態變更同一個交易
+    # 外寄匣的認領租約：worker 認領的推播超過這段時間沒有結果，其他 worker 才能重新認領 (應大於 PUSH_RETRY_MAX_SECONDS)
+    PUSH_OUTBOX_CLAIM_SECONDS: float = 300
+    # 注意：以下的節流與內容去重狀態保存在每個 worker 行程的記憶體中，不跨 worker 共用。
+    # 同一位家長的推播可能由不同的 worker 觸發，最壞情況下實際上限是設定值乘以 worker 數
+    # (例如 4 個 worker 時，BURST=3 最多連續送出 12 則)；需要全域精確的上限時，請依 worker 數調低。
+    # 每位收件人的節流 (token bucket)：最多連續送 BURST 則，之後每分鐘補回 PER_MINUTE 則；設為 0 表示停用
+    PUSH_RATE_LIMIT_BURST: int = 3
+    PUSH_RATE_LIMIT_PER_MINUTE: float = 1.0
+    # 同一位收件人、相同標題與內容的推播，在這段時間內只送一次 (不論是哪一次事件觸發的)
+    PUSH_CONTENT_DEDUP_SECONDS: float = 300
+    PUSH_THROTTLE_MAX_RECIPIENTS: int = 100_000  # 節流狀態最多記住幾位收件人
+    # 依學生狀態變更套用的規則，鍵為 "舊狀態->新狀態"，可用 * 代表任意狀態；值為：
+    # "always" = 不受節流與內容去重限制，"limited" = 預設規則，"mute" = 不推播
+    # 例如 PUSH_TRANSITION_RULES='{"*->PICKUP_COMPLETED": "always", "READY_FOR_PICKUP->HOMEWORK_PENDING": "mute"}'
+    PUSH_TRANSITION_RULES: Dict[str, str] = {"*->PICKUP_COMPLETED": "always"}
 
     # --- JWT 認證設定 ---
     # 這是我們未來用於簽發 JWT 的秘密金鑰
@@ -42,6 +105,68 @@ class Settings(BaseSettings):
     # Token 的有效期限（分鐘）
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7  # 7 天
 
+    # --- 身分快取設定 ---
+    # 依 Token 的 sub (手機號碼) 快取使用者的唯讀快照，避免每個請求都查詢 users 表
+    PRINCIPAL_CACHE_MAXSIZE: int = 2048
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 60
+    # 已驗證 Token 的 claims 快取，省去重複的簽章驗證 (實際存活時間不會超過 Token 的 exp)
+    TOKEN_CLAIMS_CACHE_MAXSIZE: int = 4096
+    TOKEN_CLAIMS_CACHE_TTL_SECONDS: int = 300
+    # Token 版本表 (user_id -> token_version)，用於撤銷舊 Token；
+    # 多 worker 部署時，其他 worker 最慢在這個秒數之後看到撤銷
+    TOKEN_VERSION_TABLE_MAXSIZE: int = 100_000
+    TOKEN_VERSION_TTL_SECONDS: int = 30
+
+    # --- 密碼雜湊執行緒池 ---
+    # bcrypt 在獨立的執行緒池中執行；同時進行中的工作超過 WORKERS + MAX_PENDING 時直接回傳 503。
+    # 兩者相加應明顯小於 AnyIO 預設的 40 條執行緒，才能保留執行緒給一般請求。
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_PENDING: int = 12
+    PASSWORD_HASH_RETRY_AFTER_SECONDS: int = 2
+
+    # --- 日誌 ---
+    LOG_LEVEL: str = "INFO"
+    # "text" = 原本的單行文字格式，"json" = 每行一筆 JSON，含 request_id / user_id / institution_id / latency_ms
+    LOG_FORMAT: str = "text"
+    # 請求執行緒只把紀錄放進這個佇列，由背景執行緒寫檔；滿了會丟棄並計數，不會卡住請求
+    LOG_QUEUE_SIZE: int = 10_000
+    # 多 worker 部署：設定為 Unix socket 路徑後，worker 把紀錄送給日誌匯集行程 (python -m app.core.log_sink)，
+    # 由它獨自寫入並輪替 app.log；留空則每個行程自己寫 app.log (單一 worker 時的原本行為)
+    LOG_SINK_SOCKET: str = ""
+    LOG_SINK_BATCH_SIZE: int = 512  # 匯集行程每批最多寫入幾筆後才 flush
+
+    # --- 監控 ---
+    # 平台維運人員 (管理員帳號) 的使用者 id，例如 PLATFORM_OPERATOR_IDS='[1]'。
+    # /admin/diagnostics/* 回傳的是整個行程 (所有機構) 的資料，只開放給這些帳號；一般機構管理員無法存取。
+    # 留空表示停用所有跨機構的診斷端點。
+    PLATFORM_OPERATOR_IDS: List[int] = []
+    # /metrics (Prometheus 文字格式) 的存取權杖，抓取時帶上 Authorization: Bearer <METRICS_TOKEN>。
+    # 指標包含所有機構的流量與內部狀態：留空時 /metrics 預設回傳 404，
+    # 只有確定 /metrics 不會對外開放 (例如反向代理已擋下、只給內部網路的 Prometheus 抓取) 時，
+    # 才設定 METRICS_PUBLIC=True 允許不帶權杖存取。
+    METRICS_TOKEN: str = ""
+    METRICS_PUBLIC: bool = False
+    # 開發 / 測試環境用：統計每個請求的 SQL 條數與耗時 (回應標頭與存取日誌)，
+    # 同一條 SQL 在一個請求中執行達到門檻次數就記錄 N+1 警告。正式環境請保持關閉。
+    SQL_MONITOR_ENABLED: bool = False
+    SQL_MONITOR_N_PLUS_ONE_THRESHOLD: int = 3
+    # 慢查詢日誌：單條 SQL 超過這個毫秒數就記錄 (參數會遮罩手機號碼)，設為 0 表示停用
+    SLOW_QUERY_THRESHOLD_MS: float = 500
+    SLOW_QUERY_MAX_STATEMENTS: int = 200        # 管理端點最多保留幾條不同的慢查詢
+    SLOW_QUERY_EXPLAIN: bool = True             # 在背景對慢查詢執行 EXPLAIN (Postgres / SQLite，不會 ANALYZE)
+    SLOW_QUERY_EXPLAIN_COOLDOWN_SECONDS: float = 300  # 同一條 SQL 多久內只 EXPLAIN 一次
+    # 單一請求的取樣分析：平台維運人員的請求帶上 X-Profile: 1 時啟用，結果存到 logs/profiles (speedscope 格式)
+    PROFILING_ENABLED: bool = True
+    PROFILING_MIN_INTERVAL_SECONDS: float = 60    # 每個 worker 兩次分析之間至少間隔多久 (同時間也只會有一個)
+    PROFILING_SAMPLE_INTERVAL_MS: float = 1.0
+    PROFILING_MAX_DURATION_SECONDS: float = 30    # 超過就停止取樣 (例如串流回應)
+    PROFILING_MAX_STORED: int = 20                # 最多保留幾份結果，較舊的會被刪除
+    # 請求追蹤：抽樣比例 0~1 (0 表示停用)，被抽中的請求寫到 logs/traces/trace.<pid>.jsonl (每行一個 Chrome Trace 事件)
+    TRACE_SAMPLE_RATE: float = 0.0
+    TRACE_MAX_SPANS_PER_REQUEST: int = 2000       # 單一請求最多記錄幾個 span (避免 N+1 迴圈撐爆記憶體)
+    TRACE_QUEUE_SIZE: int = 1000                  # 等待寫檔的請求數上限，滿了就丟棄
+    TRACE_FILE_MAX_BYTES: int = 100 * 1024 * 1024 # 超過就換新檔，只保留一份舊檔
+
     # vvv --- 【請追加這一行】 --- vvv
     # 每日健康檢查的時間
     DAILY_CHECK_TIME: str = "20:00"
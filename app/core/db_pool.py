@@ -0,0 +1,144 @@
+# 檔案路徑: app/core/db_pool.py
+# 資料庫連線池的監控：記錄取得連線的等待時間、目前借出的連線數與 overflow 使用量。
+
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from . import metrics
+
+# 取得連線通常在 1ms 內；排隊時則會一路等到 pool_timeout (預設 30 秒)
+_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+checkout_wait_seconds = metrics.histogram(
+    "db_pool_checkout_wait_seconds",
+    "從連線池取得一條連線所花的時間 (包含排隊與建立新連線)",
+    labelnames=("pool",),
+    buckets=_WAIT_BUCKETS,
+)
+checkout_timeouts_total = metrics.counter(
+    "db_pool_checkout_timeouts_total",
+    "等待連線超過 pool_timeout 而失敗的次數",
+    labelnames=("pool",),
+)
+checked_out_gauge = metrics.gauge(
+    "db_pool_checked_out",
+    "目前被借出的連線數",
+    labelnames=("pool",),
+)
+overflow_gauge = metrics.gauge(
+    "db_pool_overflow",
+    "目前使用中的 overflow 連線數 (超出 pool_size 的部分)",
+    labelnames=("pool",),
+)
+
+class PoolStats:
+    """單一連線池的累計統計，供管理端點讀取。"""
+    def __init__(self, label: str, pool: QueuePool):
+        self.label = label
+        self.pool = pool
+        self._lock = threading.Lock()
+        self.checked_out = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.peak_checked_out = 0
+        self.peak_overflow = 0
+
+    def record_wait(self, seconds: float) -> None:
+        checkout_wait_seconds.observe(seconds, pool=self.label)
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+
+    def record_timeout(self) -> None:
+        checkout_timeouts_total.inc(pool=self.label)
+        with self._lock:
+            self.timeouts += 1
+
+    def record_checkout(self) -> None:
+        # 自行計數：checkin 事件觸發時連線尚未放回佇列，pool.checkedout() 會多算一條
+        with self._lock:
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+            checked_out = self.checked_out
+        self._refresh_gauges(checked_out)
+
+    def record_checkin(self) -> None:
+        with self._lock:
+            self.checked_out = max(self.checked_out - 1, 0)
+            checked_out = self.checked_out
+        self._refresh_gauges(checked_out)
+
+    def _refresh_gauges(self, checked_out: int) -> None:
+        overflow = max(self.pool.overflow(), 0)
+        checked_out_gauge.set(checked_out, pool=self.label)
+        overflow_gauge.set(overflow, pool=self.label)
+        with self._lock:
+            self.peak_overflow = max(self.peak_overflow, overflow)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "pool": self.label,
+                "pool_size": self.pool.size(),
+                "max_overflow": self.pool._max_overflow,
+                "timeout_seconds": self.pool.timeout(),
+                "checked_out": self.checked_out,
+                "checked_in": self.pool.checkedin(),
+                "overflow": max(self.pool.overflow(), 0),
+                "peak_checked_out": self.peak_checked_out,
+                "peak_overflow": self.peak_overflow,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else None,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+            }
+
+_pool_stats: dict = {}
+
+class _InstrumentedPoolMixin:
+    """覆寫公開的 connect()，量測取得連線所花的時間，並計算逾時次數。"""
+    pool_stats: PoolStats = None
+
+    def connect(self):
+        started_at = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            if self.pool_stats is not None:
+                self.pool_stats.record_timeout()
+            raise
+        if self.pool_stats is not None:
+            self.pool_stats.record_wait(time.perf_counter() - started_at)
+        return connection
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    """同步引擎使用的 QueuePool。"""
+
+class InstrumentedAsyncAdaptedQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    """非同步引擎 (asyncpg / aiosqlite) 使用的 QueuePool。"""
+
+def instrument(pool, label: str) -> None:
+    """為引擎的連線池掛上統計與事件監聽。非 QueuePool 類型 (例如 SQLite 記憶體資料庫) 會被略過。"""
+    if not isinstance(pool, QueuePool):
+        return
+    stats = PoolStats(label, pool)
+    if isinstance(pool, _InstrumentedPoolMixin):
+        pool.pool_stats = stats
+    _pool_stats[label] = stats
+
+    @event.listens_for(pool, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        stats.record_checkout()
+
+    @event.listens_for(pool, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        stats.record_checkin()
+
+def pool_snapshot() -> list:
+    return [stats.as_dict() for stats in _pool_stats.values()]
@@ -0,0 +1,47 @@
+# 檔案路徑: app/core/log_format.py
+# 日誌的輸出位置與格式。獨立成一個沒有副作用的模組，讓日誌匯集行程 (log_sink) 不必載入 logging_config
+# (載入 logging_config 會設定根 logger 並開啟 app.log)。
+
+import json
+import logging
+from datetime import datetime, timezone
+from pathlib import Path
+
+from .config import settings
+
+# 我們將日誌檔案存放在專案的根目錄下的一個名為 'logs' 的資料夾中
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+LOGS_DIR = ROOT_DIR / "logs"
+LOG_FILE = LOGS_DIR / "app.log"
+
+# 一個好的日誌格式，應該包含時間、日誌級別、模組名稱、以及日誌訊息
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+
+# 結構化欄位：由 ContextFilter 從請求上下文填入，或由呼叫端以 extra={...} 帶入
+CONTEXT_FIELDS = ("request_id", "user_id", "institution_id")
+EXTRA_FIELDS = ("latency_ms", "method", "path", "route", "status_code", "db_queries", "db_time_ms")
+
+class JsonFormatter(logging.Formatter):
+    """每筆紀錄輸出成一行 JSON，方便日誌平台直接解析欄位。"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "message": record.getMessage(),
+        }
+        for name in CONTEXT_FIELDS + EXTRA_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def make_formatter() -> logging.Formatter:
+    if settings.LOG_FORMAT == "json":
+        return JsonFormatter()
+    return logging.Formatter(LOG_FORMAT)
@@ -0,0 +1,198 @@
+# 檔案路徑: app/core/log_sink.py
+# 多 worker 的日誌匯集。
+#
+# 每個 uvicorn worker 各自開一個 TimedRotatingFileHandler 寫同一個 app.log 時，午夜輪替會互相競爭
+# (有的 worker 還在寫已經被改名的檔案，rename 也可能卡住)。設定 LOG_SINK_SOCKET 後：
+#   - worker 的 SinkHandler 把紀錄經由 Unix socket 送給單一的匯集行程；
+#   - 匯集行程 (python -m app.core.log_sink) 是唯一開啟 app.log 的行程，負責輪替，並整批寫入後才 flush；
+#   - 匯集行程無法連線時，worker 改寫自己的 logs/app.<pid>.log，不會遺失紀錄，也不會搶同一個檔案。
+#
+# 紀錄以 pickle 傳送 (logging.handlers.SocketHandler 的格式)，所以 socket 檔只開放給同一個使用者 (0600)。
+
+import logging
+import os
+import pickle
+import queue
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from logging.handlers import SocketHandler, TimedRotatingFileHandler
+from pathlib import Path
+from typing import List, Optional
+
+from .config import settings
+from .log_format import LOG_FILE, LOGS_DIR, make_formatter
+
+# ===================================================================
+# Worker 端
+# ===================================================================
+
+class SinkHandler(SocketHandler):
+    """
+    把紀錄送到日誌匯集行程。連不上 (或送到一半斷線) 時改寫本行程專屬的備援檔案；
+    SocketHandler 本身的重連退避 (1 秒起，最多 30 秒) 避免匯集行程停機時每筆紀錄都嘗試連線。
+    """
+    def __init__(self, socket_path: str, fallback_dir: Path = LOGS_DIR):
+        super().__init__(socket_path, None)
+        self.fallback_dir = fallback_dir
+        self._fallback: Optional[logging.Handler] = None
+        self.fallback_records = 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            data = self.makePickle(record)
+            if self.sock is None:
+                self.createSocket()
+            if self.sock is not None:
+                self.sock.sendall(data)
+                return
+        except OSError:
+            self._drop_socket()
+        except Exception:
+            self.handleError(record)
+            return
+        self._write_fallback(record)
+
+    def _drop_socket(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _write_fallback(self, record: logging.LogRecord) -> None:
+        if self._fallback is None:
+            # 在第一次需要時才決定檔名，fork 出來的 worker 才會用自己的 pid
+            path = self.fallback_dir / f"app.{os.getpid()}.log"
+            self._fallback = TimedRotatingFileHandler(path, when="D", interval=1, backupCount=7, encoding="utf-8")
+            self._fallback.setFormatter(self.formatter or make_formatter())
+            print(f"警告：無法連線到日誌匯集行程 {self.address}，改寫入 {path}", file=sys.stderr)
+        self.fallback_records += 1
+        self._fallback.handle(record)
+
+    def close(self) -> None:
+        with self.lock:
+            if self._fallback is not None:
+                self._fallback.close()
+        super().close()
+
+# ===================================================================
+# 匯集行程端
+# ===================================================================
+
+class BatchingFileHandler(TimedRotatingFileHandler):
+    """每筆紀錄不各自 flush，由寫入執行緒在一整批寫完後呼叫 flush_batch()。"""
+    def flush(self) -> None:
+        pass
+
+    def flush_batch(self) -> None:
+        super().flush()
+
+class _RecordStreamHandler(socketserver.StreamRequestHandler):
+    """讀取 SocketHandler 的格式：4 bytes 長度 (big-endian) + pickle 後的 LogRecord 屬性。"""
+    def handle(self) -> None:
+        sink: "LogSink" = self.server.sink
+        sink.connections += 1
+        while True:
+            header = self.rfile.read(4)
+            if len(header) < 4:
+                return
+            (length,) = struct.unpack(">L", header)
+            data = self.rfile.read(length)
+            if len(data) < length:
+                return
+            sink.records.put(logging.makeLogRecord(pickle.loads(data)))
+
+class _SinkServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+class LogSink:
+    """接收所有 worker 的紀錄並寫入同一個檔案；只有這個行程會輪替 app.log。"""
+    def __init__(self, socket_path: str, log_file: Path = LOG_FILE, batch_size: int = settings.LOG_SINK_BATCH_SIZE):
+        self.socket_path = socket_path
+        self.batch_size = batch_size
+        self.records: "queue.Queue[logging.LogRecord]" = queue.Queue()
+        log_file.parent.mkdir(exist_ok=True)
+        self.handler = BatchingFileHandler(log_file, when="D", interval=1, backupCount=7, encoding="utf-8")
+        self.handler.setFormatter(make_formatter())
+        self.connections = 0
+        self.written = 0
+        self.batches = 0
+        self._stopping = threading.Event()
+        self._server: Optional[_SinkServer] = None
+        self._writer = threading.Thread(target=self._write_loop, name="log-sink-writer", daemon=True)
+
+    def start(self) -> None:
+        _remove_stale_socket(self.socket_path)
+        previous_umask = os.umask(0o177)
+        try:
+            self._server = _SinkServer(self.socket_path, _RecordStreamHandler)
+        finally:
+            os.umask(previous_umask)
+        self._server.sink = self
+        self._writer.start()
+        threading.Thread(target=self._server.serve_forever, name="log-sink-server", daemon=True).start()
+
+    def stop(self) -> None:
+        """停止接受連線，把已經收到的紀錄寫完後關閉檔案。"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+        self._stopping.set()
+        self._writer.join()
+        self.handler.close()
+
+    def _write_loop(self) -> None:
+        while True:
+            try:
+                batch: List[logging.LogRecord] = [self.records.get(timeout=0.5)]
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+            for record in batch:
+                self.handler.handle(record)
+            self.handler.flush_batch()
+            self.written += len(batch)
+            self.batches += 1
+
+def _remove_stale_socket(path: str) -> None:
+    """上一次匯集行程沒有正常結束時留下的 socket 檔；如果還有行程在監聽就拒絕啟動。"""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f"已經有日誌匯集行程在 {path} 上執行")
+
+def main() -> None:
+    if not settings.LOG_SINK_SOCKET:
+        sys.exit("請先設定 LOG_SINK_SOCKET (例如 /tmp/pickup-log-sink.sock)")
+    sink = LogSink(settings.LOG_SINK_SOCKET)
+    stop_requested = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_requested.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_requested.set())
+    sink.start()
+    print(f"日誌匯集行程已啟動：{settings.LOG_SINK_SOCKET} -> {sink.handler.baseFilename}", file=sys.stderr)
+    stop_requested.wait()
+    sink.stop()
+    print(f"日誌匯集行程已停止：共寫入 {sink.written} 筆 ({sink.batches} 批)", file=sys.stderr)
+
+# --- 腳本入口 ---
+if __name__ == "__main__":
+    main()
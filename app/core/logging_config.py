@@ -1,50 +1,100 @@
 # 檔案路徑: app/core/logging_config.py
 
+import atexit
 import logging
+import queue
 import sys
-from pathlib import Path
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+
+from . import request_context
+from .config import settings
+from .log_format import CONTEXT_FIELDS, LOG_FILE, LOG_FORMAT, LOGS_DIR, JsonFormatter, make_formatter
+from .log_sink import SinkHandler
 
 # --- 1. 定義日誌檔案的路徑 ---
-# 我們將日誌檔案存放在專案的根目錄下的一個名為 'logs' 的資料夾中
-ROOT_DIR = Path(__file__).resolve().parent.parent.parent
-LOGS_DIR = ROOT_DIR / "logs"
+# 路徑定義在 log_format (logs/app.log)，日誌匯集行程也會用到
 LOGS_DIR.mkdir(exist_ok=True) # 確保 logs 資料夾存在
-LOG_FILE = LOGS_DIR / "app.log"
 
-# --- 2. 定義日誌格式 ---
-# 一個好的日誌格式，應該包含時間、日誌級別、模組名稱、以及日誌訊息
-LOG_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+# --- 2. 日誌格式 ---
+# 格式本身定義在 log_format (日誌匯集行程也會用到)；LOG_FORMAT 與 JsonFormatter 在這裡保留原本的匯入路徑
+
+class ContextFilter(logging.Filter):
+    """
+    把目前請求的 request_id / user_id / institution_id 複製到紀錄上。
+    必須掛在 QueueHandler 上 (也就是在產生紀錄的執行緒中執行)：背景的 QueueListener 執行緒看不到請求的 contextvars。
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = request_context.current()
+        for name in CONTEXT_FIELDS:
+            if not hasattr(record, name):
+                setattr(record, name, getattr(context, name) if context is not None else None)
+        return True
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    請求執行緒只把紀錄放進佇列。佇列滿了 (寫檔跟不上) 就丟棄並計數，而不是卡住請求。
+
+    prepare() 只把 msg % args 合併成字串 (避免 args 中的物件在背景執行緒被讀取時已經改變)；
+    時間格式化、traceback 展開與實際的 I/O 都留給 QueueListener 的執行緒。
+    """
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
 
 # --- 3. 創建並配置根日誌記錄器 (Root Logger) ---
 # 我們直接配置根記錄器，這樣我們專案中所有模組的日誌都會繼承這個配置
 logger = logging.getLogger()
-logger.setLevel(logging.INFO) # 設定日誌記錄的最低級別為 INFO
+logger.setLevel(settings.LOG_LEVEL) # 設定日誌記錄的最低級別 (預設 INFO)
 
 # --- 4. 創建處理器 (Handlers) ---
-# 處理器決定了日誌要被發送到哪裡
+# 處理器決定了日誌要被發送到哪裡；它們都由背景的 QueueListener 執行緒呼叫，不會在請求執行緒中做 I/O
 
 # 處理器 A: 輸出到控制台 (StreamHandler)
 # 這讓我們在開發和運行時，能即時看到日誌
 stream_handler = logging.StreamHandler(sys.stdout)
-stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
-logger.addHandler(stream_handler)
+stream_handler.setFormatter(make_formatter())
 
 # 處理器 B: 輸出到檔案 (TimedRotatingFileHandler)
 # 這會將日誌寫入到 app.log 檔案中
 # TimedRotatingFileHandler 會自動按時間（例如每天）分割日誌檔案，防止單一檔案過大
 # when='D' 表示每天分割一次, backupCount=7 表示最多保留 7 個舊的日誌檔案
-file_handler = TimedRotatingFileHandler(
-    LOG_FILE, 
-    when='D', 
-    interval=1, 
-    backupCount=7, 
-    encoding='utf-8'
-)
-file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
-logger.addHandler(file_handler)
-
-# --- 5. 提供一個簡單的函數，供其他模組調用以獲取配置好的 logger ---
+# 多 worker 部署時設定 LOG_SINK_SOCKET：改由單一的日誌匯集行程寫 app.log 並負責輪替，
+# 避免每個 worker 各自輪替同一個檔案 (匯集行程連不上時改寫 logs/app.<pid>.log)
+if settings.LOG_SINK_SOCKET:
+    file_handler = SinkHandler(settings.LOG_SINK_SOCKET, fallback_dir=LOGS_DIR)
+else:
+    file_handler = TimedRotatingFileHandler(
+        LOG_FILE,
+        when='D',
+        interval=1,
+        backupCount=7,
+        encoding='utf-8'
+    )
+file_handler.setFormatter(make_formatter())
+
+# --- 5. 非同步管線：根 logger 只掛 QueueHandler，由 QueueListener 轉交給上面的處理器 ---
+log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+queue_handler = NonBlockingQueueHandler(log_queue)
+queue_handler.addFilter(ContextFilter())
+logger.addHandler(queue_handler)
+
+listener = QueueListener(log_queue, stream_handler, file_handler, respect_handler_level=True)
+listener.start()
+# 行程結束前把佇列中剩下的紀錄寫完
+atexit.register(listener.stop)
+
+# --- 6. 提供一個簡單的函數，供其他模組調用以獲取配置好的 logger ---
 def get_logger(name: str) -> logging.Logger:
     """
     獲取一個以指定名稱命名的 logger 實例。
@@ -52,3 +102,14 @@ def get_logger(name: str) -> logging.Logger:
     """
     return logging.getLogger(name)
 
+def pipeline_stats() -> dict:
+    """日誌佇列目前的長度與因為佇列已滿而丟棄的筆數。"""
+    return {
+        "format": settings.LOG_FORMAT,
+        "queued": log_queue.qsize(),
+        "queue_size": log_queue.maxsize,
+        "dropped": queue_handler.dropped,
+        "sink": settings.LOG_SINK_SOCKET or None,
+        "sink_connected": getattr(file_handler, "sock", None) is not None,
+        "sink_fallback_records": getattr(file_handler, "fallback_records", 0),
+    }
@@ -0,0 +1,187 @@
+# 檔案路徑: app/core/metrics.py
+# 一個極簡的行程內指標登錄表 (Counter / Gauge / Histogram)，不依賴任何外部套件。
+# 指標以名稱註冊一次，重複呼叫 counter()/gauge()/histogram() 會拿到同一個實例。
+
+import threading
+from typing import Dict, Iterable, Tuple
+
+# 預設的直方圖區間 (秒)，涵蓋 1ms ~ 10s
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指標 {self.name} 需要標籤 {self.labelnames}，但收到 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+class Counter(_Metric):
+    """只增不減的計數器。"""
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+class Gauge(_Metric):
+    """可以任意設定、增減的量測值。"""
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+class Histogram(_Metric):
+    """累積式直方圖：記錄每個區間的次數、總和與總次數。"""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [每個區間的次數..., 總和, 總次數]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self) -> Dict[Tuple[str, ...], dict]:
+        """回傳每組標籤的 {"buckets": {上界: 累積次數}, "sum": 總和, "count": 總次數}。"""
+        with self._lock:
+            return {
+                key: {
+                    "buckets": dict(zip(self.buckets, state[:-2])),
+                    "sum": state[-2],
+                    "count": state[-1],
+                }
+                for key, state in self._values.items()
+            }
+
+# ===================================================================
+# 登錄表 (Registry)
+# ===================================================================
+
+_registry: Dict[str, _Metric] = {}
+_registry_lock = threading.Lock()
+
+def _get_or_create(cls, name: str, documentation: str, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, documentation, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"指標 {name} 已經以 {metric.type} 類型註冊")
+        return metric
+
+def counter(name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+    return _get_or_create(Counter, name, documentation, labelnames=labelnames)
+
+def gauge(name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+    return _get_or_create(Gauge, name, documentation, labelnames=labelnames)
+
+def histogram(name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+    return _get_or_create(Histogram, name, documentation, labelnames=labelnames, buckets=buckets)
+
+def all_metrics() -> list:
+    with _registry_lock:
+        return list(_registry.values())
+
+def snapshot() -> dict:
+    """以 JSON 友善的格式回傳所有指標，供管理端點使用。"""
+    result = {}
+    for metric in all_metrics():
+        result[metric.name] = {
+            "type": metric.type,
+            "help": metric.documentation,
+            "samples": [
+                {"labels": dict(zip(metric.labelnames, key)), "value": value}
+                for key, value in metric.samples().items()
+            ],
+        }
+    return result
+
+# ===================================================================
+# Prometheus 文字格式 (text/plain; version=0.0.4)
+# ===================================================================
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render_prometheus() -> str:
+    """把登錄表中所有指標輸出成 Prometheus 的文字格式，供 /metrics 端點使用。"""
+    lines = []
+    for metric in sorted(all_metrics(), key=lambda m: m.name):
+        help_text = metric.documentation.replace("\\", "\\\\").replace("\n", "\\n")
+        lines.append(f"# HELP {metric.name} {help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for key, value in sorted(metric.samples().items()):
+            if isinstance(metric, Histogram):
+                # 我們的區間次數本來就是累積的 (value <= 上界的區間都會 +1)
+                for upper, count in value["buckets"].items():
+                    lines.append(f"{metric.name}_bucket{_labels(metric.labelnames, key, (('le', _number(upper)),))} {count}")
+                lines.append(f"{metric.name}_bucket{_labels(metric.labelnames, key, (('le', '+Inf'),))} {value['count']}")
+                lines.append(f"{metric.name}_sum{_labels(metric.labelnames, key)} {_number(value['sum'])}")
+                lines.append(f"{metric.name}_count{_labels(metric.labelnames, key)} {value['count']}")
+            else:
+                lines.append(f"{metric.name}{_labels(metric.labelnames, key)} {_number(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,100 @@
+# 檔案路徑: app/core/password_pool.py
+
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+from fastapi import HTTPException, status
+
+from . import metrics
+from .config import settings
+
+# bcrypt 的耗時通常在 50ms ~ 300ms 之間，區間依此設計
+_HASH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0)
+
+queue_wait_seconds = metrics.histogram(
+    "password_hash_queue_wait_seconds",
+    "密碼雜湊工作在佇列中等待執行的時間",
+    labelnames=("operation",),
+    buckets=_HASH_BUCKETS,
+)
+hash_duration_seconds = metrics.histogram(
+    "password_hash_duration_seconds",
+    "單次 bcrypt 雜湊 / 驗證本身的耗時",
+    labelnames=("operation",),
+    buckets=_HASH_BUCKETS,
+)
+rejected_total = metrics.counter(
+    "password_hash_rejected_total",
+    "因為佇列已滿而直接回傳 503 的次數",
+    labelnames=("operation",),
+)
+pending_gauge = metrics.gauge(
+    "password_hash_pending",
+    "正在執行或排隊中的密碼雜湊工作數",
+)
+
+class PasswordHashPool:
+    """
+    專用於 bcrypt 的執行緒池。
+
+    登入與啟用帳號是 async 路由，以 `await run_async()` 等待結果：等待期間不佔用任何 AnyIO 執行緒，
+    bcrypt 只在這個獨立大小的池中執行，登入尖峰不會耗盡 AnyIO 的執行緒池 (儀表板等一般請求仍有執行緒可用)。
+    同步程式碼 (修改密碼、建立教職員等少用的路由) 呼叫 `run()`，會佔住呼叫端的執行緒直到完成。
+    同時進行中的工作 (執行 + 排隊) 超過 `workers + max_pending` 時直接回傳 503。
+    """
+    def __init__(self, workers: int, max_pending: int, retry_after_seconds: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retry_after_seconds = retry_after_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+
+    def run(self, operation: str, fn: Callable[..., Any], *args) -> Any:
+        return self._submit(operation, fn, *args).result()
+
+    async def run_async(self, operation: str, fn: Callable[..., Any], *args) -> Any:
+        return await asyncio.wrap_future(self._submit(operation, fn, *args))
+
+    def _submit(self, operation: str, fn: Callable[..., Any], *args) -> Future:
+        if not self._slots.acquire(blocking=False):
+            rejected_total.inc(operation=operation)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="系統忙碌中，請稍後再試",
+                headers={"Retry-After": str(self.retry_after_seconds)},
+            )
+        pending_gauge.inc()
+        submitted_at = time.perf_counter()
+
+        def task():
+            started_at = time.perf_counter()
+            queue_wait_seconds.observe(started_at - submitted_at, operation=operation)
+            try:
+                return fn(*args)
+            finally:
+                hash_duration_seconds.observe(time.perf_counter() - started_at, operation=operation)
+
+        try:
+            future = self._executor.submit(task)
+        except BaseException:
+            pending_gauge.dec()
+            self._slots.release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _future) -> None:
+        pending_gauge.dec()
+        self._slots.release()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+password_pool = PasswordHashPool(
+    workers=settings.PASSWORD_HASH_WORKERS,
+    max_pending=settings.PASSWORD_HASH_MAX_PENDING,
+    retry_after_seconds=settings.PASSWORD_HASH_RETRY_AFTER_SECONDS,
+)
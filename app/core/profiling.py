@@ -0,0 +1,273 @@
+# 檔案路徑: app/core/profiling.py
+# 單一請求的取樣分析 (settings.PROFILING_ENABLED)。
+#
+# 管理員在請求上加上 X-Profile: 1 標頭，RequestMetricsMiddleware 就會呼叫 begin_request()：
+#   - 只接受平台維運人員 (settings.PLATFORM_OPERATOR_IDS) 的管理員 Token：分析結果包含整個行程的堆疊與其他機構的請求資料，
+#     一般機構管理員不能啟動或下載；Token 是否被撤銷要等路由的身分驗證跑完才知道，
+#     所以請求結束時還會確認請求上下文綁定的正是同一位使用者，否則丟棄結果；
+#   - 每個 worker 同一時間只分析一個請求，兩次之間至少間隔 PROFILING_MIN_INTERVAL_SECONDS；
+#   - 背景執行緒每 PROFILING_SAMPLE_INTERVAL_MS 取樣一次所有執行緒的呼叫堆疊，只保留屬於這個請求的：
+#     事件迴圈上正在執行這個請求的中介軟體協程，或執行緒池中以這個請求的 contextvars 執行的同步路由與依賴項，
+#     因此同時處理的其他請求不會混進結果；
+#   - 結果以 speedscope 格式 (https://www.speedscope.app) 存到 logs/profiles，
+#     同一台機器上的 worker 共用這個目錄，管理端點可以列出與下載。
+
+import contextvars
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from . import metrics, request_context
+from .config import settings
+from .log_format import LOGS_DIR, ROOT_DIR
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+PROFILES_DIR = LOGS_DIR / "profiles"
+PROFILE_SUFFIX = ".speedscope.json"
+_PROFILE_ID = re.compile(r"^\d{8}-\d{6}-[0-9a-f]{8}$")
+
+profiles_total = metrics.counter(
+    "profiles_total",
+    "X-Profile 請求的處理結果；result=captured / discarded / rate_limited",
+    labelnames=("result",),
+)
+
+class ProfileSession(threading.Thread):
+    """一次分析：取樣執行緒本身。停止後在同一條執行緒上寫檔，不佔用事件迴圈。"""
+
+    def __init__(self, context: request_context.RequestContext, user_id: int, method: str, path: str):
+        super().__init__(name="request-profiler", daemon=True)
+        self.profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.context = context
+        self.user_id = user_id
+        self.method = method
+        self.path = path
+        self.status_code: Optional[int] = None
+        self.elapsed_ms: Optional[float] = None
+        self.discard = False
+        self._stop_event = threading.Event()
+        self._frames: List[dict] = []
+        self._frame_index: dict = {}
+        # 執行緒名稱 -> ([堆疊 (frame 索引，由根到葉)], [權重 ms])
+        self._samples: dict = {}
+        self._truncated = False
+
+    def stop(self, status_code: int, elapsed_ms: float, discard: bool) -> None:
+        self.status_code = status_code
+        self.elapsed_ms = elapsed_ms
+        self.discard = discard
+        self._stop_event.set()
+
+    def run(self) -> None:
+        try:
+            self._sample_until_stopped()
+            if not self.discard:
+                self._write()
+        except Exception as e:
+            logger.error("請求分析失敗 (%s %s): %s", self.method, self.path, e, exc_info=True)
+        finally:
+            _release()
+
+    def _sample_until_stopped(self) -> None:
+        own_ident = threading.get_ident()
+        interval = settings.PROFILING_SAMPLE_INTERVAL_MS / 1000
+        deadline = time.perf_counter() + settings.PROFILING_MAX_DURATION_SECONDS
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        last = time.perf_counter()
+        while not self._stop_event.wait(interval):
+            now = time.perf_counter()
+            if now > deadline:
+                self._truncated = True
+                break
+            weight = (now - last) * 1000
+            last = now
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = self._request_stack(frame)
+                if stack is None:
+                    continue
+                name = thread_names.get(ident)
+                if name is None:
+                    thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+                    name = thread_names.get(ident, str(ident))
+                stacks, weights = self._samples.setdefault(f"{name} ({ident})", ([], []))
+                stacks.append(stack)
+                weights.append(weight)
+
+    def _request_stack(self, frame) -> Optional[List[int]]:
+        """這個堆疊屬於目前分析的請求時，回傳由根到葉的 frame 索引；否則回傳 None。"""
+        keys: List[Tuple[str, str, int]] = []
+        owned = False
+        while frame is not None:
+            code = frame.f_code
+            # 中介軟體的區域變數 context 是這個請求的 RequestContext；
+            # 執行緒池 (anyio) 的 worker 以區域變數 context (contextvars.Context) 執行同步函式
+            if not owned and ("context" in code.co_varnames or "context" in code.co_cellvars):
+                value = frame.f_locals.get("context")
+                owned = value is self.context or (
+                    isinstance(value, contextvars.Context) and request_context.from_context(value) is self.context
+                )
+            keys.append((code.co_filename, code.co_name, code.co_firstlineno))
+            frame = frame.f_back
+        if not owned:
+            return None
+        return [self._frame_id(key) for key in reversed(keys)]
+
+    def _frame_id(self, key: Tuple[str, str, int]) -> int:
+        index = self._frame_index.get(key)
+        if index is None:
+            filename, name, line = key
+            try:
+                filename = str(Path(filename).relative_to(ROOT_DIR))
+            except ValueError:
+                pass
+            index = self._frame_index[key] = len(self._frames)
+            self._frames.append({"name": name, "file": filename, "line": line})
+        return index
+
+    def _write(self) -> None:
+        title = f"{self.method} {self.path} -> {self.status_code} ({self.elapsed_ms:.1f} ms)"
+        if self._truncated:
+            title += f"，只取樣前 {settings.PROFILING_MAX_DURATION_SECONDS:g} 秒"
+        profiles = []
+        for thread_name, (stacks, weights) in sorted(self._samples.items()):
+            profiles.append({
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 3),
+                "samples": stacks,
+                "weights": [round(weight, 3) for weight in weights],
+            })
+        document = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": title,
+            "exporter": "pickup_system request profiler",
+            "activeProfileIndex": 0,
+            "shared": {"frames": self._frames},
+            "profiles": profiles,
+        }
+        PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+        path = PROFILES_DIR / f"{self.profile_id}{PROFILE_SUFFIX}"
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(document, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+        tmp_path.replace(path)
+        _prune()
+        samples = sum(len(stacks) for stacks, _ in self._samples.values())
+        logger.info("已儲存請求分析 %s：%s，%d 個樣本", self.profile_id, title, samples)
+
+# --- 全域限流：每個 worker 同時只有一個分析，且兩次之間至少間隔 PROFILING_MIN_INTERVAL_SECONDS ---
+
+_lock = threading.Lock()
+_active = False
+_last_started = float("-inf")
+
+def _acquire() -> bool:
+    global _active, _last_started
+    with _lock:
+        now = time.monotonic()
+        if _active or now - _last_started < settings.PROFILING_MIN_INTERVAL_SECONDS:
+            return False
+        _active = True
+        _last_started = now
+        return True
+
+def _release() -> None:
+    global _active
+    with _lock:
+        _active = False
+
+def _prune() -> None:
+    paths = sorted(PROFILES_DIR.glob(f"*{PROFILE_SUFFIX}"), key=lambda path: path.stat().st_mtime, reverse=True)
+    for path in paths[settings.PROFILING_MAX_STORED:]:
+        path.unlink(missing_ok=True)
+
+def _operator_user_id(authorization: Optional[bytes]) -> Optional[int]:
+    """Authorization 標頭是平台維運人員的有效管理員 Token 時回傳使用者 id (撤銷與否在請求結束時確認)。"""
+    if not authorization:
+        return None
+    scheme, _, token = authorization.decode("latin-1").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    # 延遲匯入：security 依賴 crud 與資料庫，而這個模組在中介軟體載入時就會被匯入
+    from .. import models, security
+    try:
+        claims = security.decode_access_token(token)
+    except Exception:
+        return None
+    if claims.get("role") != models.UserRole.admin.value or claims.get("st") != models.UserStatus.active.value:
+        return None
+    try:
+        user_id = int(claims["uid"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return user_id if user_id in settings.PLATFORM_OPERATOR_IDS else None
+
+# --- 請求生命週期 (由 RequestMetricsMiddleware 呼叫) ---
+
+def begin_request(
+    context: request_context.RequestContext, authorization: Optional[bytes], method: str, path: str
+) -> Optional[ProfileSession]:
+    """請求帶有 X-Profile: 1 時呼叫；不是平台維運人員或被限流時回傳 None，請求照常處理。"""
+    if not settings.PROFILING_ENABLED:
+        return None
+    user_id = _operator_user_id(authorization)
+    if user_id is None:
+        return None
+    if not _acquire():
+        profiles_total.inc(result="rate_limited")
+        logger.info("請求分析被限流，略過 %s %s", method, path)
+        return None
+    session = ProfileSession(context, user_id, method, path)
+    session.start()
+    return session
+
+def response_headers(session: ProfileSession) -> List[Tuple[bytes, bytes]]:
+    return [(b"x-profile-id", session.profile_id.encode("latin-1"))]
+
+def finish_request(session: ProfileSession, status_code: int, elapsed_ms: float) -> None:
+    # 路由的身分驗證通過時，請求上下文會綁定使用者；不是同一位 (例如 Token 已被撤銷) 就不保存結果
+    discard = session.context.user_id != session.user_id
+    profiles_total.inc(result="discarded" if discard else "captured")
+    if discard:
+        logger.warning("請求分析的結果已丟棄：%s %s 沒有以同一位平台維運人員的身分通過驗證", session.method, session.path)
+    session.stop(status_code, elapsed_ms, discard)
+
+# --- 管理端點 ---
+
+def list_profiles() -> List[dict]:
+    """已儲存的分析結果，新的在前。"""
+    if not PROFILES_DIR.is_dir():
+        return []
+    profiles = []
+    for path in PROFILES_DIR.glob(f"*{PROFILE_SUFFIX}"):
+        try:
+            stat = path.stat()
+            with path.open(encoding="utf-8") as f:
+                name = json.load(f).get("name")
+        except (OSError, ValueError):
+            continue
+        profiles.append({
+            "id": path.name[: -len(PROFILE_SUFFIX)],
+            "name": name,
+            "created_at": datetime.fromtimestamp(stat.st_mtime, timezone.utc).isoformat(timespec="seconds"),
+            "size_bytes": stat.st_size,
+        })
+    return sorted(profiles, key=lambda profile: profile["created_at"], reverse=True)
+
+def profile_path(profile_id: str) -> Optional[Path]:
+    """分析結果的檔案路徑；id 格式不對或檔案不存在時回傳 None。"""
+    if not _PROFILE_ID.match(profile_id):
+        return None
+    path = PROFILES_DIR / f"{profile_id}{PROFILE_SUFFIX}"
+    return path if path.is_file() else None
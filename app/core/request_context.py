@@ -0,0 +1,47 @@
+# 檔案路徑: app/core/request_context.py
+# 每個請求的上下文：請求 id、使用者 id、機構 id。
+#
+# 中介軟體在請求開始時建立一個 RequestContext 放進 ContextVar；之後同一個請求中的程式碼
+# (包含被 AnyIO 丟到執行緒池的同步路由與依賴項，它們會複製呼叫端的 contextvars)
+# 拿到的都是同一個物件，所以驗證身分之後填入的使用者資訊，日誌與監控都看得到。
+
+import uuid
+from contextvars import Context, ContextVar
+from typing import Optional
+
+class RequestContext:
+    __slots__ = ("request_id", "user_id", "institution_id", "sql", "trace")
+
+    def __init__(self, request_id: Optional[str] = None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.user_id: Optional[int] = None
+        self.institution_id: Optional[int] = None
+        # SQL 監控啟用時的統計 (sql_monitor.RequestSqlStats)
+        self.sql = None
+        # 被抽樣追蹤時的 span 緩衝區 (tracing.RequestTrace)
+        self.trace = None
+
+_current: ContextVar[Optional[RequestContext]] = ContextVar("request_context", default=None)
+
+def begin(request_id: Optional[str] = None):
+    """開始一個新的請求上下文；回傳 (context, token)，請求結束時把 token 交給 end()。"""
+    context = RequestContext(request_id)
+    return context, _current.set(context)
+
+def end(token) -> None:
+    _current.reset(token)
+
+def current() -> Optional[RequestContext]:
+    """目前請求的上下文；不在請求中 (例如背景執行緒、排程腳本) 時回傳 None。"""
+    return _current.get()
+
+def bind_user(user_id: int, institution_id: Optional[int]) -> None:
+    """身分驗證成功後呼叫，把使用者與機構記到目前的請求上下文。"""
+    context = _current.get()
+    if context is not None:
+        context.user_id = user_id
+        context.institution_id = institution_id
+
+def from_context(ctx: Context) -> Optional[RequestContext]:
+    """某個 contextvars.Context 所屬的請求 (例如執行緒池正在用來執行同步路由的那一份)。"""
+    return ctx.get(_current)
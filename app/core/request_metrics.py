@@ -0,0 +1,138 @@
+# 檔案路徑: app/core/request_metrics.py
+# 純 ASGI 的請求中介軟體，取代原本 @app.middleware("http") 的 global_exception_handler。
+#
+# BaseHTTPMiddleware 會為每個請求多建立一個 task 與記憶體串流來轉送回應；這裡直接包裝 ASGI 的 send，
+# 沒有額外的 task，也不會改變串流回應 (Server-Sent Events) 的行為。
+# 每個請求：
+#   - 建立請求上下文 (request_id 沿用客戶端的 X-Request-ID)，並在回應加上 X-Request-ID；
+#   - 依路由範本 (例如 /api/v1/teachers/students/{student_id}/status) 記錄延遲直方圖與狀態碼計數，
+#     沒有對應路由的請求一律歸到 "<unmatched>"，避免掃描器把標籤數量撐爆；
+#   - 未處理的例外記錄 500 錯誤並回傳標準的 JSON 回應；
+#   - 啟用 SQL_MONITOR_ENABLED 時，附上這個請求的 SQL 條數、耗時與 N+1 嫌疑 (見 sql_monitor)；
+#   - 依 TRACE_SAMPLE_RATE 抽樣的請求，結束時把整個請求的 span 寫到追蹤檔 (見 tracing)；
+#   - 平台維運人員的請求帶有 X-Profile: 1 時，對這個請求做取樣分析，回應附上 X-Profile-Id (見 profiling)。
+
+import json
+import time
+
+from . import metrics, profiling, request_context, sql_monitor, tracing
+from .config import settings
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+access_logger = get_logger("app.access")
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+request_duration_seconds = metrics.histogram(
+    "http_request_duration_seconds",
+    "HTTP 請求從進入中介軟體到回應送完的時間 (依路由範本)",
+    labelnames=("method", "route"),
+)
+requests_total = metrics.counter(
+    "http_requests_total",
+    "HTTP 請求數 (依路由範本與狀態碼)",
+    labelnames=("method", "route", "status"),
+)
+requests_in_flight = metrics.gauge(
+    "http_requests_in_flight",
+    "正在處理中的 HTTP 請求數 (包含仍在串流的 Server-Sent Events)",
+    labelnames=("method",),
+)
+unhandled_exceptions_total = metrics.counter(
+    "http_unhandled_exceptions_total",
+    "路由拋出未處理的例外、由中介軟體轉成 500 的次數",
+    labelnames=("route",),
+)
+
+_INTERNAL_ERROR_BODY = json.dumps({"detail": "Internal Server Error"}).encode("utf-8")
+
+def route_template(scope) -> str:
+    """FastAPI 在比對到路由後會把 APIRoute 放進 scope["route"]；用它的 path 範本當作標籤。"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        request_id = None
+        profile_requested = False
+        authorization = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")
+            elif name == b"x-profile":
+                profile_requested = value == b"1"
+            elif name == b"authorization":
+                authorization = value
+        context, token = request_context.begin(request_id)
+        if settings.SQL_MONITOR_ENABLED:
+            sql_monitor.begin_request(context)
+        tracing.begin_request(context)
+        profile = profiling.begin_request(context, authorization, method, scope["path"]) if profile_requested else None
+        request_id_header = (b"x-request-id", context.request_id.encode("latin-1"))
+        status_code = 500
+        response_started = False
+
+        async def send_wrapper(message):
+            nonlocal status_code, response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", ())) + [request_id_header] + sql_monitor.response_headers(context)
+                if profile is not None:
+                    message["headers"] += profiling.response_headers(profile)
+            await send(message)
+
+        started = time.perf_counter()
+        requests_in_flight.inc(method=method)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            # 捕獲到了未被處理的異常！這是一個 500 Internal Server Error
+            status_code = 500
+            unhandled_exceptions_total.inc(route=route_template(scope))
+            # 使用 logger.error 記錄完整的錯誤資訊和堆疊追蹤
+            logger.error("發生未處理的伺服器內部錯誤 (500): %s", e, exc_info=True)
+            if response_started:
+                # 回應已經開始送出 (例如串流到一半)，只能讓連線中斷
+                raise
+            # 向客戶端返回一個標準的、安全的 500 錯誤響應
+            await send({
+                "type": "http.response.start",
+                "status": 500,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(_INTERNAL_ERROR_BODY)).encode("latin-1")),
+                    request_id_header,
+                ],
+            })
+            await send({"type": "http.response.body", "body": _INTERNAL_ERROR_BODY})
+        finally:
+            elapsed = time.perf_counter() - started
+            requests_in_flight.dec(method=method)
+            route = route_template(scope)
+            request_duration_seconds.observe(elapsed, method=method, route=route)
+            requests_total.inc(method=method, route=route, status=status_code)
+            latency_ms = round(elapsed * 1000, 2)
+            if profile is not None:
+                profiling.finish_request(profile, status_code, latency_ms)
+            extra = {"method": method, "path": scope["path"], "route": route, "status_code": status_code, "latency_ms": latency_ms}
+            sql = sql_monitor.finish_request(context, route, scope["path"])
+            if sql:
+                extra.update(sql)
+                access_logger.info(
+                    "%s %s -> %d (%.2f ms, SQL %d 條 / %.2f ms)", method, scope["path"], status_code, latency_ms,
+                    sql["db_queries"], sql["db_time_ms"], extra=extra,
+                )
+            else:
+                access_logger.info("%s %s -> %d (%.2f ms)", method, scope["path"], status_code, latency_ms, extra=extra)
+            tracing.finish_request(context, method, route, scope["path"], status_code)
+            request_context.end(token)
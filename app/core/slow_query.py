@@ -0,0 +1,193 @@
+# 檔案路徑: app/core/slow_query.py
+# 慢查詢日誌 (settings.SLOW_QUERY_THRESHOLD_MS)。
+#
+# sql_monitor 的 cursor 計時事件發現某條 SQL 超過門檻時呼叫 record()：
+#   - 記錄一筆警告日誌，包含耗時、呼叫它的 app 函式 (通常是 crud 中的某個函式)，以及遮罩後的參數
+#     (手機號碼只保留末三碼，密碼雜湊與 Token 完全隱藏)；
+#   - 依 SQL 文字累計次數、總耗時、最大耗時，供管理端點列出前 N 名；
+#   - 在 Postgres / SQLite 上，把 EXPLAIN 交給背景執行緒用另一條連線執行 (不會 ANALYZE，也就是不會真的執行該 SQL)，
+#     同一條 SQL 在 SLOW_QUERY_EXPLAIN_COOLDOWN_SECONDS 內只會 EXPLAIN 一次，不佔用請求的時間與連線。
+
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from . import metrics
+from .config import settings
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+slow_queries_total = metrics.counter("db_slow_queries_total", "超過 SLOW_QUERY_THRESHOLD_MS 的 SQL 次數")
+explains_total = metrics.counter(
+    "db_slow_query_explains_total",
+    "慢查詢的 EXPLAIN 結果；result=captured / failed / skipped",
+    labelnames=("result",),
+)
+
+_PHONE = re.compile(r"^\+?\d[\d\- ]{6,}\d$")
+_SECRET = re.compile(r"^\$2[aby]\$|^eyJ")  # bcrypt 雜湊、JWT
+_EXPLAINABLE = re.compile(r"^\s*(SELECT|UPDATE|DELETE|WITH)\b", re.IGNORECASE)
+_SELECT_COLUMNS = re.compile(r"^SELECT .+? FROM ", re.IGNORECASE)
+
+def redact_value(value):
+    if isinstance(value, str):
+        if _SECRET.match(value):
+            return "***"
+        if _PHONE.match(value):
+            return "*" * (len(value) - 3) + value[-3:]
+    return value
+
+def redact_parameters(parameters):
+    """遮罩參數中的手機號碼與機密字串；支援 tuple / list / dict，以及 executemany 的多組參數。"""
+    if isinstance(parameters, dict):
+        return {key: redact_parameters(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact_parameters(value) for value in parameters]
+    return redact_value(parameters)
+
+def summarize(statement: str, limit: int = 300) -> str:
+    """日誌用的簡短 SQL：壓成一行，並把冗長的 SELECT 欄位清單省略成 ...，讓 FROM / WHERE 看得到。"""
+    flat = " ".join(statement.split())
+    flat = _SELECT_COLUMNS.sub("SELECT ... FROM ", flat, count=1)
+    return flat[:limit]
+
+def find_caller() -> Optional[str]:
+    """沿著呼叫堆疊往上找第一個 app 內 (但不是 app.core) 的函式，例如 app.crud.update_student_status:262。"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("app.") and not module.startswith("app.core."):
+            return f"{module}.{frame.f_code.co_name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return None
+
+class SlowQueryLog:
+    def __init__(
+        self,
+        threshold_ms: float = settings.SLOW_QUERY_THRESHOLD_MS,
+        max_statements: int = settings.SLOW_QUERY_MAX_STATEMENTS,
+        explain: bool = settings.SLOW_QUERY_EXPLAIN,
+        explain_cooldown_seconds: float = settings.SLOW_QUERY_EXPLAIN_COOLDOWN_SECONDS,
+    ):
+        self.threshold_seconds = threshold_ms / 1000
+        self.max_statements = max_statements
+        self.explain = explain
+        self.explain_cooldown_seconds = explain_cooldown_seconds
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = {}
+        # 單一背景執行緒；排隊中的 EXPLAIN 太多時直接略過，不會無限累積
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-explain")
+        self._explain_pending = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_seconds > 0
+
+    def record(self, conn, statement: str, parameters, elapsed: float) -> None:
+        """由 cursor 事件呼叫 (在執行 SQL 的執行緒上)；只做計數與排程，EXPLAIN 在背景執行。"""
+        caller = find_caller()
+        redacted = redact_parameters(parameters)
+        elapsed_ms = elapsed * 1000
+        slow_queries_total.inc()
+        logger.warning("慢查詢 %.1f ms (%s)：%s 參數=%s", elapsed_ms, caller or "未知呼叫者", summarize(statement), redacted)
+
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(statement)
+            if entry is None:
+                if len(self._entries) >= self.max_statements:
+                    # 淘汰累計耗時最少的一條
+                    del self._entries[min(self._entries, key=lambda key: self._entries[key]["total_ms"])]
+                entry = self._entries[statement] = {
+                    "statement": statement,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "callers": {},
+                    "plan": None,
+                    "plan_captured_at": None,
+                    "_explain_after": 0.0,
+                }
+            entry["count"] += 1
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+            entry["last_ms"] = elapsed_ms
+            entry["last_parameters"] = redacted
+            entry["last_seen"] = now
+            if caller:
+                entry["callers"][caller] = entry["callers"].get(caller, 0) + 1
+            should_explain = (
+                self.explain
+                and now >= entry["_explain_after"]
+                and self._explain_pending < 16
+                and _EXPLAINABLE.match(statement) is not None
+            )
+            if should_explain:
+                entry["_explain_after"] = now + self.explain_cooldown_seconds
+                self._explain_pending += 1
+        if should_explain:
+            self._executor.submit(self._explain, conn.engine, conn.dialect, statement, parameters)
+
+    def _explain(self, engine, dialect, statement: str, parameters) -> None:
+        try:
+            plan = self._run_explain(engine, dialect, statement, parameters)
+            result = "skipped" if plan is None else "captured"
+        except Exception as e:
+            plan = [f"EXPLAIN 失敗: {e}"]
+            result = "failed"
+        finally:
+            with self._lock:
+                self._explain_pending -= 1
+        explains_total.inc(result=result)
+        if plan is None:
+            return
+        with self._lock:
+            entry = self._entries.get(statement)
+            if entry is not None:
+                entry["plan"] = plan
+                entry["plan_captured_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        logger.info("慢查詢的執行計畫：%s\n%s", summarize(statement), "\n".join(plan))
+
+    def _run_explain(self, engine, dialect, statement: str, parameters) -> Optional[List[str]]:
+        if dialect.name == "sqlite":
+            prefix = "EXPLAIN QUERY PLAN "
+        elif dialect.name == "postgresql":
+            prefix = "EXPLAIN "
+        else:
+            return None
+        if dialect.is_async:
+            # AsyncEngine 底下的同步 Engine 不能在一般執行緒中使用；改用同一個資料庫的同步引擎，
+            # 只要兩邊的參數格式相同 (例如 aiosqlite 與 sqlite 都是 ?) 就能直接帶入原本的參數
+            from .. import database
+            if database.engine.dialect.name != dialect.name or database.engine.dialect.paramstyle != dialect.paramstyle:
+                return None
+            engine = database.engine
+        with engine.connect() as explain_conn:
+            rows = explain_conn.exec_driver_sql(prefix + statement, parameters).fetchall()
+        return [" | ".join(str(column) for column in row) for row in rows]
+
+    def top(self, limit: int = 20, order_by: str = "total_ms") -> List[dict]:
+        """依 total_ms / max_ms / count 排序的前 N 條慢查詢。"""
+        with self._lock:
+            entries = [
+                {**{key: value for key, value in entry.items() if not key.startswith("_")}, "callers": dict(entry["callers"])}
+                for entry in self._entries.values()
+            ]
+        entries.sort(key=lambda entry: entry[order_by], reverse=True)
+        for entry in entries:
+            entry["summary"] = summarize(entry["statement"])
+            entry["total_ms"] = round(entry["total_ms"], 2)
+            entry["max_ms"] = round(entry["max_ms"], 2)
+            entry["last_ms"] = round(entry["last_ms"], 2)
+        return entries[:limit]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+slow_query_log = SlowQueryLog()
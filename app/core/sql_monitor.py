@@ -0,0 +1,139 @@
+# 檔案路徑: app/core/sql_monitor.py
+# 開發 / 測試環境用的 SQL 監控 (settings.SQL_MONITOR_ENABLED)。
+#
+# 掛在 SQLAlchemy 的 before/after_cursor_execute 事件上 (所有 Engine，包含 AsyncEngine 底下的同步 Engine)，
+# 把每條 SQL 的次數與耗時累計到目前請求的上下文中。同一個請求裡「完全相同的 SQL 文字」(參數不同)
+# 執行達到 SQL_MONITOR_N_PLUS_ONE_THRESHOLD 次，就視為 N+1 嫌疑：典型的來源是在迴圈中讀取 relationship
+# (例如 Student.institution 經由 class_ 延遲載入，或序列化 /users/me 時逐一讀取 children)。
+#
+# 結果會加到回應標頭 (X-DB-Query-Count / X-DB-Time-Ms / X-DB-N-Plus-One) 與存取日誌中。
+#
+# 同一組計時事件也負責慢查詢日誌 (見 slow_query) 與追蹤的 db span (見 tracing)；只要其中之一啟用，main 就會呼叫 install()。
+
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import metrics, request_context, tracing
+from .config import settings
+from .logging_config import get_logger
+from .slow_query import slow_query_log, summarize
+
+logger = get_logger(__name__)
+
+queries_per_request = metrics.histogram(
+    "db_queries_per_request",
+    "每個 HTTP 請求執行的 SQL 條數 (只在 SQL_MONITOR_ENABLED 時記錄)",
+    labelnames=("route",),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+db_time_per_request_seconds = metrics.histogram(
+    "db_time_per_request_seconds",
+    "每個 HTTP 請求花在執行 SQL 的總時間 (只在 SQL_MONITOR_ENABLED 時記錄)",
+    labelnames=("route",),
+)
+n_plus_one_suspects_total = metrics.counter(
+    "db_n_plus_one_suspects_total",
+    "被判定為 N+1 嫌疑的請求數",
+    labelnames=("route",),
+)
+
+_START_KEY = "sql_monitor_started_at"
+
+class RequestSqlStats:
+    """一個請求中所有 SQL 的統計：statement -> [次數, 總耗時]。"""
+    __slots__ = ("count", "total_seconds", "statements", "_lock")
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.statements: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, elapsed: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.total_seconds += elapsed
+            entry = self.statements.get(statement)
+            if entry is None:
+                self.statements[statement] = [1, elapsed]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+
+    def suspects(self, threshold: int = settings.SQL_MONITOR_N_PLUS_ONE_THRESHOLD) -> List[Tuple[str, int, float]]:
+        """重複次數達到門檻的 SQL：[(statement, 次數, 總耗時)]，次數多的在前。"""
+        with self._lock:
+            repeated = [(statement, n, seconds) for statement, (n, seconds) in self.statements.items() if n >= threshold]
+        return sorted(repeated, key=lambda item: item[1], reverse=True)
+
+# --- 請求生命週期 (由 RequestMetricsMiddleware 呼叫) ---
+
+def begin_request(context: request_context.RequestContext) -> None:
+    context.sql = RequestSqlStats()
+
+def response_headers(context: request_context.RequestContext) -> List[Tuple[bytes, bytes]]:
+    """回應開始時的統計 (串流回應之後才執行的 SQL 不會算進去)。"""
+    stats: Optional[RequestSqlStats] = context.sql
+    if stats is None:
+        return []
+    return [
+        (b"x-db-query-count", str(stats.count).encode("latin-1")),
+        (b"x-db-time-ms", f"{stats.total_seconds * 1000:.2f}".encode("latin-1")),
+        (b"x-db-n-plus-one", str(len(stats.suspects())).encode("latin-1")),
+    ]
+
+def finish_request(context: request_context.RequestContext, route: str, path: str) -> dict:
+    """記錄指標與 N+1 警告，回傳要附加到存取日誌的欄位。"""
+    stats: Optional[RequestSqlStats] = context.sql
+    if stats is None:
+        return {}
+    queries_per_request.observe(stats.count, route=route)
+    db_time_per_request_seconds.observe(stats.total_seconds, route=route)
+    suspects = stats.suspects()
+    if suspects:
+        n_plus_one_suspects_total.inc(route=route)
+        for statement, count, seconds in suspects[:3]:
+            logger.warning(
+                "疑似 N+1 查詢：%s 在同一個請求中執行了 %d 次 (共 %.2f ms)：%s",
+                path, count, seconds * 1000, summarize(statement),
+            )
+    return {"db_queries": stats.count, "db_time_ms": round(stats.total_seconds * 1000, 2)}
+
+# --- SQLAlchemy 事件 ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault(_START_KEY, []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info[_START_KEY].pop()
+    if slow_query_log.enabled and elapsed >= slow_query_log.threshold_seconds:
+        slow_query_log.record(conn, statement, parameters, elapsed)
+    current = request_context.current()
+    if current is None:
+        return
+    if current.trace is not None:
+        tracing.record_sql(statement, elapsed)
+    if current.sql is not None:
+        current.sql.record(statement, elapsed)
+
+def _handle_error(exception_context):
+    # 執行失敗時不會觸發 after_cursor_execute，要把對應的開始時間拿掉
+    conn = exception_context.connection
+    if conn is not None and conn.info.get(_START_KEY):
+        conn.info[_START_KEY].pop()
+
+_installed = False
+
+def install() -> None:
+    """在所有 Engine 上掛上計時事件；重複呼叫不會重複掛。"""
+    global _installed
+    if _installed:
+        return
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Engine, "handle_error", _handle_error)
+    _installed = True
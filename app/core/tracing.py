@@ -0,0 +1,297 @@
+# 檔案路徑: app/core/tracing.py
+# 輕量的請求追蹤 (settings.TRACE_SAMPLE_RATE)，不需要外部收集器。
+#
+# RequestMetricsMiddleware 依 TRACE_SAMPLE_RATE 抽樣請求；被抽中的請求在上下文中帶著一個 RequestTrace，
+# 之後同一個請求中的 span() / @traced 都會記錄成一個 span：
+#   - security 的身分驗證依賴項 (category=auth)
+#   - crud 的每個函式 (category=crud) 與 NotificationService (category=notification)
+#   - 每條 SQL (category=db，由 sql_monitor 的 cursor 計時事件記錄)
+# 沒被抽中的請求與請求以外的程式 (背景執行緒、排程腳本)，span 只會多一次 ContextVar 查詢。
+#
+# 請求結束時，整個請求的 span 一次交給背景執行緒寫檔，輸出到 logs/traces/trace.<pid>.jsonl：
+# JSON Lines，每行一個 Chrome Trace Event，可以用 jq / grep 逐行處理，行程中途結束也只會少最後一行。
+# 要用 Perfetto (https://ui.perfetto.dev) 或 chrome://tracing 檢視時，
+# 先以 scripts/trace_to_chrome.py (to_chrome_trace) 轉成 {"traceEvents": [...]} 格式。
+# 每個請求在檢視器中是獨立的一列 (tid)，列名為「方法 路由範本」。
+
+import atexit
+import functools
+import inspect
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional
+
+from . import metrics, request_context
+from .config import settings
+from .log_format import LOGS_DIR
+from .logging_config import get_logger
+from .slow_query import summarize
+
+logger = get_logger(__name__)
+
+TRACES_DIR = LOGS_DIR / "traces"
+TRACE_SUFFIX = ".jsonl"
+
+traces_written_total = metrics.counter("traces_written_total", "寫入追蹤檔的請求數")
+traces_dropped_total = metrics.counter("traces_dropped_total", "寫入佇列已滿而丟棄的請求追蹤數")
+
+_lanes = itertools.count(1)
+
+class RequestTrace:
+    """一個被抽樣請求的 span 緩衝區；只在請求結束時整批送出。"""
+    __slots__ = ("pid", "lane", "started_ns", "started_wall_ns", "events", "dropped")
+
+    def __init__(self):
+        # 每次重新取得 pid：應用程式可能在匯入後才被 fork 成多個 worker
+        self.pid = os.getpid()
+        self.lane = next(_lanes)
+        self.started_ns = time.perf_counter_ns()
+        self.started_wall_ns = time.time_ns()
+        self.events: List[dict] = []
+        self.dropped = 0
+
+    def add(self, name: str, category: str, wall_start_ns: int, duration_ns: int, args: Optional[dict] = None) -> None:
+        if len(self.events) >= settings.TRACE_MAX_SPANS_PER_REQUEST:
+            self.dropped += 1
+            return
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": wall_start_ns / 1000,
+            "dur": duration_ns / 1000,
+            "pid": self.pid,
+            "tid": self.lane,
+        }
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+def _current_trace() -> Optional[RequestTrace]:
+    context = request_context.current()
+    return None if context is None else context.trace
+
+# ===================================================================
+# Span API
+# ===================================================================
+
+@contextmanager
+def span(name: str, category: str = "app", **args):
+    """記錄一段程式的耗時：with tracing.span("eta.coalesce", student_id=1): ..."""
+    trace = _current_trace()
+    if trace is None:
+        yield
+        return
+    wall_start = time.time_ns()
+    start = time.perf_counter_ns()
+    try:
+        yield
+    except BaseException as e:
+        args["error"] = type(e).__name__
+        raise
+    finally:
+        trace.add(name, category, wall_start, time.perf_counter_ns() - start, args)
+
+def traced(name: Optional[str] = None, category: str = "app") -> Callable:
+    """
+    函式裝飾器，span 名稱預設為「模組.函式」(例如 crud.update_student_status)。
+    以 functools.wraps 保留原本的簽章，可以用在 FastAPI 的依賴項上。
+    """
+    def decorate(func):
+        span_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__qualname__}"
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                trace = _current_trace()
+                if trace is None:
+                    return await func(*args, **kwargs)
+                with span(span_name, category):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = _current_trace()
+            if trace is None:
+                return func(*args, **kwargs)
+            wall_start = time.time_ns()
+            start = time.perf_counter_ns()
+            error = None
+            try:
+                return func(*args, **kwargs)
+            except BaseException as e:
+                error = {"error": type(e).__name__}
+                raise
+            finally:
+                trace.add(span_name, category, wall_start, time.perf_counter_ns() - start, error)
+        return wrapper
+    return decorate
+
+def instrument_functions(namespace: dict, category: str) -> None:
+    """把模組中「在這個模組定義的」公開函式全部換成 @traced 版本 (在模組結尾以 globals() 呼叫)。"""
+    module_name = namespace["__name__"]
+    for attr, value in list(namespace.items()):
+        if attr.startswith("_") or not inspect.isfunction(value) or value.__module__ != module_name:
+            continue
+        namespace[attr] = traced(category=category)(value)
+
+def instrument_methods(cls: type, category: str) -> None:
+    """把類別中的公開方法全部換成 @traced 版本。"""
+    for attr, value in list(vars(cls).items()):
+        if not attr.startswith("_") and inspect.isfunction(value):
+            setattr(cls, attr, traced(category=category)(value))
+
+def record_sql(statement: str, elapsed_seconds: float) -> None:
+    """由 sql_monitor 的 cursor 計時事件在 SQL 執行完後呼叫。"""
+    trace = _current_trace()
+    if trace is None:
+        return
+    duration_ns = int(elapsed_seconds * 1e9)
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "SQL"
+    trace.add(f"db.{verb}", "db", time.time_ns() - duration_ns, duration_ns, {"statement": summarize(statement, limit=500)})
+
+# ===================================================================
+# 請求生命週期 (由 RequestMetricsMiddleware 呼叫)
+# ===================================================================
+
+def begin_request(context: request_context.RequestContext) -> None:
+    rate = settings.TRACE_SAMPLE_RATE
+    if rate > 0 and (rate >= 1 or random.random() < rate):
+        context.trace = RequestTrace()
+
+def finish_request(context: request_context.RequestContext, method: str, route: str, path: str, status_code: int) -> None:
+    trace: Optional[RequestTrace] = context.trace
+    if trace is None:
+        return
+    context.trace = None
+    title = f"{method} {route}"
+    root = {
+        "name": title,
+        "cat": "http",
+        "ph": "X",
+        "ts": trace.started_wall_ns / 1000,
+        "dur": (time.perf_counter_ns() - trace.started_ns) / 1000,
+        "pid": trace.pid,
+        "tid": trace.lane,
+        "args": {
+            "path": path,
+            "status_code": status_code,
+            "request_id": context.request_id,
+            "user_id": context.user_id,
+            "institution_id": context.institution_id,
+            "dropped_spans": trace.dropped,
+        },
+    }
+    lane_name = {"name": "thread_name", "ph": "M", "pid": trace.pid, "tid": trace.lane, "args": {"name": title}}
+    _writer.submit([lane_name, root] + trace.events)
+
+# ===================================================================
+# 背景寫檔
+# ===================================================================
+
+class _TraceWriter:
+    """單一背景執行緒，第一次有追蹤要寫時才啟動；佇列滿了就丟棄，不讓請求等待磁碟。"""
+
+    def __init__(self):
+        self._queue: "queue.Queue[Optional[list]]" = queue.Queue(maxsize=settings.TRACE_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.path = None
+
+    def submit(self, events: list) -> None:
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(events)
+        except queue.Full:
+            traces_dropped_total.inc()
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self.path = TRACES_DIR / f"trace.{os.getpid()}{TRACE_SUFFIX}"
+            self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        return open(self.path, "a", encoding="utf-8")
+
+    def _run(self) -> None:
+        f = self._open()
+        try:
+            while True:
+                batches = [self._queue.get()]
+                # 一次把佇列中累積的都寫掉，減少 flush 次數
+                while len(batches) < 256:
+                    try:
+                        batches.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stopping = None in batches
+                lines = []
+                for events in batches:
+                    if events is None:
+                        continue
+                    lines.extend(json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n" for event in events)
+                    traces_written_total.inc()
+                try:
+                    f.write("".join(lines))
+                    f.flush()
+                    if f.tell() >= settings.TRACE_FILE_MAX_BYTES:
+                        # 保留一份舊檔：trace.<pid>.jsonl -> trace.<pid>.1.jsonl
+                        f.close()
+                        os.replace(self.path, self.path.with_suffix(f".1{TRACE_SUFFIX}"))
+                        f = self._open()
+                except OSError as e:
+                    logger.error("寫入追蹤檔失敗: %s", e)
+                if stopping:
+                    return
+        finally:
+            f.close()
+
+_writer = _TraceWriter()
+
+# ===================================================================
+# 轉換成檢視器的格式
+# ===================================================================
+
+def trace_files(directory: Path = TRACES_DIR) -> List[Path]:
+    """目錄中所有的追蹤檔 (包含換檔後保留的舊檔)。"""
+    return sorted(directory.glob(f"*{TRACE_SUFFIX}"))
+
+def to_chrome_trace(paths: Iterable[Path]) -> dict:
+    """把一個或多個 JSONL 追蹤檔合併成 Chrome Trace 的 JSON 物件格式；不完整的行 (寫到一半就結束) 會被略過。"""
+    events = []
+    skipped = 0
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    skipped += 1
+    if skipped:
+        logger.warning("轉換追蹤檔時略過 %d 行無法解析的事件", skipped)
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
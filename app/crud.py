@@ -1,37 +1,61 @@
 # 檔案路徑: app/crud.py (日誌完全整合版)
 
+import logging
+import time
+
 from fastapi import HTTPException
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import case
+from sqlalchemy.orm import Session, joinedload, selectinload
 from typing import List, Optional
 
 # vvv --- 【新的導入】 --- vvv
 from .core.logging_config import get_logger
+from .core import tracing
 # ^^^ --- 【新的導入】 --- ^^^
 
-from . import models, schemas, security
+from . import events, models, push, schemas, security
 
 # vvv --- 【初始化 logger】 --- vvv
 logger = get_logger(__name__)
 # ^^^ --- 【初始化 logger】 --- ^^^
 
 # ===================================================================
-# 模擬推播服務 (日誌升級)
+# 推播服務 (交給背景派送器批次送出)
 # ===================================================================
+
 class NotificationService:
-    def send_push_to_parents(self, parents: List[models.User], title: str, body: str):
+    def send_push_to_parents(
+        self,
+        parents: List[models.User],
+        title: str,
+        body: str,
+        db: Optional[Session] = None,
+        event_key: str = "",
+        category: Optional[str] = None,
+    ):
+        """
+        把推播排入背景派送器後立即返回，不在請求中等待供應商。
+        傳入 db 時，推播會在這個 session commit 成功後才排入 (rollback 時不送)。
+        event_key 用來產生去重鍵：同一個事件重複呼叫只會送一次。
+        category 決定套用哪一條節流規則 (見 settings.PUSH_TRANSITION_RULES)。
+        """
         if not parents:
-            logger.warning(f"試圖發送推播 '{title}'，但找不到任何家長接收者。")
+            logger.warning("試圖發送推播 '%s'，但找不到任何家長接收者。", title)
             return
-        parent_names = ", ".join([p.full_name for p in parents])
-        # 使用 logger.info 替換 print
-        notification_log = (
-            f"\n--- 模擬發送推播 ---\n"
-            f"  收件人: {parent_names}\n"
-            f"  標題: {title}\n"
-            f"  內容: {body}\n"
-            f"----------------------"
-        )
-        logger.info(notification_log)
+        messages = [
+            push.PushMessage(
+                recipient_id=parent.id,
+                title=title,
+                body=body,
+                dedup_key=push.make_dedup_key(parent.id, title, body, event_key),
+                category=category,
+            )
+            for parent in parents
+        ]
+        if db is not None:
+            push.dispatcher.submit_after_commit(db, messages)
+        else:
+            push.dispatcher.submit(messages)
 
 notifications = NotificationService()
 
@@ -45,10 +69,15 @@ def get_user_by_phone(db: Session, phone_number: str) -> Optional[models.User]:
 def update_user_password(db: Session, user: models.User, new_password: str) -> models.User:
     """更新指定使用者的密碼。"""
     user_id = user.id
+    # 遞增 Token 版本號，讓修改密碼前簽發的所有 Token 失效
+    new_token_version = (user.token_version or 0) + 1
     user.hashed_password = security.get_password_hash(new_password)
+    user.token_version = new_token_version
     db.commit()
+    security.invalidate_principal(user.phone_number)
+    security.record_token_version(user_id, new_token_version)
     db.refresh(user)
-    logger.info(f"使用者 (ID: {user_id}) 的密碼已成功更新。")
+    logger.info("使用者 (ID: %s) 的密碼已成功更新。", user_id)
     return user
 
 # ===================================================================
@@ -64,7 +93,7 @@ def create_institution(db: Session, institution: schemas.InstitutionCreate) -> m
     db.add(db_institution)
     db.commit()
     db.refresh(db_institution)
-    logger.info(f"成功創建新的機構。機構 ID: {db_institution.id}, 名稱: {db_institution.name}, 代碼: {db_institution.code}")
+    logger.info("成功創建新的機構。機構 ID: %s, 名稱: %s, 代碼: %s", db_institution.id, db_institution.name, db_institution.code)
     return db_institution
 
 # ===================================================================
@@ -85,7 +114,10 @@ def create_staff_user(db: Session, staff_data: schemas.StaffCreate, institution_
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
-    logger.info(f"成功創建新的教職員。使用者 ID: {db_user.id}, 姓名: {db_user.full_name}, 角色: {db_user.role.name}, 所屬機構 ID: {db_user.institution_id}")
+    logger.info(
+        "成功創建新的教職員。使用者 ID: %s, 姓名: %s, 角色: %s, 所屬機構 ID: %s",
+        db_user.id, db_user.full_name, db_user.role.name, db_user.institution_id,
+    )
     return db_user
 
 def create_class(db: Session, class_data: schemas.ClassCreate, institution_id: int) -> models.Class:
@@ -98,18 +130,18 @@ def create_class(db: Session, class_data: schemas.ClassCreate, institution_id: i
     db.add(db_class)
     db.commit()
     db.refresh(db_class)
-    logger.info(f"成功創建新的班級。班級 ID: {db_class.id}, 名稱: {db_class.name}, 所屬機構 ID: {db_class.institution_id}")
+    logger.info("成功創建新的班級。班級 ID: %s, 名稱: %s, 所屬機構 ID: %s", db_class.id, db_class.name, db_class.institution_id)
     return db_class
 
 # ===================================================================
 # Parent (家長)
 # ===================================================================
 
-def activate_parent_account(db: Session, activation_data: schemas.ParentActivation) -> Optional[models.User]:
-    """啟用家長帳號的核心邏輯。"""
-    # ... (查詢邏輯不變)
+def get_parent_for_activation(db: Session, activation_data: schemas.ParentActivation) -> Optional[models.User]:
+    """找出這份啟用資料對應的家長帳號：必須是待啟用狀態，且有一位子女的機構代碼與姓名相符。"""
+    # Student.institution 是 association_proxy，必須經由 class_ 預先載入
     user = db.query(models.User).options(
-        joinedload(models.User.children).joinedload(models.Student.institution)
+        joinedload(models.User.children).joinedload(models.Student.class_).joinedload(models.Class.institution)
     ).filter(
         models.User.phone_number == activation_data.phone_number,
         models.User.status == models.UserStatus.invited
@@ -121,13 +153,26 @@ def activate_parent_account(db: Session, activation_data: schemas.ParentActivati
         for student in user.children
     ):
         return None
+    return user
+
+def activate_parent_account(
+    db: Session, activation_data: schemas.ParentActivation, hashed_password: Optional[str] = None
+) -> Optional[models.User]:
+    """
+    啟用家長帳號的核心邏輯。
+    async 路由會先以 get_parent_for_activation 確認帳號、在 password_pool 中算好 hashed_password 再傳進來。
+    """
+    user = get_parent_for_activation(db, activation_data)
+    if user is None:
+        return None
 
     user_id = user.id
-    user.hashed_password = security.get_password_hash(activation_data.password)
+    user.hashed_password = hashed_password or security.get_password_hash(activation_data.password)
     user.status = models.UserStatus.active
     db.commit()
+    security.invalidate_principal(activation_data.phone_number)
     db.refresh(user)
-    logger.info(f"家長帳號 (ID: {user_id}, 手機: {user.phone_number}) 已成功啟用。")
+    logger.info("家長帳號 (ID: %s, 手機: %s) 已成功啟用。", user_id, user.phone_number)
     return user
 
 def bind_child_to_parent(db: Session, *, parent: models.User, child_info: schemas.ChildBindingCreate) -> models.User:
@@ -146,7 +191,10 @@ def bind_child_to_parent(db: Session, *, parent: models.User, child_info: schema
     db.add(parent)
     db.commit()
     db.refresh(parent)
-    logger.info(f"成功將學生 (ID: {student_to_bind.id}, 姓名: {student_to_bind.full_name}) 綁定到家長 (ID: {parent.id}, 姓名: {parent.full_name})。")
+    logger.info(
+        "成功將學生 (ID: %s, 姓名: %s) 綁定到家長 (ID: %s, 姓名: %s)。",
+        student_to_bind.id, student_to_bind.full_name, parent.id, parent.full_name,
+    )
     return parent
 
 # ===================================================================
@@ -164,6 +212,56 @@ def get_student_by_name_and_institution(db: Session, name: str, institution_code
         models.Institution.code == institution_code
     ).first()
 
+def get_student_status_snapshot(
+    db: Session, *, institution_id: Optional[int] = None, class_id: Optional[int] = None
+) -> List[dict]:
+    """機構或班級內所有學生目前的狀態 (WebSocket 重連時的完整快照，只取需要的欄位)。"""
+    query = db.query(models.Student.id, models.Student.class_id, models.Student.status)
+    if class_id is not None:
+        query = query.filter(models.Student.class_id == class_id)
+    if institution_id is not None:
+        query = query.join(models.Student.class_).filter(models.Class.institution_id == institution_id)
+    return [
+        {"student_id": student_id, "class_id": student_class_id, "status": student_status.value}
+        for student_id, student_class_id, student_status in query.order_by(models.Student.id)
+    ]
+
+# 儀表板的排序：需要處理的學生排前面 (家長已出發 > 可接送 > 在班 > ... > 已離校)
+DASHBOARD_STATUS_ORDER = (
+    models.StudentStatus.PARENT_EN_ROUTE,
+    models.StudentStatus.READY_FOR_PICKUP,
+    models.StudentStatus.HOMEWORK_PENDING,
+    models.StudentStatus.ARRIVED,
+    models.StudentStatus.NOT_ARRIVED,
+    models.StudentStatus.PICKUP_COMPLETED,
+)
+
+def get_dashboard_students(
+    db: Session,
+    *,
+    institution_id: int,
+    teacher_id: Optional[int] = None,
+    statuses: Optional[List[models.StudentStatus]] = None,
+) -> List[models.Student]:
+    """儀表板的學生列表：限定在操作者的機構內，可依帶班老師與狀態篩選。"""
+    query = (
+        db.query(models.Student)
+        .join(models.Student.class_)
+        .filter(models.Class.institution_id == institution_id)
+        # 序列化 StudentOut 時會讀取班級與家長，一次載入，避免逐一查詢
+        .options(joinedload(models.Student.class_), selectinload(models.Student.parents))
+    )
+    if teacher_id is not None:
+        query = query.filter(models.Class.teacher_id == teacher_id)
+    if statuses:
+        query = query.filter(models.Student.status.in_(statuses))
+    priority = case(
+        {status: rank for rank, status in enumerate(DASHBOARD_STATUS_ORDER)},
+        value=models.Student.status,
+        else_=len(DASHBOARD_STATUS_ORDER),
+    )
+    return query.order_by(priority, models.Student.full_name, models.Student.id).all()
+
 def create_student(db: Session, student_data: schemas.StudentCreate) -> models.Student:
     """建立學生，並預註冊或關聯家長。"""
     db_student = models.Student(
@@ -185,10 +283,23 @@ def create_student(db: Session, student_data: schemas.StudentCreate) -> models.S
     
     db.commit()
     db.refresh(db_student)
-    parent_phones = ", ".join([p.phone_number for p in student_data.parents])
-    logger.info(f"成功創建新的學生。學生 ID: {db_student.id}, 姓名: {db_student.full_name}, 班級 ID: {db_student.class_id}。關聯家長手機: [{parent_phones}]")
+    if logger.isEnabledFor(logging.INFO):
+        parent_phones = ", ".join([p.phone_number for p in student_data.parents])
+        logger.info(
+            "成功創建新的學生。學生 ID: %s, 姓名: %s, 班級 ID: %s。關聯家長手機: [%s]",
+            db_student.id, db_student.full_name, db_student.class_id, parent_phones,
+        )
     return db_student
 
+# 哪些狀態變更要推播給家長；沒有列出的狀態 (例如家長自己觸發的 PARENT_EN_ROUTE) 不推播。
+# 排入前還會依 settings.PUSH_TRANSITION_RULES 做每位家長的節流與內容去重
+STATUS_PUSH_MESSAGES = {
+    models.StudentStatus.ARRIVED: ("學生已到班", "{name} 已經抵達安親班。"),
+    models.StudentStatus.READY_FOR_PICKUP: ("可以接送了", "{name} 已準備好，可以前來接送。"),
+    models.StudentStatus.HOMEWORK_PENDING: ("作業尚未完成", "{name} 還在完成今天的作業，請稍後再來接送。"),
+    models.StudentStatus.PICKUP_COMPLETED: ("接送完成", "{name} 已經由家長接走。"),
+}
+
 def update_student_status(
     db: Session, 
     *, 
@@ -206,17 +317,98 @@ def update_student_status(
     student.status = new_status
     db.add(student)
     
-    # ... (推播邏輯不變)
+    # 推播給家長：commit 成功後才排入派送器；同一秒內重複送出的相同變更 (例如連點) 只推播一次
+    push_text = STATUS_PUSH_MESSAGES.get(new_status)
+    if push_text is not None and new_status != current_status_before_update:
+        title, body = push_text
+        transition = f"{current_status_before_update.value}->{new_status.value}"
+        notifications.send_push_to_parents(
+            list(student.parents),
+            title,
+            body.format(name=student.full_name),
+            db=db,
+            event_key=f"student:{student.id}:{transition}:{int(time.time())}",
+            category=transition,
+        )
+
+    # 即時事件：commit 成功後才送到機構與班級的 WebSocket 房間
+    events.publish_student_status(
+        db,
+        student=student,
+        institution_id=operator.institution_id,
+        old_status=current_status_before_update,
+        new_status=new_status,
+        operator_id=operator.id,
+    )
     
     db.commit()
     db.refresh(student)
     logger.info(
-        f"學生狀態更新。學生 ID: {student.id}, 姓名: {student.full_name}, "
-        f"狀態從 [{current_status_before_update.name}] 更新為 [{new_status.name}]。 "
-        f"操作者: {operator.full_name} (ID: {operator.id})"
+        "學生狀態更新。學生 ID: %s, 姓名: %s, 狀態從 [%s] 更新為 [%s]。 操作者: %s (ID: %s)",
+        student.id, student.full_name, current_status_before_update.name, new_status.name,
+        operator.full_name, operator.id,
     )
     return student
 
+# 家長可以發起接送的學生狀態 (還沒到校或已經離校的學生不行)
+PICKUP_START_STATUSES = (
+    models.StudentStatus.ARRIVED,
+    models.StudentStatus.READY_FOR_PICKUP,
+    models.StudentStatus.HOMEWORK_PENDING,
+)
+
+def start_pickup_process(db: Session, *, student: models.Student, parent: models.User) -> models.Student:
+    """
+    家長按下「出發」：學生狀態改為 PARENT_EN_ROUTE，commit 後通知機構與班級的 WebSocket 房間。
+    已經是 PARENT_EN_ROUTE 時 (例如重複點擊) 直接回傳，不會重複廣播。
+    """
+    if parent not in student.parents:
+        raise HTTPException(status_code=403, detail="權限不足：您不是該學生的家長")
+    if student.status == models.StudentStatus.PARENT_EN_ROUTE:
+        return student
+    if student.status not in PICKUP_START_STATUSES:
+        raise HTTPException(status_code=400, detail="學生目前的狀態無法發起接送")
+
+    old_status = student.status
+    student.status = models.StudentStatus.PARENT_EN_ROUTE
+    db.add(student)
+    events.publish_student_status(
+        db,
+        student=student,
+        institution_id=student.class_.institution_id,
+        old_status=old_status,
+        new_status=student.status,
+        operator_id=parent.id,
+    )
+    db.commit()
+    db.refresh(student)
+    logger.info("家長發起接送。學生 ID: %s, 家長 ID: %s, 狀態從 [%s] 更新為 [PARENT_EN_ROUTE]。", student.id, parent.id, old_status.name)
+    return student
+
+def update_pickup_eta(
+    db: Session,
+    *,
+    student: models.Student,
+    parent: models.User,
+    minutes_remaining: int
+) -> None:
+    """
+    家長更新預計到達時間。ETA 是短暫的資訊，不寫入資料庫；
+    交給 ETA 合併器，依時間窗合併後再送到機構與班級的 WebSocket 房間。
+    """
+    if parent not in student.parents:
+        raise HTTPException(status_code=403, detail="權限不足：您不是該學生的家長")
+    if minutes_remaining < 0:
+        raise HTTPException(status_code=400, detail="預計到達時間不可為負數")
+
+    events.publish_eta(
+        student=student,
+        institution_id=student.class_.institution_id,
+        parent_id=parent.id,
+        minutes_remaining=minutes_remaining,
+    )
+    logger.debug("家長更新 ETA。學生 ID: %s, 家長 ID: %s, 剩餘 %s 分鐘。", student.id, parent.id, minutes_remaining)
+
 # ===================================================================
 # Unbind and Delete (解除綁定與刪除)
 # ===================================================================
@@ -228,7 +420,7 @@ def unbind_student_from_parent_by_ids(db: Session, *, student_id: int, parent_id
         return False
     db.delete(link)
     db.commit()
-    logger.info(f"成功解除綁定。學生 ID: {student_id}, 家長 ID: {parent_id}。")
+    logger.info("成功解除綁定。學生 ID: %s, 家長 ID: %s。", student_id, parent_id)
     return True
 
 def delete_student_by_id(db: Session, *, student_id: int) -> Optional[models.Student]:
@@ -239,7 +431,7 @@ def delete_student_by_id(db: Session, *, student_id: int) -> Optional[models.Stu
     student_name = student_to_delete.full_name
     db.delete(student_to_delete)
     db.commit()
-    logger.info(f"成功刪除學生。學生 ID: {student_id}, 姓名: {student_name}。")
+    logger.info("成功刪除學生。學生 ID: %s, 姓名: %s。", student_id, student_name)
     return student_to_delete
 
 def delete_user_by_id(db: Session, *, user_id: int) -> Optional[models.User]:
@@ -248,9 +440,17 @@ def delete_user_by_id(db: Session, *, user_id: int) -> Optional[models.User]:
     if not user_to_delete:
         return None
     user_name = user_to_delete.full_name
+    user_phone = user_to_delete.phone_number
     db.delete(user_to_delete)
     db.commit()
-    logger.info(f"成功刪除使用者。使用者 ID: {user_id}, 姓名: {user_name}。")
+    security.invalidate_principal(user_phone)
+    security.revoke_user_tokens(user_id)
+    logger.info("成功刪除使用者。使用者 ID: %s, 姓名: %s。", user_id, user_name)
     return user_to_delete
 
-# ... (start_pickup_process 和 update_pickup_eta 保持不變，它們的 print 語句在模擬 WebSocket，暫時保留)
+# ===================================================================
+# 追蹤 (見 core/tracing.py)：被抽樣的請求會記錄每個 crud 函式與推播服務的耗時
+# ===================================================================
+
+tracing.instrument_functions(globals(), category="crud")
+tracing.instrument_methods(NotificationService, category="notification")
@@ -1,9 +1,11 @@
 # 檔案路徑: app/database.py (修改後)
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import URL, make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings # <--- 我們唯一的設定來源
+from app.core import db_pool
 
 # 1. 直接從 settings 物件獲取資料庫 URL
 #    Pydantic 的 BaseSettings 已經幫我們處理了從 .env 或環境變數讀取的邏輯。
@@ -15,17 +17,80 @@ SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 if SQLALCHEMY_DATABASE_URL.startswith("postgres://"):
     SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-# 3. 根據 URL 的內容，決定 create_engine 的參數
-if "sqlite" in SQLALCHEMY_DATABASE_URL:
+# 3. 連線池設定 (全部來自 settings)，同步與非同步引擎共用
+#    放學時段曾出現 "QueuePool limit ... overflow" 逾時，所以這些數值必須可以依環境調整。
+POOL_OPTIONS = {
+    "pool_size": settings.DB_POOL_SIZE,
+    "max_overflow": settings.DB_MAX_OVERFLOW,
+    "pool_timeout": settings.DB_POOL_TIMEOUT,
+    "pool_recycle": settings.DB_POOL_RECYCLE,
+    "pool_pre_ping": settings.DB_POOL_PRE_PING,
+}
+IS_SQLITE = make_url(SQLALCHEMY_DATABASE_URL).get_backend_name() == "sqlite"
+
+def pool_arguments(poolclass) -> dict:
+    """
+    只有資料庫伺服器 (PostgreSQL 等) 才套用上面的連線池設定。
+    SQLite 保留 SQLAlchemy 預設的連線池：記憶體資料庫 (sqlite://) 必須所有連線共用同一條，
+    換成 QueuePool 會讓每條連線各自拿到一個空的資料庫；檔案資料庫的預設本來就是 QueuePool。
+    """
+    if IS_SQLITE:
+        return {}
+    return {"poolclass": poolclass, **POOL_OPTIONS}
+
+# 4. 根據 URL 的內容，決定 create_engine 的參數
+if IS_SQLITE:
     # 如果是 SQLite，添加 connect_args
     engine = create_engine(
         SQLALCHEMY_DATABASE_URL, 
-        connect_args={"check_same_thread": False}
+        connect_args={"check_same_thread": False},
+        **pool_arguments(db_pool.InstrumentedQueuePool)
     )
 else:
     # 如果是 PostgreSQL 或其他資料庫，正常創建
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        **pool_arguments(db_pool.InstrumentedQueuePool)
+    )
+db_pool.instrument(engine.pool, "sync")
 
-# 4. 後續部分保持不變
+# 5. 後續部分保持不變
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+
+# 6. (可選) 非同步引擎：PostgreSQL 使用 asyncpg，本地 SQLite 使用 aiosqlite
+#    由 settings.DB_ASYNC_ENABLED 切換，方便在壓力測試時做 A/B 比較。
+#    關閉時不會匯入任何非同步驅動程式，也不需要安裝它們。
+def to_async_url(url: str) -> URL:
+    """將同步的資料庫 URL 轉換為對應的非同步驅動程式 URL。"""
+    async_url = make_url(url)
+    if async_url.drivername.startswith("postgresql"):
+        async_url = async_url.set(drivername="postgresql+asyncpg")
+        # asyncpg 不認得 libpq 的 sslmode 參數，改用它自己的 ssl 參數
+        if "sslmode" in async_url.query:
+            query = dict(async_url.query)
+            query["ssl"] = query.pop("sslmode")
+            async_url = async_url.set(query=query)
+    elif async_url.drivername.startswith("sqlite"):
+        async_url = async_url.set(drivername="sqlite+aiosqlite")
+    return async_url
+
+def to_libpq_dsn(url: str) -> str:
+    """
+    給直接使用驅動程式的元件 (例如 asyncpg 的 LISTEN/NOTIFY broker) 的純 postgresql:// DSN：
+    去掉 SQLAlchemy 的 +psycopg2 / +psycopg 等驅動後綴，postgres:// 也一併改寫。
+    """
+    return make_url(url).set(drivername="postgresql").render_as_string(hide_password=False)
+
+async_engine = None
+AsyncSessionLocal = None
+
+if settings.DB_ASYNC_ENABLED:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(
+        to_async_url(SQLALCHEMY_DATABASE_URL),
+        **pool_arguments(db_pool.InstrumentedAsyncAdaptedQueuePool)
+    )
+    db_pool.instrument(async_engine.pool, "async")
+    AsyncSessionLocal = async_sessionmaker(async_engine, autocommit=False, autoflush=False)
@@ -1,14 +1,21 @@
 # 檔案路徑: pickup_system/app/dependencies.py
 
+from abc import ABC, abstractmethod
+
 from fastapi import Depends, HTTPException, status, Query
 from fastapi.security import OAuth2PasswordBearer
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from jose import JWTError, jwt
+from jose import JWTError
+from typing import Any, Callable, Optional
 
 from . import crud, models, security, database
+from .core.config import settings
 
 # 建立一個 OAuth2 "流程" 的實例，它指向獲取 token 的 API 端點
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/token")
+# 沒有 Authorization 標頭時不直接回 401，讓 SSE 端點可以改從查詢參數取得 token
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/token", auto_error=False)
 
 def get_db():
     """
@@ -20,12 +27,61 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """
+    get_db 的非同步版本，為每個請求建立一個 AsyncSession。
+    只有在 settings.DB_ASYNC_ENABLED 為 True 時才能使用。
+    """
+    if database.AsyncSessionLocal is None:
+        raise RuntimeError("非同步資料庫引擎未啟用，請設定 DB_ASYNC_ENABLED=true")
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
+class DBRunner(ABC):
+    """
+    讓以同步 Session 撰寫的 crud 函式，可以在 async 路由中執行。
+
+    用法: `await db.run(fn, *args, **kwargs)`，fn 的第一個參數會收到一個同步的 Session。
+    fn 內可以自由地使用延遲載入 (lazy load)，因此回傳給客戶端的 Pydantic 模型也應該在 fn 內建立。
+    """
+    def __init__(self, session):
+        self.session = session
+
+    @abstractmethod
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        ...
+
+class ThreadpoolDBRunner(DBRunner):
+    """同步引擎：在 AnyIO 的執行緒池中執行 fn (與同步路由的行為相同)。"""
+    async def run(self, fn, *args, **kwargs):
+        return await run_in_threadpool(fn, self.session, *args, **kwargs)
+
+class AsyncDBRunner(DBRunner):
+    """非同步引擎：透過 AsyncSession.run_sync 執行 fn，不佔用任何執行緒。"""
+    async def run(self, fn, *args, **kwargs):
+        return await self.session.run_sync(fn, *args, **kwargs)
+
+async def get_db_runner():
+    """
+    熱門路由使用的資料庫依賴項，依 settings.DB_ASYNC_ENABLED 選擇同步或非同步引擎。
+    """
+    if settings.DB_ASYNC_ENABLED:
+        async with database.AsyncSessionLocal() as session:
+            yield AsyncDBRunner(session)
+    else:
+        db = database.SessionLocal()
+        try:
+            yield ThreadpoolDBRunner(db)
+        finally:
+            await run_in_threadpool(db.close)
+
 def get_current_user(
     token: str = Depends(oauth2_scheme), 
     db: Session = Depends(get_db)
 ):
     """
     一個依賴項，用於從 Authorization header 中的 Bearer token 解析出當前使用者。
+    回傳的是 security.UserSnapshot，而不是綁定在會話上的 User 物件。
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -33,14 +89,11 @@ def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
-        phone_number: str = payload.get("sub")
-        if phone_number is None:
-            raise credentials_exception
+        payload = security.decode_access_token(token)
     except JWTError:
         raise credentials_exception
     
-    user = crud.get_user_by_phone(db, phone_number=phone_number)
+    user = security.principal_from_claims(db, payload)
     if user is None:
         raise credentials_exception
     return user
@@ -73,18 +126,46 @@ def get_current_teacher_user(
     return current_user
 
 async def get_current_user_from_token(
-    token: str = Query(...), 
-    db: Session = Depends(get_db)
+    token: str = Query(...)
 ):
-    """一個專門給 WebSocket 用的依賴項，從查詢參數中獲取 token 並驗證使用者。"""
+    """
+    一個專門給 WebSocket 用的依賴項，從查詢參數中獲取 token 並驗證使用者。
+
+    它刻意不依賴 get_db：get_db 的會話會一直存活到 WebSocket 關閉為止，
+    200 個連線中的家長就會佔滿連線池。這裡改為在握手時開一個短暫的會話 (新版 Token 通常完全不需要查詢)，
+    解析出與會話分離的 UserSnapshot 後立即關閉，接收迴圈開始前就已經歸還連線。
+    """
     try:
-        payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
-        phone_number: str = payload.get("sub")
-        if phone_number is None:
-            return None
+        payload = security.decode_access_token(token)
     except JWTError:
         return None
     
-    user = crud.get_user_by_phone(db, phone_number=phone_number)
-    return user
+    return await run_in_threadpool(security.principal_from_claims_with_short_session, payload)
+
+async def get_current_user_for_stream(
+    token: Optional[str] = Query(None),
+    bearer_token: Optional[str] = Depends(optional_oauth2_scheme),
+):
+    """
+    給 Server-Sent Events 端點用的依賴項。
+
+    瀏覽器的 EventSource 無法自訂標頭，所以 token 可以放在查詢參數，也可以照常使用 Authorization 標頭。
+    與 WebSocket 版本一樣只開短暫的會話解析身分，串流期間不佔用連線池。
+    """
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="無法驗證憑證",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    raw_token = bearer_token or token
+    if not raw_token:
+        raise credentials_exception
+    try:
+        payload = security.decode_access_token(raw_token)
+    except JWTError:
+        raise credentials_exception
 
+    user = await run_in_threadpool(security.principal_from_claims_with_short_session, payload)
+    if user is None:
+        raise credentials_exception
+    return user
@@ -0,0 +1,187 @@
+# 檔案路徑: app/events.py
+# 即時事件：在交易 commit 成功「之後」才送到 WebSocket 房間。
+#
+# crud 函式在 commit 前呼叫 publish_after_commit() 把事件暫存在 session.info；
+# Session 的 after_commit 事件觸發時才真正發布，rollback 時直接丟棄，
+# 所以客戶端不會看到一筆最後沒有寫進資料庫的狀態變更。
+#
+# 高頻率的 ETA 更新則交給 EtaCoalescer，依時間窗合併後才扇出。
+
+import threading
+from datetime import datetime, timezone
+from functools import partial
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import models
+from .core import metrics
+from .core.config import settings
+from .core.logging_config import get_logger
+from .websocket import manager
+
+logger = get_logger(__name__)
+
+eta_updates_total = metrics.counter("ws_eta_updates_total", "送進 ETA 合併器的更新數")
+eta_collapsed_total = metrics.counter("ws_eta_collapsed_total", "在時間窗內被較新的一筆取代、沒有送出的 ETA 更新數")
+eta_frames_total = metrics.counter("ws_eta_frames_total", "ETA 合併器實際送出的訊框數 (每個房間每輪一個)")
+
+_PENDING_KEY = "after_commit_callbacks"
+
+def institution_room(institution_id: int) -> str:
+    return f"institution:{institution_id}"
+
+def class_room(class_id: int) -> str:
+    return f"class:{class_id}"
+
+def run_after_commit(db: Session, callback: Callable[[], None]) -> None:
+    """登記一個要在這個 session 下一次 commit 成功後執行的回呼 (rollback 時丟棄)。回呼不可以再使用這個 session。"""
+    db.info.setdefault(_PENDING_KEY, []).append(callback)
+
+def publish_after_commit(db: Session, room_id: str, message: dict) -> None:
+    """登記一則要在這個 session 下一次 commit 成功後送出的訊息。"""
+    run_after_commit(db, partial(manager.publish_threadsafe, message, room_id))
+
+def student_status_event(
+    student: models.Student,
+    old_status: models.StudentStatus,
+    new_status: models.StudentStatus,
+    operator_id: Optional[int],
+) -> dict:
+    return {
+        "type": "student_status",
+        "student_id": student.id,
+        "class_id": student.class_id,
+        "old": old_status.value,
+        "new": new_status.value,
+        "operator": operator_id,
+        "ts": _utc_timestamp(),
+    }
+
+def publish_student_status(
+    db: Session,
+    *,
+    student: models.Student,
+    institution_id: int,
+    old_status: models.StudentStatus,
+    new_status: models.StudentStatus,
+    operator_id: Optional[int],
+) -> None:
+    """學生狀態變更：commit 後同時送到機構房間與班級房間。"""
+    message = student_status_event(student, old_status, new_status, operator_id)
+    publish_after_commit(db, institution_room(institution_id), message)
+    publish_after_commit(db, class_room(student.class_id), message)
+
+def _utc_timestamp() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+
+class EtaCoalescer:
+    """
+    ETA 更新的合併器。
+
+    以 (學生, 目標房間) 為鍵，只保留時間窗內最新的一筆；時間窗結束時，
+    把同一個房間的所有學生合併成一個 {"type": "eta", "updates": [...], "collapsed": n} 訊框送出。
+    時間窗從第一筆更新開始計時，沒有更新時不會有任何計時器在跑。
+    submit() 可以從 threadpool 或事件迴圈中呼叫。
+    """
+    def __init__(self, window_seconds: float):
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        # (student_id, rooms) -> (update, 被取代的筆數)
+        self._pending: Dict[Tuple[int, Tuple[str, ...]], Tuple[dict, int]] = {}
+        self._flush_scheduled = False
+        self.submitted = 0
+        self.collapsed = 0
+        self.frames = 0
+
+    def submit(self, student_id: int, rooms: Tuple[str, ...], update: dict) -> None:
+        loop = manager.loop
+        if loop is None or loop.is_closed():
+            logger.debug("WebSocket manager 尚未啟動，略過學生 %s 的 ETA 更新。", student_id)
+            return
+        key = (student_id, rooms)
+        eta_updates_total.inc()
+        with self._lock:
+            self.submitted += 1
+            previous = self._pending.get(key)
+            collapsed = 0
+            if previous is not None:
+                collapsed = previous[1] + 1
+                self.collapsed += 1
+            self._pending[key] = (update, collapsed)
+            schedule = not self._flush_scheduled
+            self._flush_scheduled = True
+        if previous is not None:
+            eta_collapsed_total.inc()
+        if schedule:
+            loop.call_soon_threadsafe(loop.call_later, self.window_seconds, self._flush)
+
+    def _flush(self) -> None:
+        """在事件迴圈中執行：每個房間送出一個合併後的訊框。"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flush_scheduled = False
+
+        frames: Dict[str, dict] = {}
+        for (_student_id, rooms), (update, collapsed) in pending.items():
+            for room_id in rooms:
+                frame = frames.get(room_id)
+                if frame is None:
+                    frame = frames[room_id] = {"type": "eta", "updates": [], "collapsed": 0, "ts": _utc_timestamp()}
+                frame["updates"].append(update)
+                frame["collapsed"] += collapsed
+
+        for room_id, frame in frames.items():
+            manager.publish_threadsafe(frame, room_id)
+        with self._lock:
+            self.frames += len(frames)
+        eta_frames_total.inc(len(frames))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "window_seconds": self.window_seconds,
+                "pending": len(self._pending),
+                "submitted": self.submitted,
+                "collapsed": self.collapsed,
+                "frames": self.frames,
+            }
+
+eta_coalescer = EtaCoalescer(settings.WS_ETA_COALESCE_WINDOW_SECONDS)
+
+def eta_update(*, student_id: int, class_id: Optional[int], minutes_remaining: int, parent_id: int) -> dict:
+    return {
+        "student_id": student_id,
+        "class_id": class_id,
+        "minutes_remaining": minutes_remaining,
+        "parent": parent_id,
+        "ts": _utc_timestamp(),
+    }
+
+def publish_eta(*, student: models.Student, institution_id: int, parent_id: int, minutes_remaining: int) -> None:
+    """家長的 ETA 更新：經過合併後送到機構與班級房間。"""
+    update = eta_update(
+        student_id=student.id, class_id=student.class_id, minutes_remaining=minutes_remaining, parent_id=parent_id
+    )
+    eta_coalescer.submit(student.id, (institution_room(institution_id), class_room(student.class_id)), update)
+
+# --- Session 事件 (對所有 Session，包含 AsyncSession 底下的同步 Session) ---
+
+@event.listens_for(Session, "after_commit")
+def _flush_pending_events(session: Session) -> None:
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    for callback in pending:
+        try:
+            callback()
+        except Exception:
+            # 資料已經 commit，單一回呼失敗不應影響其他事件，也不應讓請求失敗
+            logger.exception("commit 後的回呼執行失敗")
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending_events(session: Session) -> None:
+    dropped = session.info.pop(_PENDING_KEY, None)
+    if dropped:
+        logger.info("交易已 rollback，捨棄 %d 個尚未執行的 commit 後回呼。", len(dropped))
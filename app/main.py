@@ -3,11 +3,20 @@
 # --- 導入 ---
 from app.core import logging_config
 
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse # <--- 新的導入
+import secrets
+from contextlib import asynccontextmanager
 
+from fastapi import FastAPI, Header, HTTPException, status
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+
+from .core import metrics, sql_monitor
+from .core.config import settings
+from .core.request_metrics import RequestMetricsMiddleware
 from .database import engine, Base
-from .routers import auth, users, admin, teachers
+from .push import dispatcher as push_dispatcher
+from .routers import auth, users, admin, teachers, websockets, streams, dashboard
+from .websocket import manager as ws_manager
 
 # vvv --- 【新的導入】 --- vvv
 from .core.logging_config import get_logger
@@ -17,38 +26,29 @@ from .core.logging_config import get_logger
 logger = get_logger(__name__)
 # ^^^ --- 【初始化 logger】 --- ^^^
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 每個 worker 啟動時訂閱 WebSocket broker，關閉時取消訂閱
+    await ws_manager.start()
+    # 推播派送器的工作執行緒；啟用外寄匣時會先查詢資料庫補送，所以放到 threadpool 執行
+    await run_in_threadpool(push_dispatcher.start)
+    yield
+    await ws_manager.stop()
+    await run_in_threadpool(push_dispatcher.stop)
+
 app = FastAPI(
     title="校園接送系統 API",
     description="一個專業的、符合多租戶架構的安親班管理系統。",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan,
 )
 
 # vvv --- 【添加全域異常處理中介軟體】 --- vvv
-@app.middleware("http" )
-async def global_exception_handler(request: Request, call_next):
-    """
-    全域異常捕獲中介軟體。
-    用於捕獲所有未被處理的異常，記錄 500 錯誤，並返回一個標準的 JSON 響應。
-    """
-    try:
-        # 將請求傳遞給後續的處理程序 (API 路由)
-        response = await call_next(request)
-        return response
-    except Exception as e:
-        # 捕獲到了未被處理的異常！
-        # 這是一個 500 Internal Server Error
-        
-        # 使用 logger.error 記錄完整的錯誤資訊和堆疊追蹤
-        logger.error(
-            f"發生未處理的伺服器內部錯誤 (500): {e}",
-            exc_info=True # exc_info=True 會自動附加堆疊追蹤資訊
-        )
-        
-        # 向客戶端返回一個標準的、安全的 500 錯誤響應
-        return JSONResponse(
-            status_code=500,
-            content={"detail": "Internal Server Error"},
-        )
+# 純 ASGI 中介軟體：500 錯誤處理、請求上下文 (X-Request-ID)、每個路由的延遲與狀態碼指標
+app.add_middleware(RequestMetricsMiddleware)
+# cursor 計時事件：每個請求的 SQL 統計 (開發 / 測試用)、慢查詢日誌與追蹤的 db span 共用
+if settings.SQL_MONITOR_ENABLED or settings.SLOW_QUERY_THRESHOLD_MS > 0 or settings.TRACE_SAMPLE_RATE > 0:
+    sql_monitor.install()
 # ^^^ --- 【添加全域異常處理中介軟體】 --- ^^^
 
 
@@ -57,6 +57,9 @@ app.include_router(auth.router, prefix="/api/v1/auth", tags=["1. 認證 (Authent
 app.include_router(users.router, prefix="/api/v1/users", tags=["2. 使用者 (Users)"])
 app.include_router(admin.router, prefix="/api/v1/admin", tags=["3. 機構管理 (Admin)"])
 app.include_router(teachers.router, prefix="/api/v1/teachers", tags=["4. 教職員 (Teachers)"]) 
+app.include_router(websockets.router, prefix="/ws", tags=["5. 即時通訊 (WebSocket)"])
+app.include_router(streams.router, prefix="/api/v1/stream", tags=["6. 即時串流 (Server-Sent Events)"])
+app.include_router(dashboard.router, prefix="/api/v1/dashboard", tags=["7. 儀表板 (Dashboard)"])
 
 # --- 根端點 (保持不變) ---
 @app.get("/", tags=["Root"])
@@ -66,3 +69,17 @@ def read_root():
 @app.get("/health", tags=["Root"])
 def health_check():
     return {"status": "ok"}
+
+@app.get("/metrics", tags=["Root"], include_in_schema=False)
+def prometheus_metrics(authorization: str = Header("")):
+    """
+    Prometheus 抓取用的端點 (文字格式)，內容是本 worker 的所有指標。
+    需要帶上 Authorization: Bearer <METRICS_TOKEN>；沒有設定權杖時預設關閉 (404)，
+    除非明確設定 METRICS_PUBLIC=True。
+    """
+    if not settings.METRICS_TOKEN:
+        if not settings.METRICS_PUBLIC:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    elif not secrets.compare_digest(authorization, f"Bearer {settings.METRICS_TOKEN}"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="無效的指標存取權杖")
+    return PlainTextResponse(metrics.render_prometheus(), media_type=metrics.PROMETHEUS_CONTENT_TYPE)
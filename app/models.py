@@ -60,6 +60,8 @@ class User(Base):
     full_name = Column(String, nullable=False)
     role = Column(Enum(UserRole), nullable=False)
     status = Column(Enum(UserStatus), default=UserStatus.active, nullable=False)
+    # Token 版本號：每次修改密碼 (或需要強制登出) 時遞增，舊版本的 Token 會立即失效
+    token_version = Column(Integer, default=0, server_default="0", nullable=False)
     
     institution_id = Column(Integer, ForeignKey("institutions.id"), nullable=True) # 家長在啟用前可能沒有機構
     
@@ -134,3 +136,25 @@ class PickupPrediction(Base):
     student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
     reason = Column(String, default="高頻率常客")
     student = relationship("Student")
+
+class PushOutbox(Base):
+    """
+    推播外寄匣 (選用，見 settings.PUSH_OUTBOX_ENABLED)。
+
+    推播與觸發它的狀態變更寫在同一個交易裡；commit 後才交給背景的推播派送器，
+    送出後標記為 sent。排入佇列的 worker 會先「認領」推播 (status=sending, claimed_at)；
+    認領超過 PUSH_OUTBOX_CLAIM_SECONDS 仍沒有結果 (例如 worker 已經停止) 的，才會被其他 worker 重新認領補送。
+    """
+    __tablename__ = "push_outbox"
+    id = Column(Integer, primary_key=True, index=True)
+    recipient_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    title = Column(String, nullable=False)
+    body = Column(String, nullable=False)
+    dedup_key = Column(String(64), unique=True, nullable=False)
+    status = Column(String, default="pending", nullable=False, index=True) # pending, sending, sent, failed, suppressed (被節流規則擋下)
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    sent_at = Column(DateTime, nullable=True)
+    claimed_at = Column(DateTime, nullable=True) # 最後一次被 worker 認領 (或延長認領) 的時間
+
@@ -0,0 +1,702 @@
+# 檔案路徑: app/push.py
+# 推播派送：請求執行緒只負責把推播放進佇列，背景的執行緒池依供應商的批次大小送出，
+# 並處理重試、指數退避與去重。
+#
+# 排入佇列前先經過 PushThrottle：依狀態變更的規則，對每位收件人做內容去重與 token bucket 節流，
+# 避免學生狀態來回切換時，家長在一分鐘內收到好幾則推播。
+#
+# 啟用 PUSH_OUTBOX_ENABLED 時，推播先寫入 push_outbox 資料表 (與觸發它的狀態變更同一個交易)，
+# commit 後才排入佇列；送出後標記為 sent。寫入時就由這個 worker 認領 (status=sending, claimed_at)，
+# 認領過期 (PUSH_OUTBOX_CLAIM_SECONDS) 仍沒有結果的，才由任一 worker 以單一 UPDATE ... RETURNING 重新認領補送，
+# 所以多個 worker 不會把同一則推播各送一次。
+
+import hashlib
+import heapq
+import itertools
+import queue
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import database, events, models
+from .core import metrics
+from .core.cache import TTLCache
+from .core.config import settings
+from .core.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+enqueued_total = metrics.counter("push_enqueued_total", "排入推播佇列的訊息數")
+deduplicated_total = metrics.counter("push_deduplicated_total", "因為 dedup_key 重複而略過的推播數")
+dropped_total = metrics.counter("push_dropped_total", "因為佇列已滿而沒有排入的推播數")
+sent_total = metrics.counter("push_sent_total", "供應商確認送達的推播數")
+failed_total = metrics.counter(
+    "push_failed_total",
+    "放棄送出的推播數；reason=permanent 表示供應商拒絕，exhausted 表示重試次數用完",
+    labelnames=("reason",),
+)
+retries_total = metrics.counter("push_retries_total", "排入重試的次數")
+batch_size_histogram = metrics.histogram(
+    "push_batch_size",
+    "每次呼叫供應商的批次大小",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+delivery_latency_seconds = metrics.histogram(
+    "push_delivery_latency_seconds",
+    "從排入佇列到供應商確認送達的時間 (包含重試)",
+)
+suppressed_total = metrics.counter(
+    "push_suppressed_total",
+    "被節流規則擋下的推播數；reason=muted / duplicate_content / rate_limited",
+    labelnames=("reason",),
+)
+queue_depth_gauge = metrics.gauge("push_queue_depth", "推播佇列中等待送出的訊息數 (不含等待重試的)")
+
+# ===================================================================
+# 訊息與供應商
+# ===================================================================
+
+@dataclass
+class PushMessage:
+    recipient_id: int
+    title: str
+    body: str
+    dedup_key: str
+    # 套用哪一條節流規則，例如 "READY_FOR_PICKUP->HOMEWORK_PENDING"；None 表示使用預設規則
+    category: Optional[str] = None
+    outbox_id: Optional[int] = None
+    attempts: int = 0
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+def make_content_key(recipient_id: int, title: str, body: str) -> str:
+    """只看收件人與內容的雜湊，用於內容去重時間窗。"""
+    return make_dedup_key(recipient_id, title, body)
+
+def make_dedup_key(recipient_id: int, title: str, body: str, event_key: str = "") -> str:
+    """同一個事件送給同一位收件人的推播只會有一個 key；event_key 用來區分內容相同但不同次的事件。"""
+    raw = f"{recipient_id}\x1f{title}\x1f{body}\x1f{event_key}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class PushSendError(Exception):
+    """供應商回報的單則推播錯誤。retryable=False 表示不應重試 (例如裝置 token 已失效)。"""
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+class PushProvider(ABC):
+    """推播供應商的介面。send_batch 回傳與 messages 對應的錯誤列表 (None 表示成功)；拋出例外視為整批可重試。"""
+    name = "base"
+    max_batch_size = 100
+
+    @abstractmethod
+    def send_batch(self, messages: Sequence[PushMessage]) -> List[Optional[PushSendError]]:
+        ...
+
+class LoggingPushProvider(PushProvider):
+    """開發用：只把推播寫進日誌。"""
+    name = "log"
+    max_batch_size = 500
+
+    def send_batch(self, messages: Sequence[PushMessage]) -> List[Optional[PushSendError]]:
+        for message in messages:
+            logger.debug("模擬推播 -> 使用者 %s: %s / %s", message.recipient_id, message.title, message.body)
+        logger.info("模擬送出 %d 則推播。", len(messages))
+        return [None] * len(messages)
+
+class FakePushProvider(PushProvider):
+    """
+    離線測試用的假供應商：每批固定延遲，並依機率回傳可重試或永久性的錯誤。
+    送達的訊息會記錄從排入佇列到送達的延遲，供基準測試計算百分位數。
+    """
+    name = "fake"
+
+    def __init__(
+        self,
+        latency_seconds: float = 0.05,
+        failure_rate: float = 0.0,
+        permanent_failure_rate: float = 0.0,
+        max_batch_size: int = 500,
+        seed: Optional[int] = None,
+    ):
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self.permanent_failure_rate = permanent_failure_rate
+        self.max_batch_size = max_batch_size
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.delivered = 0
+        self.latencies: List[float] = []
+
+    def send_batch(self, messages: Sequence[PushMessage]) -> List[Optional[PushSendError]]:
+        time.sleep(self.latency_seconds)
+        now = time.monotonic()
+        results: List[Optional[PushSendError]] = []
+        delivered_latencies = []
+        with self._lock:
+            for message in messages:
+                roll = self._random.random()
+                if roll < self.permanent_failure_rate:
+                    results.append(PushSendError("invalid device token", retryable=False))
+                elif roll < self.permanent_failure_rate + self.failure_rate:
+                    results.append(PushSendError("provider unavailable"))
+                else:
+                    results.append(None)
+                    delivered_latencies.append(now - message.enqueued_at)
+            self.batches += 1
+            self.delivered += len(delivered_latencies)
+            self.latencies.extend(delivered_latencies)
+        return results
+
+def create_provider() -> PushProvider:
+    if settings.PUSH_PROVIDER == "log":
+        return LoggingPushProvider()
+    if settings.PUSH_PROVIDER == "fake":
+        return FakePushProvider()
+    raise ValueError(f"未知的 PUSH_PROVIDER: {settings.PUSH_PROVIDER}")
+
+# ===================================================================
+# 節流
+# ===================================================================
+
+RULE_ALWAYS = "always"
+RULE_LIMITED = "limited"
+RULE_MUTE = "mute"
+
+class PushThrottle:
+    """
+    排入佇列前的節流，依訊息的 category 找出規則：
+
+    - "mute"：一律不送。
+    - "limited" (預設)：相同收件人、相同內容在 content_dedup_seconds 內只送一次；
+      通過後再向收件人的 token bucket 取一個 token，取不到就不送。
+    - "always"：不受上述限制 (例如接送完成這種家長一定要知道的事)，但仍會登記內容，
+      讓緊接著的同內容推播被去重。
+
+    規則鍵為 "舊狀態->新狀態"，依序比對 "舊->新"、"*->新"、"舊->*"、"*->*"。
+
+    token bucket 與內容去重的狀態只存在這個行程的記憶體中：多 worker 部署時每個 worker 各自計算，
+    同一位收件人的上限最多是設定值乘以 worker 數 (見 config.py 的 PUSH_RATE_LIMIT_* 說明)。
+    """
+    def __init__(
+        self,
+        burst: int = settings.PUSH_RATE_LIMIT_BURST,
+        per_minute: float = settings.PUSH_RATE_LIMIT_PER_MINUTE,
+        content_dedup_seconds: float = settings.PUSH_CONTENT_DEDUP_SECONDS,
+        rules: Optional[Dict[str, str]] = None,
+        max_recipients: int = settings.PUSH_THROTTLE_MAX_RECIPIENTS,
+    ):
+        self.burst = burst
+        self.refill_per_second = per_minute / 60
+        self.content_dedup_seconds = content_dedup_seconds
+        self.rules = dict(settings.PUSH_TRANSITION_RULES if rules is None else rules)
+        for key, rule in self.rules.items():
+            if rule not in (RULE_ALWAYS, RULE_LIMITED, RULE_MUTE):
+                raise ValueError(f"推播規則 {key} 的值 {rule} 無效")
+        self._lock = threading.Lock()
+        # 收件人 -> (剩餘 token, 上次更新時間)；閒置到 bucket 補滿後就不需要記住
+        refill_seconds = burst / self.refill_per_second if self.refill_per_second > 0 else 3600
+        self._buckets = TTLCache(maxsize=max_recipients, ttl=max(refill_seconds, 1))
+        self._recent_content = TTLCache(maxsize=max_recipients, ttl=max(content_dedup_seconds, 1))
+        self.suppressed = {"muted": 0, "duplicate_content": 0, "rate_limited": 0}
+
+    def rule_for(self, category: Optional[str]) -> str:
+        if not category or "->" not in category:
+            return self.rules.get("*->*", RULE_LIMITED)
+        old, new = category.split("->", 1)
+        for key in (category, f"*->{new}", f"{old}->*", "*->*"):
+            rule = self.rules.get(key)
+            if rule is not None:
+                return rule
+        return RULE_LIMITED
+
+    def admit(self, messages: Iterable[PushMessage]) -> List[PushMessage]:
+        """回傳可以送出的訊息；被擋下的只計數，不會排入。"""
+        admitted = []
+        for message in messages:
+            reason = self._check(message)
+            if reason is None:
+                admitted.append(message)
+                continue
+            with self._lock:
+                self.suppressed[reason] += 1
+            suppressed_total.inc(reason=reason)
+            logger.info("推播被節流規則擋下 (使用者 %s, %s, 規則 %s): %s", message.recipient_id, reason, message.category, message.title)
+        return admitted
+
+    def _check(self, message: PushMessage) -> Optional[str]:
+        rule = self.rule_for(message.category)
+        if rule == RULE_MUTE:
+            return "muted"
+        content_key = make_content_key(message.recipient_id, message.title, message.body)
+        if rule == RULE_ALWAYS:
+            self._recent_content.set(content_key, True, ttl=self.content_dedup_seconds)
+            return None
+        if self.content_dedup_seconds > 0 and self._recent_content.get(content_key) is not None:
+            return "duplicate_content"
+        if not self._take_token(message.recipient_id):
+            return "rate_limited"
+        self._recent_content.set(content_key, True, ttl=self.content_dedup_seconds)
+        return None
+
+    def _take_token(self, recipient_id: int) -> bool:
+        if self.burst <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            state = self._buckets.get(recipient_id)
+            if state is None:
+                tokens = float(self.burst)
+            else:
+                tokens, updated_at = state
+                tokens = min(self.burst, tokens + (now - updated_at) * self.refill_per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets.set(recipient_id, (tokens, now))
+        return allowed
+
+    def stats(self) -> dict:
+        with self._lock:
+            suppressed = dict(self.suppressed)
+        return {
+            "scope": "per_worker",
+            "burst": self.burst,
+            "per_minute": self.refill_per_second * 60,
+            "content_dedup_seconds": self.content_dedup_seconds,
+            "rules": self.rules,
+            "tracked_recipients": len(self._buckets),
+            "suppressed": suppressed,
+        }
+
+# ===================================================================
+# 派送器
+# ===================================================================
+
+@dataclass
+class _OutboxUpdate:
+    """一批推播送出後要寫回外寄匣的結果。"""
+    sent_at: datetime
+    sent_ids: List[int]
+    retrying: List[tuple]   # (outbox_id, attempts)
+    failed: List[tuple]     # (outbox_id, attempts, last_error)
+
+class PushDispatcher:
+    """
+    背景推播派送器。
+
+    - submit() 不會阻塞：去重後放進有界佇列就返回。
+    - 每個工作執行緒取出第一則後，最多再等 batch_wait_seconds 湊滿一批 (不超過供應商上限)。
+    - 可重試的錯誤以「指數退避 + 隨機抖動」排入重試；超過 max_attempts 或永久性錯誤就放棄。
+    - dedup_key 在 dedup_ttl 秒內只會被接受一次，避免重複排入或重啟補送造成重複推播。
+    - 新的推播在排入前先經過 throttle (PushThrottle)，與交易綁定時在 commit 之後才檢查；
+      外寄匣補送的推播已經通過過，不會再檢查。
+    - 送出結果寫回外寄匣失敗時保留在記憶體中，由工作執行緒退避後依序重寫，
+      避免已經送出的推播一直停在 sending、在認領過期或 dedup_ttl 之後被補送第二次。
+    """
+    def __init__(
+        self,
+        provider: Optional[PushProvider] = None,
+        workers: int = settings.PUSH_WORKERS,
+        queue_size: int = settings.PUSH_QUEUE_SIZE,
+        batch_size: int = settings.PUSH_BATCH_SIZE,
+        batch_wait_seconds: float = settings.PUSH_BATCH_WAIT_SECONDS,
+        max_attempts: int = settings.PUSH_MAX_ATTEMPTS,
+        retry_base_seconds: float = settings.PUSH_RETRY_BASE_SECONDS,
+        retry_max_seconds: float = settings.PUSH_RETRY_MAX_SECONDS,
+        dedup_ttl_seconds: float = settings.PUSH_DEDUP_TTL_SECONDS,
+        outbox_enabled: bool = settings.PUSH_OUTBOX_ENABLED,
+        outbox_claim_seconds: float = settings.PUSH_OUTBOX_CLAIM_SECONDS,
+        throttle: Optional[PushThrottle] = None,
+    ):
+        self.provider = provider if provider is not None else create_provider()
+        self.throttle = throttle if throttle is not None else PushThrottle()
+        self.workers = workers
+        self.batch_size = max(1, min(batch_size, self.provider.max_batch_size))
+        self.batch_wait_seconds = batch_wait_seconds
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.outbox_enabled = outbox_enabled
+        self.outbox_claim_seconds = outbox_claim_seconds
+
+        self._queue: "queue.Queue[PushMessage]" = queue.Queue(maxsize=queue_size)
+        self._recent = TTLCache(maxsize=max(queue_size * 10, 1000), ttl=dedup_ttl_seconds)
+        # 等待重試的訊息：(到期時間, 序號, 訊息)
+        self._retry_heap: list = []
+        self._retry_lock = threading.Lock()
+        self._retry_counter = itertools.count()
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._recovery_lock = threading.Lock()
+        self._next_recovery = 0.0
+        # 還沒寫回外寄匣的送出結果 (_OutboxUpdate)，依發生順序重寫
+        self._unsaved_updates: deque = deque()
+        self._unsaved_lock = threading.Lock()
+        self._unsaved_flush_lock = threading.Lock()
+        self._unsaved_failures = 0
+        self._next_unsaved_flush = 0.0
+        self.stats_counters = {"enqueued": 0, "deduplicated": 0, "dropped": 0, "sent": 0, "failed": 0, "retries": 0, "batches": 0}
+
+    # --- 生命週期 ---
+
+    def start(self) -> None:
+        """啟動工作執行緒；啟用外寄匣時，先認領上次沒送完的推播重新排入。可以重複呼叫。"""
+        with self._start_lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f"push-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        if self.outbox_enabled:
+            self._recover_outbox_if_due()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """停止接受新工作，等待佇列送完 (最多 timeout 秒)。等待重試的訊息若有外寄匣，認領過期後會被補送。"""
+        self._stopping.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        self._threads = []
+        if self.outbox_enabled:
+            self._flush_outbox_updates(force=True)
+
+    # --- 排入 ---
+
+    def submit(self, messages: Iterable[PushMessage]) -> int:
+        """經過節流後把推播放進佇列並立即返回；回傳實際排入的則數。"""
+        return self._enqueue(self.throttle.admit(messages))
+
+    def _enqueue(self, messages: Iterable[PushMessage]) -> int:
+        if not self._threads:
+            self.start()
+        accepted = 0
+        for message in messages:
+            if self._recent.get(message.dedup_key) is not None:
+                self._count("deduplicated")
+                deduplicated_total.inc()
+                continue
+            self._recent.set(message.dedup_key, True)
+            try:
+                self._queue.put_nowait(message)
+            except queue.Full:
+                self._recent.invalidate(message.dedup_key)
+                self._count("dropped")
+                dropped_total.inc()
+                logger.warning("推播佇列已滿，略過給使用者 %s 的推播。", message.recipient_id)
+                continue
+            accepted += 1
+        if accepted:
+            self._count("enqueued", accepted)
+            enqueued_total.inc(accepted)
+            queue_depth_gauge.set(self._queue.qsize())
+        return accepted
+
+    def submit_after_commit(self, db: Session, messages: List[PushMessage]) -> None:
+        """
+        與資料庫交易綁定的排入：commit 成功後才經過節流並排入佇列，rollback 時什麼都不送，也不會消耗節流額度。
+        啟用外寄匣時，在這個交易中寫入 push_outbox；commit 後才經過節流，被擋下的標記為 suppressed。
+        """
+        if not messages:
+            return
+        if not self.outbox_enabled:
+            events.run_after_commit(db, lambda: self.submit(messages))
+            return
+        # dedup_key 在外寄匣中是唯一的：已經登記過的事件直接略過，不要讓整個交易因為重複而失敗
+        keys = [message.dedup_key for message in messages]
+        existing = {
+            key for (key,) in db.query(models.PushOutbox.dedup_key).filter(models.PushOutbox.dedup_key.in_(keys))
+        }
+        if existing:
+            self._count("deduplicated", len(existing))
+            deduplicated_total.inc(len(existing))
+            messages = [message for message in messages if message.dedup_key not in existing]
+            if not messages:
+                return
+        # 寫入時就由這個 worker 認領：commit 後直接排入佇列，其他 worker 在認領過期前不會補送
+        now = datetime.utcnow()
+        rows = [
+            models.PushOutbox(
+                recipient_id=message.recipient_id,
+                title=message.title,
+                body=message.body,
+                dedup_key=message.dedup_key,
+                status="sending",
+                claimed_at=now,
+            )
+            for message in messages
+        ]
+        db.add_all(rows)
+        db.flush()
+        for message, row in zip(messages, rows):
+            message.outbox_id = row.id
+        events.run_after_commit(db, lambda: self._submit_outbox(messages))
+
+    def _submit_outbox(self, messages: List[PushMessage]) -> int:
+        """外寄匣推播 commit 後的節流與排入。"""
+        admitted = self.throttle.admit(messages)
+        if len(admitted) < len(messages):
+            admitted_ids = {message.outbox_id for message in admitted}
+            self._mark_outbox_suppressed([message.outbox_id for message in messages if message.outbox_id not in admitted_ids])
+        return self._enqueue(admitted)
+
+    def _mark_outbox_suppressed(self, outbox_ids: List[int]) -> None:
+        try:
+            with database.SessionLocal() as db:
+                db.query(models.PushOutbox).filter(models.PushOutbox.id.in_(outbox_ids)).update(
+                    {"status": "suppressed", "claimed_at": None}, synchronize_session=False
+                )
+                db.commit()
+        except Exception:
+            # 沒標記到的會在認領過期後被補送 (補送不再經過節流)
+            logger.exception("標記被節流的外寄匣推播失敗")
+
+    def recover_outbox(self, limit: Optional[int] = None) -> int:
+        """
+        認領外寄匣中尚未送出的推播並重新排入佇列：pending 的，以及 sending 但認領已過期的。
+        認領是單一個 UPDATE ... RETURNING (PostgreSQL 上搭配 FOR UPDATE SKIP LOCKED)，
+        多個 worker 同時補送時，每一則只會被其中一個認領。
+        """
+        limit = limit or self._queue.maxsize - self._queue.qsize()
+        if limit <= 0:
+            return 0
+        outbox = models.PushOutbox
+        now = datetime.utcnow()
+        claimable = or_(
+            outbox.status == "pending",
+            and_(outbox.status == "sending", outbox.claimed_at < now - timedelta(seconds=self.outbox_claim_seconds)),
+        )
+        candidates = (
+            select(outbox.id).where(claimable).order_by(outbox.id).limit(limit).with_for_update(skip_locked=True)
+        )
+        with database.SessionLocal() as db:
+            # 外層再檢查一次 claimable：另一個交易搶先認領並 commit 時，這一列會被略過
+            rows = db.execute(
+                update(outbox)
+                .where(outbox.id.in_(candidates), claimable)
+                .values(status="sending", claimed_at=now)
+                .returning(outbox.id, outbox.recipient_id, outbox.title, outbox.body, outbox.dedup_key, outbox.attempts)
+                .execution_options(synchronize_session=False)
+            ).all()
+            db.commit()
+        messages = [
+            PushMessage(
+                recipient_id=row.recipient_id,
+                title=row.title,
+                body=row.body,
+                dedup_key=row.dedup_key,
+                outbox_id=row.id,
+                attempts=row.attempts,
+            )
+            for row in sorted(rows, key=lambda row: row.id)
+        ]
+        # 這個 worker 已經送出、只是還沒寫回外寄匣的不要再送一次 (認領會在寫回時結束)
+        unsaved = self._unsaved_sent_ids()
+        if unsaved:
+            messages = [message for message in messages if message.outbox_id not in unsaved]
+        if messages:
+            logger.info("從推播外寄匣認領並重新排入 %d 則推播。", len(messages))
+        return self._enqueue(messages)
+
+    def _recover_outbox_if_due(self) -> None:
+        """每隔半個認領租約補送一次，接手已經停止的 worker 留下的推播；同一時間只有一條執行緒執行。"""
+        if time.monotonic() < self._next_recovery or not self._recovery_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_recovery = time.monotonic() + self.outbox_claim_seconds / 2
+            self.recover_outbox()
+        except Exception:
+            logger.exception("補送推播外寄匣失敗")
+        finally:
+            self._recovery_lock.release()
+
+    # --- 工作執行緒 ---
+
+    def _worker(self) -> None:
+        while True:
+            self._release_due_retries()
+            if self.outbox_enabled:
+                self._flush_outbox_updates()
+                self._recover_outbox_if_due()
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.batch_wait_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            queue_depth_gauge.set(self._queue.qsize())
+            try:
+                self._send(batch)
+            except Exception:
+                logger.exception("處理推播批次時發生未預期的錯誤")
+
+    def _send(self, batch: List[PushMessage]) -> None:
+        batch_size_histogram.observe(len(batch))
+        self._count("batches")
+        try:
+            results = self.provider.send_batch(batch)
+        except Exception as e:
+            logger.warning("推播供應商呼叫失敗 (%d 則)，稍後重試: %s", len(batch), e)
+            results = [PushSendError(str(e))] * len(batch)
+
+        now = time.monotonic()
+        sent_ids, retrying, failed = [], [], []
+        for message, error in zip(batch, results):
+            if error is None:
+                delivery_latency_seconds.observe(now - message.enqueued_at)
+                if message.outbox_id is not None:
+                    sent_ids.append(message.outbox_id)
+                continue
+            message.attempts += 1
+            if error.retryable and message.attempts < self.max_attempts:
+                self._schedule_retry(message)
+                if message.outbox_id is not None:
+                    retrying.append(message)
+                continue
+            reason = "exhausted" if error.retryable else "permanent"
+            failed_total.inc(reason=reason)
+            logger.warning("放棄推播 (使用者 %s, %s, 已嘗試 %d 次): %s", message.recipient_id, reason, message.attempts, error)
+            failed.append((message, str(error)))
+
+        sent = len(batch) - sum(1 for error in results if error is not None)
+        self._count("sent", sent)
+        self._count("failed", len(failed))
+        sent_total.inc(sent)
+        if self.outbox_enabled:
+            self._update_outbox(sent_ids, retrying, failed)
+
+    def _schedule_retry(self, message: PushMessage) -> None:
+        # 指數退避 + full jitter：避免大量重試在同一瞬間打到供應商
+        ceiling = min(self.retry_max_seconds, self.retry_base_seconds * 2 ** (message.attempts - 1))
+        due = time.monotonic() + random.uniform(ceiling / 2, ceiling)
+        with self._retry_lock:
+            heapq.heappush(self._retry_heap, (due, next(self._retry_counter), message))
+        self._count("retries")
+        retries_total.inc()
+
+    def _release_due_retries(self) -> None:
+        now = time.monotonic()
+        with self._retry_lock:
+            while self._retry_heap and self._retry_heap[0][0] <= now:
+                _, _, message = heapq.heappop(self._retry_heap)
+                try:
+                    self._queue.put_nowait(message)
+                except queue.Full:
+                    # 佇列滿了就晚一點再試
+                    heapq.heappush(self._retry_heap, (now + self.retry_base_seconds, next(self._retry_counter), message))
+                    return
+
+    def _update_outbox(self, sent_ids: List[int], retrying: List[PushMessage], failed: list) -> None:
+        update = _OutboxUpdate(
+            sent_at=datetime.utcnow(),
+            sent_ids=list(sent_ids),
+            retrying=[(message.outbox_id, message.attempts) for message in retrying],
+            failed=[
+                (message.outbox_id, message.attempts, error[:500])
+                for message, error in failed
+                if message.outbox_id is not None
+            ],
+        )
+        with self._unsaved_lock:
+            self._unsaved_updates.append(update)
+        self._flush_outbox_updates()
+
+    def _flush_outbox_updates(self, force: bool = False) -> None:
+        """
+        依序把送出結果寫回外寄匣；失敗時留在記憶體中，以指數退避 (最多半個認領租約) 再試。
+        同一時間只有一條執行緒在寫，較舊的結果不會蓋掉較新的。
+        """
+        if not force and time.monotonic() < self._next_unsaved_flush:
+            return
+        if not self._unsaved_flush_lock.acquire(blocking=force):
+            return
+        try:
+            while True:
+                with self._unsaved_lock:
+                    if not self._unsaved_updates:
+                        return
+                    update = self._unsaved_updates[0]
+                try:
+                    self._write_outbox_update(update)
+                except Exception:
+                    self._unsaved_failures += 1
+                    delay = min(self.retry_base_seconds * 2 ** (self._unsaved_failures - 1), self.outbox_claim_seconds / 2)
+                    self._next_unsaved_flush = time.monotonic() + delay
+                    logger.exception("更新推播外寄匣狀態失敗，%.1f 秒後重試 (尚有 %d 批未寫回)", delay, len(self._unsaved_updates))
+                    return
+                with self._unsaved_lock:
+                    self._unsaved_updates.popleft()
+                self._unsaved_failures = 0
+                self._next_unsaved_flush = 0.0
+        finally:
+            self._unsaved_flush_lock.release()
+
+    def _write_outbox_update(self, update: "_OutboxUpdate") -> None:
+        with database.SessionLocal() as db:
+            if update.sent_ids:
+                db.query(models.PushOutbox).filter(models.PushOutbox.id.in_(update.sent_ids)).update(
+                    {"status": "sent", "sent_at": update.sent_at}, synchronize_session=False
+                )
+            # 等待重試的推播延長認領，避免在退避期間被其他 worker 當成沒人處理而重送
+            claimed_at = datetime.utcnow()
+            for outbox_id, attempts in update.retrying:
+                db.query(models.PushOutbox).filter(models.PushOutbox.id == outbox_id).update(
+                    {"attempts": attempts, "claimed_at": claimed_at}, synchronize_session=False
+                )
+            for outbox_id, attempts, error in update.failed:
+                db.query(models.PushOutbox).filter(models.PushOutbox.id == outbox_id).update(
+                    {"status": "failed", "attempts": attempts, "last_error": error},
+                    synchronize_session=False,
+                )
+            db.commit()
+
+    def _unsaved_sent_ids(self) -> set:
+        with self._unsaved_lock:
+            return {outbox_id for update in self._unsaved_updates for outbox_id in update.sent_ids}
+
+    # --- 統計 ---
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self.stats_counters[key] += amount
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            counters = dict(self.stats_counters)
+        with self._retry_lock:
+            waiting_retry = len(self._retry_heap)
+        return {
+            "provider": self.provider.name,
+            "workers": len(self._threads),
+            "batch_size": self.batch_size,
+            "queued": self._queue.qsize(),
+            "waiting_retry": waiting_retry,
+            "outbox_enabled": self.outbox_enabled,
+            "outbox_unsaved_batches": len(self._unsaved_updates),
+            **counters,
+            "throttle": self.throttle.stats(),
+        }
+
+dispatcher = PushDispatcher()
@@ -1,7 +1,8 @@
 # 檔案路徑: app/routers/admin.py
 # 版本：v2.1 - 重構為統一使用 security 模組的權限依賴項
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 from typing import List
 
@@ -9,7 +10,10 @@ import subprocess
 import sys
 from app.core.logging_config import get_logger
 
-from .. import crud, models, schemas, security
+from .. import crud, events, models, push, schemas, security
+from ..websocket import manager as ws_manager
+from ..core import db_pool, logging_config, metrics, profiling
+from ..core.slow_query import slow_query_log
 from ..dependencies import get_db
 
 # vvv--- 這是我們要修改的地方 ---vvv
@@ -32,7 +36,7 @@ def create_staff(
     staff_data: schemas.StaffCreate,
     db: Session = Depends(get_db),
     # 【修正】: 直接使用 security 模組中權威的依賴項
-    current_admin: models.User = Depends(security.get_current_active_admin)
+    current_admin: security.UserSnapshot = Depends(security.get_current_admin_principal)
 ):
     """
     由已登入的機構管理員，在自己所屬的機構下，建立一位新的教職員。
@@ -73,7 +77,7 @@ def create_class_in_institution(
     class_data: schemas.ClassCreate,
     db: Session = Depends(get_db),
     # 【修正】: 直接使用 security 模組中權威的依賴項
-    current_admin: models.User = Depends(security.get_current_active_admin)
+    current_admin: security.UserSnapshot = Depends(security.get_current_admin_principal)
 ):
     """
     由已登入的機構管理員，在自己所屬的機構下，建立一個新的班級。
@@ -97,7 +101,7 @@ def delete_user_by_admin(
     user_id: int,
     db: Session = Depends(get_db),
     # 【確認】: 這裡的用法是正確的
-    current_admin: models.User = Depends(security.get_current_active_admin)
+    current_admin: security.UserSnapshot = Depends(security.get_current_admin_principal)
 ):
     """【管理員】刪除任何使用者（家長、老師、其他管理員）。"""
     if current_admin.id == user_id:
@@ -184,6 +188,95 @@ def trigger_daily_check(
         )
 
 
+# --- 診斷端點 (Diagnostics) ---
+
+@router.get("/diagnostics/principal-cache", summary="查看身分快取的命中統計")
+def get_principal_cache_stats(
+    current_admin: security.UserSnapshot = Depends(security.get_current_platform_operator_principal)
+):
+    """回傳身分快取的大小、命中、未命中與淘汰次數，用於調整快取容量與 TTL。"""
+    return security.principal_cache.stats()
+
+@router.get("/diagnostics/token-cache", summary="查看 Token 驗證快取的命中統計")
+def get_token_cache_stats(
+    current_admin: security.UserSnapshot = Depends(security.get_current_platform_operator_principal)
+):
+    """回傳已驗證 Token claims 快取的統計數據。"""
+    return security.token_claims_cache.stats()
+
+@router.get("/diagnostics/metrics", summary="查看行程內的效能指標")
+def get_metrics_snapshot(
+    current_admin: security.UserSnapshot = Depends(security.get_current_platform_operator_principal)
+):
+    """回傳本 worker 的所有指標 (例如密碼雜湊的排隊時間與耗時直方圖)。"""
+    return metrics.snapshot()
+
+@router.get("/diagnostics/db-pool", summary="查看資料庫連線池的壓力狀況")
+def get_db_pool_stats(
+    current_admin: security.UserSnapshot = Depends(security.get_current_platform_operator_principal)
+):
+    """回傳本 worker 每個連線池的借出數、overflow 使用量、取得連線的等待時間與逾時次數。"""
+    return db_pool.pool_snapshot()
+
+@router.get("/diagnostics/websockets", summary="查看 WebSocket 連線與各房間的扇出延遲")
+def get_websocket_stats(
+    current_admin: security.UserSnapshot = Depends(security.get_current_platform_operator_principal)
+):
+    """回傳本 worker 的 WebSocket 連線數、每個房間的廣播次數與扇出延遲，以及 ETA 合併的統計。"""
+    return {**ws_manager.stats(), "eta_coalescer": events.eta_coalescer.stats()}
+
+@router.get("/diagnostics/logging", summary="查看非同步日誌佇列的長度與丟棄筆數")
+def get_logging_stats(
+    current_admin: security.UserSnapshot = Depends(security.get_current_platform_operator_principal)
+):
+    """日誌由背景執行緒寫入；佇列長期接近上限或 dropped 持續增加，表示磁碟或輸出跟不上。"""
+    return logging_config.pipeline_stats()
+
+@router.get("/diagnostics/push", summary="查看推播派送器的佇列與送達統計")
+def get_push_stats(
+    current_admin: security.UserSnapshot = Depends(security.get_current_platform_operator_principal)
+):
+    """回傳本 worker 推播佇列的長度、等待重試的則數，送達、失敗、重試與去重的累計次數，以及節流規則與被擋下的則數。"""
+    return push.dispatcher.stats()
+
+@router.get("/diagnostics/slow-queries", summary="查看最慢的 SQL 與其執行計畫")
+def get_slow_queries(
+    limit: int = Query(20, ge=1, le=200),
+    order_by: str = Query("total_ms", pattern="^(total_ms|max_ms|count)$"),
+    current_admin: security.UserSnapshot = Depends(security.get_current_platform_operator_principal)
+):
+    """回傳本 worker 超過 SLOW_QUERY_THRESHOLD_MS 的 SQL 前 N 名：次數、耗時、呼叫的函式、遮罩後的參數與 EXPLAIN 結果。"""
+    return {
+        "threshold_ms": slow_query_log.threshold_seconds * 1000,
+        "statements": slow_query_log.top(limit, order_by),
+    }
+
+@router.delete("/diagnostics/slow-queries", status_code=status.HTTP_204_NO_CONTENT, summary="清空慢查詢統計")
+def reset_slow_queries(
+    current_admin: security.UserSnapshot = Depends(security.get_current_platform_operator_principal)
+):
+    """調整索引或查詢之後清空，方便確認改善的效果。"""
+    slow_query_log.reset()
+
+@router.get("/diagnostics/profiles", summary="列出已儲存的請求分析結果")
+def list_request_profiles(
+    current_admin: security.UserSnapshot = Depends(security.get_current_platform_operator_principal)
+):
+    """在任何請求加上 X-Profile: 1 標頭 (並使用平台維運人員的 Token) 即可分析該請求，回應的 X-Profile-Id 就是這裡的 id。"""
+    return profiling.list_profiles()
+
+@router.get("/diagnostics/profiles/{profile_id}", summary="下載請求分析結果 (speedscope 格式)")
+def download_request_profile(
+    profile_id: str,
+    current_admin: security.UserSnapshot = Depends(security.get_current_platform_operator_principal)
+):
+    """下載的檔案可以直接拖進 https://www.speedscope.app 檢視。"""
+    path = profiling.profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="找不到這份分析結果")
+    return FileResponse(path, media_type="application/json", filename=path.name)
+
+
 # ... (在 admin.py 的末尾，臨時添加以下程式碼)
 
 @router.get("/test-500-error", summary="測試 500 內部伺服器錯誤")
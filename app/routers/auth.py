@@ -8,21 +8,22 @@ from sqlalchemy.orm import Session
 from datetime import timedelta
 
 from .. import crud, models, schemas, security
-from ..dependencies import get_db
+from ..dependencies import DBRunner, get_db_runner
 
 router = APIRouter()
 
 @router.post("/token", response_model=schemas.Token, summary="使用者登入獲取 Token")
-def login_for_access_token(
-    db: Session = Depends(get_db), 
+async def login_for_access_token(
+    db: DBRunner = Depends(get_db_runner),
     form_data: OAuth2PasswordRequestForm = Depends()
 ):
     """
     標準的 OAuth2 密碼流登入。
     - 使用者提供 username (這裡用手機號) 和 password。
     - 成功後返回 access_token。
+    - bcrypt 在 password_pool 中執行，等待期間不佔用 AnyIO 的執行緒。
     """
-    user = security.authenticate_user(db, phone_number=form_data.username, password=form_data.password)
+    user = await security.authenticate_user_async(db, phone_number=form_data.username, password=form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -31,17 +32,15 @@ def login_for_access_token(
         )
     
     access_token_expires = timedelta(minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = security.create_access_token(
-        data={"sub": user.phone_number}, expires_delta=access_token_expires
-    )
+    access_token = security.create_user_access_token(user, expires_delta=access_token_expires)
     return {"access_token": access_token, "token_type": "bearer"}
 
 
 # vvv--- 家長首次綁定學生API ---vvv
 @router.post("/activate-parent", response_model=schemas.UserOut, summary="家長啟用帳號")
-def activate_parent(
+async def activate_parent(
     activation_data: schemas.ParentActivation,
-    db: Session = Depends(get_db)
+    db: DBRunner = Depends(get_db_runner)
 ):
     """
     供家長首次使用時，啟用他們的 'invited' 帳號。
@@ -49,12 +48,20 @@ def activate_parent(
     家長需要提供他們的手機號、自訂的密碼，以及他們孩子的機構代碼和姓名，
     以驗證他們的身份。
     """
-    activated_user = crud.activate_parent_account(db, activation_data=activation_data)
-    
+    def _activate(session: Session, hashed_password: str) -> schemas.UserOut | None:
+        user = crud.activate_parent_account(session, activation_data=activation_data, hashed_password=hashed_password)
+        return schemas.UserOut.model_validate(user) if user else None
+
+    # 先確認資料相符再雜湊密碼，避免無效的嘗試也佔用 password_pool
+    activated_user = None
+    if await db.run(crud.get_parent_for_activation, activation_data):
+        hashed_password = await security.get_password_hash_async(activation_data.password)
+        activated_user = await db.run(_activate, hashed_password)
+
     if not activated_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="啟用失敗：手機號碼、機構代碼或學生姓名不匹配，或帳號非待啟用狀態。",
         )
-    
+
     return activated_user
\ No newline at end of file
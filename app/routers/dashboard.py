@@ -2,17 +2,17 @@ from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.orm import Session
 from typing import List, Optional
 
-from .. import crud, schemas, models
-from ..dependencies import get_db, get_current_user
+from .. import crud, schemas, models, security
+from ..dependencies import get_db_runner, DBRunner
 
 router = APIRouter()
 
 @router.get("/students", response_model=List[schemas.StudentOut], summary="獲取儀表板學生列表（動態篩選）")
-def get_dashboard_student_list(
+async def get_dashboard_student_list(
     teacher_id: Optional[int] = None,
     status: Optional[List[models.StudentStatus]] = Query(None), # 使用 Query 來接收多個同名參數
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    db: DBRunner = Depends(get_db_runner),
+    current_user: security.UserSnapshot = Depends(security.get_current_active_principal_async)
 ):
     """
     一個統一的 API，用於獲取儀表板所需的學生列表，支持靈活的篩選和排序。
@@ -27,6 +27,8 @@ def get_dashboard_student_list(
     allowed_roles = [models.UserRole.teacher, models.UserRole.receptionist, models.UserRole.admin]
     if current_user.role not in allowed_roles:
         raise HTTPException(status_code=403, detail="權限不足")
+    if current_user.institution_id is None:
+        raise HTTPException(status_code=400, detail="操作失敗：您的帳號未歸屬任何機構。")
 
     # --- 參數校驗與修正 ---
     # 如果是普通老師，強制只能查詢自己的班級
@@ -37,5 +39,10 @@ def get_dashboard_student_list(
         teacher_id = current_user.id
 
     # --- 呼叫核心查詢函式 ---
-    students = crud.get_dashboard_students(db, teacher_id=teacher_id, statuses=status)
-    return students
+    def _list(session: Session) -> List[schemas.StudentOut]:
+        students = crud.get_dashboard_students(
+            session, institution_id=current_user.institution_id, teacher_id=teacher_id, statuses=status
+        )
+        return [schemas.StudentOut.model_validate(s) for s in students]
+
+    return await db.run(_list)
@@ -0,0 +1,77 @@
+# 檔案路徑: app/routers/streams.py
+# Server-Sent Events：給無法使用 WebSocket (被代理伺服器擋掉) 的唯讀看板使用。
+# 與 WebSocket 共用 ConnectionManager 的房間與扇出，不會為每個客戶端輪詢資料庫。
+
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+
+from ..security import UserSnapshot
+from ..dependencies import get_current_user_for_stream
+from ..websocket import ConnectionLimitExceeded, manager
+from .websockets import can_join_room, snapshot_provider
+
+router = APIRouter()
+
+# 瀏覽器斷線後多久重連 (毫秒)，在串流開頭告訴 EventSource
+RECONNECT_DELAY_MS = 3000
+
+def _parse_event_id(value: Optional[str]) -> Optional[int]:
+    if value is None or not value.strip().isdigit():
+        return None
+    return int(value)
+
+@router.get("/{room_id}", summary="以 Server-Sent Events 訂閱房間的即時事件")
+async def stream_room_events(
+    room_id: str,
+    # 瀏覽器重連時會自動帶上最後收到的事件 id (也就是訊息序號)
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    # 第一次連線時也可以用查詢參數指定 (例如從先前的 WebSocket 連線切換過來)
+    last_seq: Optional[int] = Query(None, ge=0),
+    current_user: UserSnapshot = Depends(get_current_user_for_stream),
+):
+    """
+    回傳 `text/event-stream`，內容與 `/ws/{room_id}` 收到的訊息相同：
+    每個事件的 `event` 是訊息的 type (例如 `student_status`、`eta`)，`id` 是訊息序號，`data` 是 JSON。
+    重連時只補送漏掉的事件；缺口太舊時先送一個 `snapshot` (或 `resync_required`) 事件。
+    """
+    if not await can_join_room(current_user, room_id):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="權限不足：您不能訂閱這個房間")
+
+    resume_from = _parse_event_id(last_event_id)
+    if resume_from is None:
+        resume_from = last_seq
+    try:
+        events = await manager.open_stream(
+            room_id,
+            user_id=current_user.id,
+            institution_id=current_user.institution_id,
+            last_seq=resume_from,
+            snapshot=snapshot_provider(room_id),
+        )
+    except ConnectionLimitExceeded as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": str(RECONNECT_DELAY_MS // 1000)},
+        )
+
+    async def _body():
+        try:
+            yield f"retry: {RECONNECT_DELAY_MS}\n\n"
+            async for event in events:
+                yield event
+        finally:
+            # 不論是客戶端斷線還是回應被中止，都要讓管理器移除這條連線
+            await events.aclose()
+
+    return StreamingResponse(
+        _body(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # 告訴 nginx 之類的反向代理不要緩衝串流
+            "X-Accel-Buffering": "no",
+        },
+    )
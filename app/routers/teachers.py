@@ -6,11 +6,12 @@ from sqlalchemy.orm import Session
 from typing import List
 
 from .. import crud, models, schemas, security
-from ..dependencies import get_db
+from ..dependencies import get_db, get_db_runner, DBRunner
 
 router = APIRouter(
     # 將通用的權限依賴項放在這裡，確保此路由下的所有 API 都需要教職員身份
-    dependencies=[Depends(security.get_current_active_teacher)],
+    # (使用非同步版本：授權在事件迴圈上完成，不必為每個請求佔用一次執行緒池)
+    dependencies=[Depends(security.get_current_teacher_principal_async)],
     # 為此路由下的所有 API 添加統一的 tag
     tags=["4. 教職員 (Teachers)"]
 )
@@ -26,7 +27,7 @@ router = APIRouter(
 def create_student_by_teacher(
     student_data: schemas.StudentCreate,
     db: Session = Depends(get_db),
-    current_teacher: models.User = Depends(security.get_current_active_teacher)
+    current_teacher: security.UserSnapshot = Depends(security.get_current_teacher_principal)
 ):
     """
     由已登入的教職員，在自己所屬的機構下，建立一位新學生，並同時預註冊其家長。
@@ -49,11 +50,11 @@ def create_student_by_teacher(
     response_model=schemas.StudentOut,
     summary="教職員更新學生狀態"
 )
-def update_student_status_by_teacher(
+async def update_student_status_by_teacher(
     student_id: int,
     status_update: schemas.StudentStatusUpdate,
-    db: Session = Depends(get_db),
-    current_teacher: models.User = Depends(security.get_current_active_teacher)
+    db: DBRunner = Depends(get_db_runner),
+    current_teacher: security.UserSnapshot = Depends(security.get_current_teacher_principal_async)
 ):
     """
     教職員更新學生的在校狀態。
@@ -62,19 +63,27 @@ def update_student_status_by_teacher(
     - 更新進度: `ARRIVED` -> `READY_FOR_PICKUP` / `HOMEWORK_PENDING`
     - 確認接走: `PARENT_EN_ROUTE` -> `PICKUP_COMPLETED`
     """
-    # 1. 獲取學生實例
-    student = crud.get_student_by_id(db, student_id=student_id)
-    if not student:
-        raise HTTPException(status_code=404, detail="找不到指定的學生")
+    def _update(session: Session) -> schemas.StudentOut:
+        # 1. 獲取學生實例
+        student = crud.get_student_by_id(session, student_id=student_id)
+        if not student:
+            raise HTTPException(status_code=404, detail="找不到指定的學生")
 
-    # 2. 呼叫核心業務邏輯函式
-    # 所有複雜的權限檢查、狀態機驗證、推播邏輯，都封裝在 crud 函式中
-    return crud.update_student_status(
-        db=db,
-        student=student,
-        new_status=status_update.status,
-        operator=current_teacher
-    )
+        # 2. 呼叫核心業務邏輯函式
+        # 所有複雜的權限檢查、狀態機驗證、推播邏輯，都封裝在 crud 函式中
+        operator = session.get(models.User, current_teacher.id)
+        if operator is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="無法驗證憑證")
+        updated_student = crud.update_student_status(
+            db=session,
+            student=student,
+            new_status=status_update.status,
+            operator=operator
+        )
+        return schemas.StudentOut.model_validate(updated_student)
+
+    # 整段資料庫操作 (包含回應的序列化) 交給 DBRunner，依設定在同步或非同步引擎上執行
+    return await db.run(_update)
 # ^^^--- 新 API 結束 ---^^^
 
 @router.delete(
@@ -87,7 +96,7 @@ def unbind_parent_from_student_by_teacher(
     parent_id: int,
     db: Session = Depends(get_db),
     # current_teacher 依賴項已在 router 層級定義，此處可省略，但保留亦無妨
-    current_teacher: models.User = Depends(security.get_current_active_teacher)
+    current_teacher: security.UserSnapshot = Depends(security.get_current_teacher_principal)
 ):
     """【教職員】為指定學生，解除與指定家長的綁定。"""
     success = crud.unbind_student_from_parent_by_ids(
@@ -107,7 +116,7 @@ def unbind_parent_from_student_by_teacher(
 def delete_student_by_teacher(
     student_id: int,
     db: Session = Depends(get_db),
-    current_teacher: models.User = Depends(security.get_current_active_teacher)
+    current_teacher: security.UserSnapshot = Depends(security.get_current_teacher_principal)
 ):
     """【教職員】刪除一個學生。"""
     deleted_student = crud.delete_student_by_id(db=db, student_id=student_id)
@@ -7,19 +7,29 @@ from typing import List
 from pydantic import BaseModel
 
 from .. import crud, models, schemas, security
-from ..dependencies import get_db
+from ..dependencies import get_db, get_db_runner, DBRunner
 
 router = APIRouter(
     # 將通用的權限依賴項放在這裡，確保此路由下的所有 API 都需要使用者登入
-    dependencies=[Depends(security.get_current_active_user)],
+    # (使用非同步版本：授權在事件迴圈上完成，不必為每個請求佔用一次執行緒池)
+    dependencies=[Depends(security.get_current_active_principal_async)],
     responses={404: {"description": "Not found"}},
     tags=["2. 使用者個人中心 (Users)"] # 統一在這裡設定 Tag
 )
 
 @router.get("/me", response_model=schemas.UserDetail, summary="獲取個人完整資訊")
-def read_users_me(current_user: models.User = Depends(security.get_current_active_user)):
+async def read_users_me(
+    db: DBRunner = Depends(get_db_runner),
+    current_user: security.UserSnapshot = Depends(security.get_current_active_principal_async)
+):
     """獲取當前登入使用者的完整資訊，包括其關聯的子女列表。"""
-    return current_user
+    def _read(session: Session) -> schemas.UserDetail:
+        user = session.get(models.User, current_user.id)
+        if user is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="無法驗證憑證")
+        return schemas.UserDetail.model_validate(user)
+
+    return await db.run(_read)
 
 @router.put("/me/password", status_code=status.HTTP_204_NO_CONTENT, summary="修改個人密碼")
 def update_my_password(
@@ -46,7 +56,7 @@ def bind_additional_child(
 def unbind_my_child(
     student_id: int,
     db: Session = Depends(get_db),
-    current_parent: models.User = Depends(security.get_current_active_parent)
+    current_parent: security.UserSnapshot = Depends(security.get_current_parent_principal)
 ):
     """【家長】從自己的帳號中，主動解除與某個子女的綁定關係。"""
     success = crud.unbind_student_from_parent_by_ids(db=db, parent_id=current_parent.id, student_id=student_id)
@@ -60,20 +70,27 @@ def unbind_my_child(
     response_model=schemas.StudentOut, 
     summary="【家長】發起接送"
 )
-def parent_starts_pickup(
+async def parent_starts_pickup(
     student_id: int,
-    db: Session = Depends(get_db),
-    current_parent: models.User = Depends(security.get_current_active_parent)
+    db: DBRunner = Depends(get_db_runner),
+    current_parent: security.UserSnapshot = Depends(security.get_current_parent_principal_async)
 ):
     """
     家長點擊「出發」按鈕時呼叫此 API。
     系統會將學生狀態更新為 '家長已出發'，並向機構端廣播通知。
     """
-    student = crud.get_student_by_id(db, student_id=student_id)
-    if not student:
-        raise HTTPException(status_code=404, detail="找不到指定的學生")
-    
-    return crud.start_pickup_process(db=db, student=student, parent=current_parent)
+    def _start(session: Session) -> schemas.StudentOut:
+        student = crud.get_student_by_id(session, student_id=student_id)
+        if not student:
+            raise HTTPException(status_code=404, detail="找不到指定的學生")
+
+        parent = session.get(models.User, current_parent.id)
+        if parent is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="無法驗證憑證")
+        updated_student = crud.start_pickup_process(db=session, student=student, parent=parent)
+        return schemas.StudentOut.model_validate(updated_student)
+
+    return await db.run(_start)
 
 
 # 我們需要一個新的 Pydantic 模型來接收 ETA
@@ -85,24 +102,30 @@ class EtaUpdate(BaseModel):
     status_code=status.HTTP_204_NO_CONTENT,
     summary="【家長】更新預計到達時間 (ETA)"
 )
-def parent_updates_eta(
+async def parent_updates_eta(
     student_id: int,
     eta_data: EtaUpdate,
-    db: Session = Depends(get_db),
-    current_parent: models.User = Depends(security.get_current_active_parent)
+    db: DBRunner = Depends(get_db_runner),
+    current_parent: security.UserSnapshot = Depends(security.get_current_parent_principal_async)
 ):
     """
     由家長端 App 在背景呼叫，用於向機構端廣播 ETA 更新。
     """
-    student = crud.get_student_by_id(db, student_id=student_id)
-    if not student:
-        raise HTTPException(status_code=404, detail="找不到指定的學生")
-        
-    crud.update_pickup_eta(
-        db=db, 
-        student=student, 
-        parent=current_parent, 
-        minutes_remaining=eta_data.minutes_remaining
-    )
+    def _update_eta(session: Session) -> None:
+        student = crud.get_student_by_id(session, student_id=student_id)
+        if not student:
+            raise HTTPException(status_code=404, detail="找不到指定的學生")
+
+        parent = session.get(models.User, current_parent.id)
+        if parent is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="無法驗證憑證")
+        crud.update_pickup_eta(
+            db=session, 
+            student=student, 
+            parent=parent, 
+            minutes_remaining=eta_data.minutes_remaining
+        )
+
+    await db.run(_update_eta)
     return
 
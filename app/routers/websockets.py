@@ -1,57 +1,143 @@
 # 檔案路徑: pickup_system/app/routers/websockets.py
 
+from typing import Optional
+
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query, status
-from typing import Dict, List
+from fastapi.concurrency import run_in_threadpool
 
-from .. import models
-from ..dependencies import get_current_user_from_token # 我們下一步會建立它
+from .. import crud, database, events, models, ws_codec
+from ..security import UserSnapshot
+from ..dependencies import get_current_user_from_token
+from ..websocket import ClientConnection, ConnectionLimitExceeded, manager
 
 router = APIRouter()
 
-class ConnectionManager:
-    def __init__(self):
-        self.room_connections: Dict[str, List[WebSocket]] = {}
-        self.user_connections: Dict[int, List[WebSocket]] = {}
+# 即時狀態事件的房間 (見 app/events.py)：只有同機構的教職員 (老師、行政老師) 或管理員可以加入，
+# 而且只由伺服器發布，客戶端的訊框不會轉發到這些房間
+_SERVER_EVENT_ROOM_KINDS = ("institution", "class")
+# 與儀表板 (routers/dashboard.py) 的 allowed_roles 相同：櫃台平板以行政老師的帳號登入
+_STAFF_ROLES = (models.UserRole.admin, models.UserRole.teacher, models.UserRole.receptionist)
+
+def is_server_event_room(room_id: str) -> bool:
+    kind, sep, _ = room_id.partition(":")
+    return bool(sep) and kind in _SERVER_EVENT_ROOM_KINDS
+
+def _class_institution_id(class_id: int):
+    with database.SessionLocal() as db:
+        class_ = db.get(models.Class, class_id)
+        return class_.institution_id if class_ else None
+
+async def can_join_room(user: UserSnapshot, room_id: str) -> bool:
+    if not is_server_event_room(room_id):
+        return True
+    kind, _, key = room_id.partition(":")
+    if user.role not in _STAFF_ROLES or user.institution_id is None or not key.isdigit():
+        return False
+    if kind == "institution":
+        return int(key) == user.institution_id
+    return await run_in_threadpool(_class_institution_id, int(key)) == user.institution_id
 
-    async def connect(self, websocket: WebSocket, room_id: str, user_id: int):
-        await websocket.accept()
-        if room_id not in self.room_connections: self.room_connections[room_id] = []
-        self.room_connections[room_id].append(websocket)
-        if user_id not in self.user_connections: self.user_connections[user_id] = []
-        self.user_connections[user_id].append(websocket)
+def _load_room_snapshot(kind: str, key: int) -> dict:
+    with database.SessionLocal() as db:
+        if kind == "institution":
+            return {"students": crud.get_student_status_snapshot(db, institution_id=key)}
+        return {"students": crud.get_student_status_snapshot(db, class_id=key)}
 
-    def disconnect(self, websocket: WebSocket, room_id: str, user_id: int):
-        if room_id in self.room_connections and websocket in self.room_connections[room_id]:
-            self.room_connections[room_id].remove(websocket)
-        if user_id in self.user_connections and websocket in self.user_connections[user_id]:
-            self.user_connections[user_id].remove(websocket)
+def snapshot_provider(room_id: str):
+    """狀態事件房間在重連缺口太大時改送學生狀態快照；其他房間沒有快照來源。"""
+    if not is_server_event_room(room_id):
+        return None
+    kind, _, key = room_id.partition(":")
 
-    async def broadcast_to_room(self, message: dict, room_id: str):
-        if room_id in self.room_connections:
-            for connection in self.room_connections[room_id]:
-                await connection.send_json(message)
+    async def _snapshot() -> dict:
+        return await run_in_threadpool(_load_room_snapshot, kind, int(key))
+    return _snapshot
 
-    async def send_personal_message(self, message: dict, user_id: int):
-        if user_id in self.user_connections:
-            for connection in self.user_connections[user_id]:
-                await connection.send_json(message)
+def _is_count(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
 
-manager = ConnectionManager()
+async def _receive(connection: ClientConnection):
+    """
+    接收下一個訊框：文字以 JSON、二進位以 MessagePack 解碼 (取代 receive_json)。
+    無法解碼的訊框 (例如不完整的 JSON) 回報錯誤後略過，連線保持。
+    """
+    websocket = connection.websocket
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE), message.get("reason"))
+        manager.touch(connection)
+        frame = message.get("bytes")
+        try:
+            return ws_codec.decode(frame if frame is not None else message["text"])
+        except ws_codec.DecodeError:
+            manager.send_control(connection, {"type": "error", "detail": "無法解碼的訊框"})
 
 @router.websocket("/{notification_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
     notification_id: str,
-    current_user: models.User = Depends(get_current_user_from_token)
+    # 斷線重連時帶上最後收到的訊息序號，只補送漏掉的部分
+    last_seq: Optional[int] = Query(None, ge=0),
+    # 這是關鍵：使用 Depends 將 HTTP 風格的依賴注入應用到 WebSocket
+    current_user: UserSnapshot = Depends(get_current_user_from_token)
 ):
+    # 如果 get_current_user_from_token 驗證失敗（回傳 None），
+    # WebSocket 需要我們手動處理連接關閉。
     if current_user is None:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
+    if not await can_join_room(current_user, notification_id):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
 
-    await manager.connect(websocket, room_id=notification_id, user_id=current_user.id)
+    try:
+        connection = await manager.connect(
+            websocket,
+            room_id=notification_id,
+            user_id=current_user.id,
+            institution_id=current_user.institution_id,
+            last_seq=last_seq,
+            snapshot=snapshot_provider(notification_id),
+        )
+    except ConnectionLimitExceeded:
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+    read_only = is_server_event_room(notification_id)
     try:
         while True:
-            data = await websocket.receive_json()
+            data = await _receive(connection)
+            if not isinstance(data, dict):
+                # 廣播時會在訊息上附加 seq，只接受 JSON 物件；陣列、字串等回報錯誤後略過，連線保持
+                manager.send_control(connection, {"type": "error", "detail": "訊息必須是 JSON 物件"})
+                continue
+            # 應用層心跳：伺服器送出的 ping 由客戶端回 pong；客戶端也可以主動 ping
+            message_type = data.get("type")
+            if message_type == "pong":
+                continue
+            if message_type == "ping":
+                manager.send_control(connection, {"type": "pong"})
+                continue
+            if read_only:
+                # 否則教職員可以在房間裡偽造 student_status、eta 之類的伺服器事件；
+                # 這些房間的 ETA 只由家長的 POST /users/me/children/{id}/eta 經 crud.update_pickup_eta 送出
+                manager.send_control(connection, {"type": "error", "detail": "這個房間只接收伺服器事件"})
+                continue
+            if message_type == "eta":
+                student_id, minutes_remaining = data.get("student_id"), data.get("minutes_remaining")
+                if not (_is_count(student_id) and _is_count(minutes_remaining)):
+                    manager.send_control(connection, {"type": "error", "detail": "ETA 需要非負整數的 student_id 與 minutes_remaining"})
+                    continue
+                # 高頻率的 ETA 先經過合併器，同一位學生在時間窗內只送出最新一筆；
+                # 以伺服器端的欄位重新組成更新 (發送者取自 Token)，客戶端送來的其他欄位不轉發
+                update = events.eta_update(
+                    student_id=student_id, class_id=None, minutes_remaining=minutes_remaining, parent_id=current_user.id
+                )
+                events.eta_coalescer.submit(student_id, (notification_id,), update)
+                continue
+            # 廣播只是把訊息放進每位接收者的佇列，不會被慢速的客戶端拖住
             await manager.broadcast_to_room(data, room_id=notification_id)
     except WebSocketDisconnect:
-        manager.disconnect(websocket, room_id=notification_id, user_id=current_user.id)
+        pass
+    finally:
+        manager.disconnect(connection)
@@ -2,14 +2,23 @@
 # 版本：v2.1 - 修正了權限依賴項的遞歸錯誤
 
 from fastapi import Depends, HTTPException, status
+from starlette.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta, timezone
+from dataclasses import dataclass
+from typing import Optional
+import hashlib
+import time
 
-from . import crud, models
-from .dependencies import get_db
+from . import crud, database, models
+from .core import request_context, tracing
+from .core.cache import TTLCache
+from .core.config import settings
+from .core.password_pool import password_pool
+from .dependencies import DBRunner, get_db
 
 # --- 環境變數與常數 ---
 SECRET_KEY = "a_very_secret_key_for_dev_v2" 
@@ -17,13 +26,21 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7
 
 # --- 密碼處理 ---
+# bcrypt 很耗 CPU，一律交給專用的 password_pool 執行 (佇列已滿時拋出 503)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_pool.run("verify", pwd_context.verify, plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return password_pool.run("hash", pwd_context.hash, password)
+
+# async 路由使用：等待雜湊時不佔用 AnyIO 的執行緒
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_pool.run_async("verify", pwd_context.verify, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await password_pool.run_async("hash", pwd_context.hash, password)
 
 # --- 使用者認證核心函式 ---
 def authenticate_user(db: Session, phone_number: str, password: str) -> models.User | None:
@@ -33,6 +50,13 @@ def authenticate_user(db: Session, phone_number: str, password: str) -> models.U
     # 我們只認證，不檢查 active，將 active 檢查交給依賴項
     return user
 
+async def authenticate_user_async(db: DBRunner, phone_number: str, password: str) -> Optional[models.User]:
+    """authenticate_user 的 async 版本 (登入路由使用)：查詢透過 DBRunner，bcrypt 在 password_pool 中執行。"""
+    user = await db.run(crud.get_user_by_phone, phone_number=phone_number)
+    if not user or not await verify_password_async(password, user.hashed_password):
+        return None
+    return user
+
 # --- JWT Token 處理 ---
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/token")
 
@@ -42,66 +66,363 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode.update({"exp": expire_time})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def create_user_access_token(user: models.User, expires_delta: timedelta | None = None) -> str:
+    """
+    簽發「自我描述」的 Token：除了 sub (手機號碼) 之外，還帶有授權判斷所需的欄位，
+    讓權限依賴項不必讀取資料庫。
+    - uid: 使用者 ID / role: 角色 / st: 帳號狀態 / iid: 所屬機構 ID
+    - ver: Token 版本號，用來撤銷舊的 Token (見下方的 Token 版本表)
+    """
+    return create_access_token(
+        data={
+            "sub": user.phone_number,
+            "uid": user.id,
+            "role": user.role.value,
+            "st": user.status.value,
+            "iid": user.institution_id,
+            "ver": user.token_version or 0,
+        },
+        expires_delta=expires_delta,
+    )
+
+# 已驗證的 Token claims 快取。
+# 鍵是原始 Token 的 SHA-256 (不在記憶體中保存 Token 本身)，
+# 每個項目的存活時間不會超過 Token 自己的 exp，過期後會重新走一次 jwt.decode 並得到過期錯誤。
+token_claims_cache = TTLCache(
+    maxsize=settings.TOKEN_CLAIMS_CACHE_MAXSIZE,
+    ttl=settings.TOKEN_CLAIMS_CACHE_TTL_SECONDS,
+)
+
+def decode_access_token(token: str) -> dict:
+    """
+    驗證並解碼 Token，回傳 claims (請勿修改回傳的 dict)。
+    驗證失敗時拋出 JWTError，與 jwt.decode 的行為一致。
+    """
+    cache_key = hashlib.sha256(token.encode("utf-8")).digest()
+    claims = token_claims_cache.get(cache_key)
+    if claims is not None:
+        return claims
+    claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    exp = claims.get("exp")
+    ttl = (exp - time.time()) if isinstance(exp, (int, float)) else None
+    token_claims_cache.set(cache_key, claims, ttl=ttl)
+    return claims
+
 # ===================================================================
-# FastAPI 依賴項 (Dependencies) - 修正後的版本
+# 身分快照與快取 (Principal Cache)
 # ===================================================================
 
-def get_current_user_from_token(
-    token: str = Depends(oauth2_scheme), 
-    db: Session = Depends(get_db)
-) -> models.User:
+@dataclass(frozen=True)
+class UserSnapshot:
+    """
+    使用者的唯讀快照。
+    它與資料庫會話完全分離，只包含授權判斷所需的欄位，可以安全地跨請求快取。
+    """
+    id: int
+    phone_number: str
+    role: models.UserRole
+    status: models.UserStatus
+    institution_id: Optional[int]
+    token_version: int = 0
+
+    @classmethod
+    def from_user(cls, user: models.User) -> "UserSnapshot":
+        return cls(
+            id=user.id,
+            phone_number=user.phone_number,
+            role=user.role,
+            status=user.status,
+            institution_id=user.institution_id,
+            token_version=user.token_version or 0,
+        )
+
+    @classmethod
+    def from_claims(cls, claims: dict) -> Optional["UserSnapshot"]:
+        """從新版 Token 的 claims 建立快照；欄位不完整或格式錯誤時回傳 None。"""
+        try:
+            return cls(
+                id=int(claims["uid"]),
+                phone_number=claims["sub"],
+                role=models.UserRole(claims["role"]),
+                status=models.UserStatus(claims["st"]),
+                institution_id=claims.get("iid"),
+                token_version=int(claims["ver"]),
+            )
+        except (KeyError, TypeError, ValueError):
+            return None
+
+principal_cache = TTLCache(
+    maxsize=settings.PRINCIPAL_CACHE_MAXSIZE,
+    ttl=settings.PRINCIPAL_CACHE_TTL_SECONDS,
+)
+
+def invalidate_principal(phone_number: str) -> None:
+    """當使用者資料被修改或刪除時，由 crud 呼叫，讓快取中的舊快照失效。"""
+    principal_cache.invalidate(phone_number)
+
+def resolve_principal(db: Session, phone_number: str) -> Optional[UserSnapshot]:
+    """先查快取，未命中時才查詢資料庫並寫回快取。找不到使用者時不做負向快取。"""
+    snapshot = principal_cache.get(phone_number)
+    if snapshot is not None:
+        return snapshot
+    user = crud.get_user_by_phone(db, phone_number=phone_number)
+    if user is None:
+        return None
+    snapshot = UserSnapshot.from_user(user)
+    principal_cache.set(phone_number, snapshot)
+    return snapshot
+
+# ===================================================================
+# Token 版本表 (Token Revocation)
+# ===================================================================
+
+# user_id -> token_version 的精簡對照表，只保存整數。
+# 每個 worker 各自持有一份，並在 TTL 到期後回資料庫刷新；
+# 因此在其他 worker 上，撤銷最慢會在 TOKEN_VERSION_TTL_SECONDS 之後生效。
+token_versions = TTLCache(
+    maxsize=settings.TOKEN_VERSION_TABLE_MAXSIZE,
+    ttl=settings.TOKEN_VERSION_TTL_SECONDS,
+)
+
+def get_token_version(db: Session, user_id: int) -> Optional[int]:
+    """回傳使用者目前的 Token 版本號；使用者不存在時回傳 None (不做負向快取)。"""
+    version = token_versions.get(user_id)
+    if version is not None:
+        return version
+    version = db.query(models.User.token_version).filter(models.User.id == user_id).scalar()
+    if version is not None:
+        # 版本號只會遞增：若在查詢期間其他執行緒已記錄了修改密碼後的新版本，保留較新的值
+        version = token_versions.set_max(user_id, version)
+    return version
+
+def record_token_version(user_id: int, version: int) -> None:
+    """在版本號遞增並提交後呼叫，讓本 worker 立即拒絕舊的 Token。"""
+    token_versions.set_max(user_id, version)
+
+def revoke_user_tokens(user_id: int) -> None:
+    """使用者被刪除時呼叫：移除版本表中的項目，下一次驗證會回資料庫確認。"""
+    token_versions.invalidate(user_id)
+
+def principal_from_claims(db: Session, claims: dict) -> Optional[UserSnapshot]:
     """
-    【基礎依賴項】: 只負責從 Token 中解析出 User 物件。
-    這是所有其他權限依賴項的基石。
+    將已驗證的 claims 轉換為 UserSnapshot。
+    - 新版 Token (帶有 uid)：授權資訊全部來自 claims，只在記憶體中比對版本號。
+    - 舊版 Token (只有 sub)：經由身分快取查詢使用者，並視為版本 0，修改過密碼後即失效。
     """
-    credentials_exception = HTTPException(
+    if claims.get("sub") is None:
+        return None
+    if "uid" in claims:
+        snapshot = UserSnapshot.from_claims(claims)
+        if snapshot is None or get_token_version(db, snapshot.id) != snapshot.token_version:
+            return None
+    else:
+        snapshot = resolve_principal(db, claims["sub"])
+        if snapshot is None or snapshot.token_version != 0:
+            return None
+    # 之後這個請求的日誌都會帶上使用者與機構
+    request_context.bind_user(snapshot.id, snapshot.institution_id)
+    return snapshot
+
+# ===================================================================
+# FastAPI 依賴項 (Dependencies) - 修正後的版本
+# ===================================================================
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="無法驗證憑證",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        phone_number: str = payload.get("sub")
-        if phone_number is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    user = crud.get_user_by_phone(db, phone_number=phone_number)
+
+def _load_user(db: Session, principal: UserSnapshot) -> models.User:
+    """依主鍵載入 ORM 的 User 物件，只有真正需要它的端點才會走到這一步。"""
+    user = db.get(models.User, principal.id)
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
     return user
 
+@tracing.traced(category="auth")
+def get_current_principal(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db)
+) -> UserSnapshot:
+    """
+    【基礎依賴項】: 只負責從 Token 中解析出 UserSnapshot。
+    這是所有其他權限依賴項的基石；新版 Token 在這一步完全不需要讀取資料庫。
+    """
+    try:
+        claims = decode_access_token(token)
+    except JWTError:
+        raise _credentials_exception()
+
+    principal = principal_from_claims(db, claims)
+    if principal is None:
+        raise _credentials_exception()
+    return principal
+
+@tracing.traced(category="auth")
+def get_current_user_from_token(
+    principal: UserSnapshot = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+) -> models.User:
+    """【ORM 依賴項】: 需要完整 User 物件 (例如子女列表、密碼雜湊) 的端點才使用它。"""
+    return _load_user(db, principal)
+
+# --- 權限檢查 (同步與非同步依賴項共用) ---
+
+def _require_active(principal: UserSnapshot) -> UserSnapshot:
+    if principal.status != models.UserStatus.active:
+        raise HTTPException(status_code=403, detail="使用者帳號未啟用或已被停用")
+    return principal
+
+def _require_admin(principal: UserSnapshot) -> UserSnapshot:
+    if principal.role != models.UserRole.admin:
+        raise HTTPException(status_code=403, detail="權限不足，此操作需要管理員身份")
+    return principal
+
+def _require_platform_operator(principal: UserSnapshot) -> UserSnapshot:
+    _require_admin(principal)
+    if principal.id not in settings.PLATFORM_OPERATOR_IDS:
+        raise HTTPException(status_code=403, detail="權限不足，此操作只開放給平台維運人員")
+    return principal
+
+def _require_teacher(principal: UserSnapshot) -> UserSnapshot:
+    if principal.role not in [models.UserRole.teacher, models.UserRole.admin]:
+        raise HTTPException(status_code=403, detail="權限不足，此操作需要教職員身份")
+    return principal
+
+def _require_parent(principal: UserSnapshot) -> UserSnapshot:
+    if principal.role != models.UserRole.parent:
+        raise HTTPException(status_code=403, detail="權限不足，此操作需要家長身份")
+    return principal
+
+# --- 輕量權限依賴項：只根據 claims 授權，回傳 UserSnapshot ---
+
+@tracing.traced(category="auth")
+def get_current_active_principal(
+    principal: UserSnapshot = Depends(get_current_principal),
+) -> UserSnapshot:
+    """【通用依賴項】: 驗證當前使用者的狀態為 'active'。"""
+    return _require_active(principal)
+
+@tracing.traced(category="auth")
+def get_current_admin_principal(
+    principal: UserSnapshot = Depends(get_current_active_principal),
+) -> UserSnapshot:
+    """【權限依賴項】: 驗證當前使用者是否為管理員 (admin)。"""
+    return _require_admin(principal)
+
+@tracing.traced(category="auth")
+def get_current_platform_operator_principal(
+    principal: UserSnapshot = Depends(get_current_active_principal),
+) -> UserSnapshot:
+    """【權限依賴項】: 驗證當前使用者是平台維運人員 (settings.PLATFORM_OPERATOR_IDS 中的管理員)，用於跨機構的診斷端點。"""
+    return _require_platform_operator(principal)
+
+@tracing.traced(category="auth")
+def get_current_teacher_principal(
+    principal: UserSnapshot = Depends(get_current_active_principal),
+) -> UserSnapshot:
+    """【權限依賴項】: 驗證當前使用者是否為老師 (teacher) 或管理員。"""
+    return _require_teacher(principal)
+
+@tracing.traced(category="auth")
+def get_current_parent_principal(
+    principal: UserSnapshot = Depends(get_current_active_principal),
+) -> UserSnapshot:
+    """【權限依賴項】: 驗證當前使用者是否為家長 (parent)。"""
+    return _require_parent(principal)
+
+# --- 非同步權限依賴項：給 async 路由使用，與上面的同步版本行為相同 ---
+# 同步依賴項 (以及 get_db) 每個都會被丟到 AnyIO 的執行緒池執行；
+# async 路由改用這一組，新版 Token 在版本表命中時完全在事件迴圈上完成授權，不佔用任何執行緒。
+
+def principal_from_claims_with_short_session(claims: dict) -> Optional[UserSnapshot]:
+    """開一個短暫的會話解析身分，解析完立即關閉並歸還連線 (在執行緒池中呼叫)。"""
+    with database.SessionLocal() as db:
+        return principal_from_claims(db, claims)
+
+@tracing.traced(category="auth")
+async def get_current_principal_async(token: str = Depends(oauth2_scheme)) -> UserSnapshot:
+    """
+    【基礎依賴項】get_current_principal 的非同步版本。
+    新版 Token 且本 worker 的版本表中已有這位使用者時，只比對記憶體中的版本號；
+    版本表未命中或舊版 Token (只有 sub) 才到執行緒池開一個短暫的會話查詢。
+    """
+    try:
+        claims = decode_access_token(token)
+    except JWTError:
+        raise _credentials_exception()
+
+    snapshot = UserSnapshot.from_claims(claims) if "uid" in claims and claims.get("sub") is not None else None
+    version = token_versions.get(snapshot.id) if snapshot is not None else None
+    if version is not None:
+        if version != snapshot.token_version:
+            raise _credentials_exception()
+        request_context.bind_user(snapshot.id, snapshot.institution_id)
+        return snapshot
+
+    principal = await run_in_threadpool(principal_from_claims_with_short_session, claims)
+    if principal is None:
+        raise _credentials_exception()
+    return principal
+
+@tracing.traced(category="auth")
+async def get_current_active_principal_async(
+    principal: UserSnapshot = Depends(get_current_principal_async),
+) -> UserSnapshot:
+    return _require_active(principal)
+
+@tracing.traced(category="auth")
+async def get_current_admin_principal_async(
+    principal: UserSnapshot = Depends(get_current_active_principal_async),
+) -> UserSnapshot:
+    return _require_admin(principal)
+
+@tracing.traced(category="auth")
+async def get_current_teacher_principal_async(
+    principal: UserSnapshot = Depends(get_current_active_principal_async),
+) -> UserSnapshot:
+    return _require_teacher(principal)
+
+@tracing.traced(category="auth")
+async def get_current_parent_principal_async(
+    principal: UserSnapshot = Depends(get_current_active_principal_async),
+) -> UserSnapshot:
+    return _require_parent(principal)
+
+# --- ORM 權限依賴項：先以 claims 授權，通過後才載入 User 物件 ---
+
+@tracing.traced(category="auth")
 def get_current_active_user(
-    current_user: models.User = Depends(get_current_user_from_token),
+    principal: UserSnapshot = Depends(get_current_active_principal),
+    db: Session = Depends(get_db),
 ) -> models.User:
     """
     【通用依賴項】: 獲取當前已登入且狀態為 'active' 的使用者。
     """
-    if current_user.status != models.UserStatus.active:
-        raise HTTPException(status_code=403, detail="使用者帳號未啟用或已被停用")
-    return current_user
+    return _load_user(db, principal)
 
+@tracing.traced(category="auth")
 def get_current_active_admin(
-    current_user: models.User = Depends(get_current_active_user),
+    principal: UserSnapshot = Depends(get_current_admin_principal),
+    db: Session = Depends(get_db),
 ) -> models.User:
-    """【權限依賴項】: 驗證當前使用者是否為管理員 (admin)。"""
-    if current_user.role != models.UserRole.admin:
-        raise HTTPException(status_code=403, detail="權限不足，此操作需要管理員身份")
-    return current_user
+    """【權限依賴項】: 驗證當前使用者是否為管理員 (admin)，並載入 User 物件。"""
+    return _load_user(db, principal)
 
+@tracing.traced(category="auth")
 def get_current_active_teacher(
-    current_user: models.User = Depends(get_current_active_user),
+    principal: UserSnapshot = Depends(get_current_teacher_principal),
+    db: Session = Depends(get_db),
 ) -> models.User:
-    """【權限依賴項】: 驗證當前使用者是否為老師 (teacher) 或管理員。"""
-    if current_user.role not in [models.UserRole.teacher, models.UserRole.admin]:
-        raise HTTPException(status_code=403, detail="權限不足，此操作需要教職員身份")
-    return current_user
+    """【權限依賴項】: 驗證當前使用者是否為老師 (teacher) 或管理員，並載入 User 物件。"""
+    return _load_user(db, principal)
 
+@tracing.traced(category="auth")
 def get_current_active_parent(
-    current_user: models.User = Depends(get_current_active_user),
+    principal: UserSnapshot = Depends(get_current_parent_principal),
+    db: Session = Depends(get_db),
 ) -> models.User:
-    """【權限依賴項】: 驗證當前使用者是否為家長 (parent)。"""
-    if current_user.role != models.UserRole.parent:
-        raise HTTPException(status_code=403, detail="權限不足，此操作需要家長身份")
-    return current_user
+    """【權限依賴項】: 驗證當前使用者是否為家長 (parent)，並載入 User 物件。"""
+    return _load_user(db, principal)
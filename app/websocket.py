@@ -1,63 +1,688 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query, status
-from typing import Dict, List
+# 檔案路徑: app/websocket.py
+# WebSocket 連線管理：每條連線有自己的有界傳送佇列與寫入任務，廣播只是把訊息放進佇列。
+# 廣播先經過 broker (見 ws_broker.py)，再由每個 worker 送給自己手上的連線，所以多 worker 部署也收得到。
+# 每個房間保留最近的訊息，客戶端重連時帶上 last_seq 就只會收到漏掉的部分。
+# 背景的心跳任務會送出應用層 ping，並回收閒置或已經沒有回應的半開連線。
+# 訊框的編碼 (JSON 或 MessagePack) 在握手時協商，每則廣播每種編碼只序列化一次 (見 ws_codec.py)。
 
-from .. import models
-from ..dependencies import get_current_user_from_token # <--- 匯入真實的依賴項
+import asyncio
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
 
-router = APIRouter()
+from fastapi import WebSocket, status
+
+from . import ws_codec
+from .core import metrics
+from .core.cache import TTLCache
+from .core.config import settings
+from .core.logging_config import get_logger
+from .ws_broker import Broker, create_broker
+
+logger = get_logger(__name__)
+
+fanout_latency_seconds = metrics.histogram(
+    "ws_fanout_latency_seconds",
+    "一則廣播從呼叫 broadcast_to_room 到最後一位接收者送出 (或被丟棄) 的時間",
+)
+dropped_messages_total = metrics.counter(
+    "ws_dropped_messages_total",
+    "因為接收者的傳送佇列已滿而被丟棄的訊息數",
+    labelnames=("policy",),
+)
+slow_consumers_disconnected_total = metrics.counter(
+    "ws_slow_consumers_disconnected_total",
+    "因為消化太慢而被伺服器主動斷線的連線數",
+)
+send_failures_total = metrics.counter(
+    "ws_send_failures_total",
+    "送出訊息時發生錯誤 (通常是已經斷線的 socket) 的次數",
+)
+resumes_total = metrics.counter(
+    "ws_resumes_total",
+    "帶著 last_seq 重連的次數；result=replayed 表示只補送差異，snapshot 表示缺口太舊、改送完整快照",
+    labelnames=("result",),
+)
+replayed_messages_total = metrics.counter(
+    "ws_replayed_messages_total",
+    "重連時從房間緩衝區補送的訊息數",
+)
+live_connections_gauge = metrics.gauge("ws_connections_live", "目前本 worker 上的 WebSocket 連線數")
+idle_connections_gauge = metrics.gauge("ws_connections_idle", "超過一個心跳間隔沒有收到任何訊框、正在等待 pong 的連線數")
+reaped_connections_total = metrics.counter(
+    "ws_connections_reaped_total",
+    "被心跳任務回收的連線數；reason=unresponsive 表示 ping 逾時未回應，idle 表示長時間沒有任何訊框",
+    labelnames=("reason",),
+)
+rejected_connections_total = metrics.counter(
+    "ws_connections_rejected_total",
+    "因為連線上限而被拒絕或被擠掉的連線數",
+    labelnames=("scope",),
+)
+sent_bytes_total = metrics.counter(
+    "ws_sent_bytes_total",
+    "送出的 WebSocket 訊框大小總和 (不含協定標頭)",
+    labelnames=("encoding",),
+)
+
+# 慢速接收者的處理策略
+SLOW_CONSUMER_DROP_OLDEST = "drop_oldest"   # 降級：丟掉佇列中最舊的訊息，保留最新狀態
+SLOW_CONSUMER_DISCONNECT = "disconnect"     # 直接斷線，讓客戶端重連後重新同步
+
+class _Delivery:
+    """
+    一則廣播的追蹤資訊：所有接收者都處理完後，記錄這一輪的扇出延遲。
+    編碼後的訊框依編碼快取，同一則廣播送給一千個人也只序列化一次。
+    """
+    __slots__ = ("message", "room_id", "created_at", "remaining", "frames")
+
+    def __init__(self, message: dict, room_id: Optional[str], recipients: int):
+        self.message = message
+        self.room_id = room_id
+        self.created_at = time.perf_counter()
+        self.remaining = recipients
+        self.frames: Dict[str, Tuple[ws_codec.Frame, int]] = {}
+
+    def frame(self, encoding: str) -> Tuple[ws_codec.Frame, int]:
+        """回傳 (訊框, 位元組數)。"""
+        cached = self.frames.get(encoding)
+        if cached is None:
+            frame = ws_codec.encode(self.message, encoding)
+            cached = self.frames[encoding] = (frame, ws_codec.frame_size(frame))
+        return cached
+
+class RoomStats:
+    """單一房間的扇出延遲統計。"""
+    __slots__ = ("broadcasts", "total_latency", "max_latency", "last_latency")
 
-# ConnectionManager 類別的程式碼和上面第二步中的一樣，保持不變
-class ConnectionManager:
     def __init__(self):
-        self.room_connections: Dict[str, List[WebSocket]] = {}
-        self.user_connections: Dict[int, List[WebSocket]] = {}
-    # ... (connect, disconnect, broadcast_to_room, send_personal_message 方法)
-    async def connect(self, websocket: WebSocket, room_id: str, user_id: int):
-        await websocket.accept()
-        if room_id not in self.room_connections: self.room_connections[room_id] = []
-        self.room_connections[room_id].append(websocket)
-        if user_id not in self.user_connections: self.user_connections[user_id] = []
-        self.user_connections[user_id].append(websocket)
-
-    def disconnect(self, websocket: WebSocket, room_id: str, user_id: int):
-        if room_id in self.room_connections and websocket in self.room_connections[room_id]:
-            self.room_connections[room_id].remove(websocket)
-        if user_id in self.user_connections and websocket in self.user_connections[user_id]:
-            self.user_connections[user_id].remove(websocket)
-
-    async def broadcast_to_room(self, message: dict, room_id: str):
-        if room_id in self.room_connections:
-            for connection in self.room_connections[room_id]:
-                await connection.send_json(message)
-
-    async def send_personal_message(self, message: dict, user_id: int):
-        if user_id in self.user_connections:
-            for connection in self.user_connections[user_id]:
-                await connection.send_json(message)
+        self.broadcasts = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
 
-manager = ConnectionManager()
+    def record(self, latency: float) -> None:
+        self.broadcasts += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.last_latency = latency
+
+    def as_dict(self) -> dict:
+        return {
+            "broadcasts": self.broadcasts,
+            "avg_fanout_ms": round(self.total_latency / self.broadcasts * 1000, 3) if self.broadcasts else None,
+            "max_fanout_ms": round(self.max_latency * 1000, 3),
+            "last_fanout_ms": round(self.last_latency * 1000, 3),
+        }
+
+class ReplayBuffer:
+    """
+    一個房間最近的訊息 (序號, 訊息)，長度有上限。
+
+    floor 之後 (不含) 屬於這個房間的訊息都還在緩衝區中；
+    floor 為 None 表示這個 worker 還沒收到任何訊息，無法判斷先前漏了什麼。
+    """
+    __slots__ = ("messages", "floor")
+
+    def __init__(self, size: int, floor: Optional[int]):
+        self.messages: deque = deque(maxlen=size)
+        self.floor = floor
+
+    def append(self, seq: int, message: dict) -> None:
+        if self.floor is None:
+            self.floor = seq - 1
+        elif len(self.messages) == self.messages.maxlen:
+            self.floor = self.messages[0][0]
+        self.messages.append((seq, message))
+
+    def since(self, last_seq: int) -> Optional[List[dict]]:
+        """回傳序號大於 last_seq 的訊息；缺口比緩衝區還舊時回傳 None。"""
+        if self.floor is None or last_seq < self.floor:
+            return None
+        return [message for seq, message in self.messages if seq > last_seq]
+
+# 重連時取得房間完整快照的函式 (由路由提供，通常會查資料庫)
+SnapshotProvider = Callable[[], Awaitable[dict]]
+
+class ConnectionLimitExceeded(Exception):
+    """機構的連線數已達上限，新的連線應該被拒絕。"""
+
+class ClientConnection:
+    """一條 WebSocket 連線，以及它專屬的有界傳送佇列與寫入任務。"""
+    __slots__ = (
+        "websocket", "room_id", "user_id", "institution_id", "queue", "writer_task", "dropped", "closed",
+        "connected_at", "last_seen", "ping_sent_at", "encoding",
+    )
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        room_id: str,
+        user_id: int,
+        institution_id: Optional[int],
+        queue_size: int,
+        encoding: str = ws_codec.ENCODING_JSON,
+    ):
+        self.websocket = websocket
+        self.encoding = encoding
+        self.room_id = room_id
+        self.user_id = user_id
+        self.institution_id = institution_id
+        self.queue: "asyncio.Queue[_Delivery]" = asyncio.Queue(maxsize=queue_size)
+        self.writer_task: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.closed = False
+        # 心跳用的時間戳 (time.monotonic)
+        self.connected_at = self.last_seen = time.monotonic()
+        self.ping_sent_at: Optional[float] = None
+
+class StreamConnection(ClientConnection):
+    """Server-Sent Events 的連線：沒有 websocket 與寫入任務，由 HTTP 回應的產生器直接消化佇列。"""
+    __slots__ = ()
+
+    def __init__(self, room_id: str, user_id: int, institution_id: Optional[int], queue_size: int):
+        super().__init__(None, room_id, user_id, institution_id, queue_size, ws_codec.ENCODING_SSE)
+
+class ConnectionRegistry:
+    """
+    連線索引：依房間、使用者與機構三個維度，各自以 Dict[key, Set[連線]] 保存。
+
+    加入與移除都是 O(1)；某個鍵的最後一條連線離開時，整個項目會被刪除，
+    所以一學期下來以 notification_id 命名的房間不會無限累積。
+    連線物件只需要有 room_id / user_id / institution_id 屬性。
+    """
+    def __init__(self):
+        self.rooms: Dict[str, Set[ClientConnection]] = {}
+        self.users: Dict[int, Set[ClientConnection]] = {}
+        self.institutions: Dict[int, Set[ClientConnection]] = {}
+        self._count = 0
+
+    def add(self, connection: ClientConnection) -> None:
+        self._index_add(self.rooms, connection.room_id, connection)
+        self._index_add(self.users, connection.user_id, connection)
+        self._index_add(self.institutions, connection.institution_id, connection)
+        self._count += 1
+
+    def remove(self, connection: ClientConnection) -> bool:
+        """移除連線；回傳它是否真的在索引中。"""
+        room = self.rooms.get(connection.room_id)
+        if room is None or connection not in room:
+            return False
+        self._index_remove(self.rooms, connection.room_id, connection)
+        self._index_remove(self.users, connection.user_id, connection)
+        self._index_remove(self.institutions, connection.institution_id, connection)
+        self._count -= 1
+        return True
+
+    def in_room(self, room_id: str) -> Iterable[ClientConnection]:
+        return self.rooms.get(room_id, ())
+
+    def for_user(self, user_id: int) -> Iterable[ClientConnection]:
+        return self.users.get(user_id, ())
+
+    def in_institution(self, institution_id: int) -> Iterable[ClientConnection]:
+        return self.institutions.get(institution_id, ())
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self):
+        return (connection for room in list(self.rooms.values()) for connection in list(room))
+
+    @staticmethod
+    def _index_add(index: dict, key: Optional[Hashable], connection) -> None:
+        if key is None:
+            return
+        bucket = index.get(key)
+        if bucket is None:
+            bucket = index[key] = set()
+        bucket.add(connection)
+
+    @staticmethod
+    def _index_remove(index: dict, key: Optional[Hashable], connection) -> None:
+        if key is None:
+            return
+        bucket = index.get(key)
+        if bucket is None:
+            return
+        bucket.discard(connection)
+        if not bucket:
+            del index[key]
+
+# broker 的主題名稱：依收件對象的種類加上前綴
+_TOPIC_ROOM = "room:"
+_TOPIC_USER = "user:"
+_TOPIC_INSTITUTION = "institution:"
+
+class ConnectionManager:
+    def __init__(
+        self,
+        queue_size: int = settings.WS_SEND_QUEUE_SIZE,
+        slow_consumer_policy: str = settings.WS_SLOW_CONSUMER_POLICY,
+        broker: Optional[Broker] = None,
+        replay_size: int = settings.WS_REPLAY_BUFFER_SIZE,
+    ):
+        self.queue_size = queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.registry = ConnectionRegistry()
+        # 房間的統計與房間同生共死：最後一條連線離開時一併刪除
+        self.room_stats: Dict[str, RoomStats] = {}
+        self.broker = broker if broker is not None else create_broker()
+        # 有連線的房間的補送緩衝區；房間清空後移到 dormant_replay，過期或超量就丟棄
+        self.replay_size = replay_size
+        self.replay_buffers: Dict[str, ReplayBuffer] = {}
+        self.dormant_replay = TTLCache(
+            maxsize=settings.WS_REPLAY_DORMANT_ROOMS, ttl=settings.WS_REPLAY_DORMANT_TTL_SECONDS
+        )
+        self.last_seq = 0
+        self._started = False
+        self._start_lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self.ping_interval = settings.WS_PING_INTERVAL_SECONDS
+        self.pong_timeout = settings.WS_PONG_TIMEOUT_SECONDS
+        self.idle_timeout = settings.WS_IDLE_TIMEOUT_SECONDS
+        self.max_per_user = settings.WS_MAX_CONNECTIONS_PER_USER
+        self.max_per_institution = settings.WS_MAX_CONNECTIONS_PER_INSTITUTION
+        self.reaped = {"unresponsive": 0, "idle": 0}
+
+    async def start(self) -> None:
+        """啟動 broker 的訂閱 (由 main.py 的 lifespan 呼叫；第一次廣播時也會自動啟動)。"""
+        if self._started:
+            return
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._started:
+                return
+            await self.broker.start(self._deliver_local)
+            self._loop = asyncio.get_running_loop()
+            self._heartbeat_task = self._loop.create_task(self._heartbeat())
+            self._started = True
+            logger.info("WebSocket broker 已啟動: %s", self.broker.name)
+
+    async def stop(self) -> None:
+        for connection in self.registry:
+            self.disconnect(connection)
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        if self._started:
+            await self.broker.stop()
+            self._started = False
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        room_id: str,
+        user_id: int,
+        institution_id: Optional[int] = None,
+        last_seq: Optional[int] = None,
+        snapshot: Optional[SnapshotProvider] = None,
+    ) -> ClientConnection:
+        """
+        接受連線並加入房間。
+
+        帶 last_seq 重連時，先補送房間緩衝區中序號更新的訊息；
+        若缺口已經超出緩衝區，改送 {"type": "snapshot"} (由 snapshot 提供資料)，
+        沒有快照來源的房間則送 {"type": "resync_required"} 請客戶端自行重新載入。
+        補送完成前的新訊息會先排在佇列中，不會插隊也不會遺失。
+
+        機構連線數已達上限時拋出 ConnectionLimitExceeded (通常還沒 accept；並行的握手在加入房間時才超出上限的，
+        會在 accept 之後被拒絕，由呼叫端關閉)；
+        使用者的連線數已達上限時，關閉他最舊的一條連線 (通常是換網路後留下的半開連線)。
+        客戶端要求 pickup.msgpack.v1 子協定時，之後的訊框都以 MessagePack 二進位格式送出。
+        """
+        await self.start()
+        self._enforce_limits(user_id, institution_id)
+        subprotocol = ws_codec.negotiate(websocket.scope.get("subprotocols", ()))
+        await websocket.accept(subprotocol=subprotocol)
+        connection = ClientConnection(
+            websocket, room_id, user_id, institution_id, self.queue_size, ws_codec.encoding_for(subprotocol)
+        )
+        backlog = self._register(connection, last_seq)
+        try:
+            for message in await self._resume_messages(backlog, last_seq, snapshot):
+                await self._send_frame(connection, *_Delivery(message, None, 1).frame(connection.encoding))
+        except Exception:
+            self.disconnect(connection)
+            raise
+        # 補送期間可能被同一使用者並行的新連線擠掉 (已經在關閉中)，這時不需要寫入任務
+        if not connection.closed:
+            connection.writer_task = asyncio.create_task(self._writer(connection))
+        return connection
+
+    async def open_stream(
+        self,
+        room_id: str,
+        user_id: int,
+        institution_id: Optional[int] = None,
+        last_seq: Optional[int] = None,
+        snapshot: Optional[SnapshotProvider] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Server-Sent Events 版本的 connect()：回傳 text/event-stream 事件的非同步產生器。
+
+        與 WebSocket 共用同一個房間索引與扇出 (事件只編碼一次)，補送與快照的規則也相同，
+        last_seq 通常來自瀏覽器重連時帶的 Last-Event-ID。連線上限在這裡先檢查，
+        真正加入房間是在產生器開始執行時，所以沒有被迭代的產生器不會留下殘留的連線。
+        """
+        await self.start()
+        self._enforce_limits(user_id, institution_id)
+        connection = StreamConnection(room_id, user_id, institution_id, self.queue_size)
+        return self._stream(connection, last_seq, snapshot)
+
+    def touch(self, connection: ClientConnection) -> None:
+        """收到客戶端的任何訊框 (包含 pong) 時呼叫，表示連線仍然活著。"""
+        connection.last_seen = time.monotonic()
+        connection.ping_sent_at = None
+
+    def send_control(self, connection: ClientConnection, message: dict) -> None:
+        """送出只給這條連線的控制訊息 (ping/pong、錯誤回報)，同樣經過它的傳送佇列。"""
+        if not connection.closed:
+            self._enqueue(connection, _Delivery(message, None, 1))
+
+    def disconnect(self, connection: ClientConnection):
+        """移除連線並停止它的寫入任務；可以重複呼叫。"""
+        if connection.closed:
+            return
+        connection.closed = True
+        self.registry.remove(connection)
+        if connection.room_id not in self.registry.rooms:
+            self.room_stats.pop(connection.room_id, None)
+            buffer = self.replay_buffers.pop(connection.room_id, None)
+            if buffer is not None:
+                self.dormant_replay.set(connection.room_id, buffer)
+        if connection.writer_task is not None and connection.writer_task is not asyncio.current_task():
+            connection.writer_task.cancel()
+        # 還在佇列中的訊息不會再送出，但要讓它們的扇出統計可以結束
+        while not connection.queue.empty():
+            self._mark_done(connection.queue.get_nowait())
+        if isinstance(connection, StreamConnection):
+            # 喚醒正在等待佇列的 SSE 產生器，讓它結束回應
+            connection.queue.put_nowait(None)
+
+    async def broadcast_to_room(self, message: dict, room_id: str) -> int:
+        """
+        透過 broker 發布給所有 worker 上、這個房間內的連線，回傳訊息序號。
+        各 worker 只是把訊息放進連線的佇列，不等待任何一位接收者。
+        """
+        return await self._publish(_TOPIC_ROOM + room_id, message)
+
+    @property
+    def loop(self) -> Optional[asyncio.AbstractEventLoop]:
+        """manager 所在的事件迴圈；尚未啟動時為 None。"""
+        return self._loop
+
+    def publish_threadsafe(self, message: dict, room_id: str) -> None:
+        """
+        給同步程式碼 (threadpool 中的路由、SQLAlchemy 的 commit 事件) 使用的廣播入口。
+        排進 manager 所在的事件迴圈後立即返回；manager 尚未啟動時 (例如離線腳本) 直接略過。
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            logger.debug("WebSocket manager 尚未啟動，略過房間 %s 的訊息。", room_id)
+            return
+        future = asyncio.run_coroutine_threadsafe(self.broadcast_to_room(message, room_id), loop)
+        future.add_done_callback(self._log_publish_error)
+
+    @staticmethod
+    def _log_publish_error(future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("發布 WebSocket 訊息失敗: %s", future.exception())
+
+    async def send_personal_message(self, message: dict, user_id: int) -> int:
+        return await self._publish(f"{_TOPIC_USER}{user_id}", message)
+
+    async def send_to_institution(self, message: dict, institution_id: int) -> int:
+        """送給某個機構下所有已連線的使用者，不論他們在哪個房間或哪個 worker。"""
+        return await self._publish(f"{_TOPIC_INSTITUTION}{institution_id}", message)
+
+    def stats(self) -> dict:
+        return {
+            "broker": self.broker.name,
+            "last_seq": self.last_seq,
+            "connections": len(self.registry),
+            "reaped": dict(self.reaped),
+            "replay_buffers": {"live": len(self.replay_buffers), "dormant": len(self.dormant_replay)},
+            "users": len(self.registry.users),
+            "institutions": len(self.registry.institutions),
+            "rooms": {room_id: room_stats.as_dict() for room_id, room_stats in self.room_stats.items()},
+        }
 
+    # --- 內部實作 ---
 
-@router.websocket("/ws/{notification_id}")
-async def websocket_endpoint(
-    websocket: WebSocket,
-    notification_id: str,
-    # 這是關鍵：使用 Depends 將 HTTP 風格的依賴注入應用到 WebSocket
-    current_user: models.User = Depends(get_current_user_from_token)
-):
-    # 如果 get_current_user_from_token 驗證失敗（回傳 None），FastAPI 會自動處理，
-    # 但 WebSocket 需要我們手動處理連接關閉。
-    if current_user is None:
-        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
-        return
-
-    await manager.connect(websocket, room_id=notification_id, user_id=current_user.id)
-    try:
+    async def _publish(self, topic: str, message: dict) -> int:
+        if not self._started:
+            await self.start()
+        return await self.broker.publish(topic, message)
+
+    def _deliver_local(self, topic: str, seq: int, message: dict) -> None:
+        """broker 的回呼：把訊息 (附上序號) 交給本 worker 上符合主題的連線。"""
+        message = {**message, "seq": seq}
+        if topic.startswith(_TOPIC_ROOM):
+            room_id = topic[len(_TOPIC_ROOM):]
+            self._record(room_id, seq, message)
+            self._fan_out(message, list(self.registry.in_room(room_id)), room_id)
+        elif topic.startswith(_TOPIC_USER):
+            self._fan_out(message, list(self.registry.for_user(int(topic[len(_TOPIC_USER):]))), None)
+        elif topic.startswith(_TOPIC_INSTITUTION):
+            self._fan_out(message, list(self.registry.in_institution(int(topic[len(_TOPIC_INSTITUTION):]))), None)
+        else:
+            logger.warning("收到未知主題的 broker 訊息: %s", topic)
+        self.last_seq = max(self.last_seq, seq)
+
+    def _enforce_limits(
+        self, user_id: int, institution_id: Optional[int], registered: Optional[ClientConnection] = None
+    ) -> None:
+        """
+        registered 為 None 時是握手前的預先檢查 (還沒 accept，可以便宜地拒絕)。
+        預先檢查與加入房間之間隔著 accept 等 await，並行的握手可能全部通過，
+        所以 _register 加入索引後會帶著 registered 再檢查一次：兩者之間沒有 await，這次才是最終判定。
+        """
+        if self.max_per_institution and institution_id is not None:
+            others = len(self.registry.in_institution(institution_id)) - (registered is not None)
+            if others >= self.max_per_institution:
+                rejected_connections_total.inc(scope="institution")
+                if registered is not None:
+                    self.disconnect(registered)
+                raise ConnectionLimitExceeded(f"機構 {institution_id} 的 WebSocket 連線數已達上限")
+        if self.max_per_user:
+            existing = sorted(
+                (c for c in self.registry.for_user(user_id) if c is not registered), key=lambda c: c.connected_at
+            )
+            for connection in existing[: max(len(existing) - self.max_per_user + 1, 0)]:
+                rejected_connections_total.inc(scope="user")
+                logger.info("使用者 %s 的 WebSocket 連線數已達上限，關閉最舊的連線。", user_id)
+                self.disconnect(connection)
+                asyncio.create_task(self._close(connection, status.WS_1008_POLICY_VIOLATION))
+
+    async def _heartbeat(self) -> None:
+        checks = [v for v in (self.ping_interval, self.pong_timeout, self.idle_timeout) if v > 0]
+        if not checks:
+            return
+        tick = max(min(checks) / 2, 0.5)
         while True:
-            data = await websocket.receive_json()
-            # 可以在這裡增加更多處理客戶端訊息的邏輯
-            # 例如，處理家長發來的 GPS 更新
-            await manager.broadcast_to_room(data, room_id=notification_id)
-    except WebSocketDisconnect:
-        manager.disconnect(websocket, room_id=notification_id, user_id=current_user.id)
+            await asyncio.sleep(tick)
+            try:
+                self._heartbeat_tick(time.monotonic())
+            except Exception:
+                logger.exception("WebSocket 心跳檢查失敗")
+
+    def _heartbeat_tick(self, now: float) -> None:
+        idle = 0
+        for connection in self.registry:
+            silent_for = now - connection.last_seen
+            if isinstance(connection, StreamConnection):
+                # SSE 是單向的，收不到 pong：只定期送出 ping 事件讓代理伺服器不會切斷閒置的串流，
+                # 客戶端斷線由 StreamingResponse 偵測
+                if self.ping_interval and silent_for >= self.ping_interval:
+                    self.send_control(connection, {"type": "ping"})
+                    connection.last_seen = now
+                continue
+            if self.pong_timeout and connection.ping_sent_at is not None and now - connection.ping_sent_at > self.pong_timeout:
+                self._reap(connection, "unresponsive")
+            elif self.idle_timeout and silent_for > self.idle_timeout:
+                self._reap(connection, "idle")
+            elif self.ping_interval and silent_for >= self.ping_interval:
+                idle += 1
+                if connection.ping_sent_at is None:
+                    connection.ping_sent_at = now
+                    self.send_control(connection, {"type": "ping"})
+        live_connections_gauge.set(len(self.registry))
+        idle_connections_gauge.set(idle)
+
+    def _reap(self, connection: ClientConnection, reason: str) -> None:
+        logger.info("回收 WebSocket 連線 (%s)。房間: %s, 使用者 ID: %s", reason, connection.room_id, connection.user_id)
+        self.reaped[reason] += 1
+        reaped_connections_total.inc(reason=reason)
+        self.disconnect(connection)
+        asyncio.create_task(self._close(connection, status.WS_1001_GOING_AWAY))
+
+    def _live_buffer(self, room_id: str) -> ReplayBuffer:
+        buffer = self.replay_buffers.get(room_id)
+        if buffer is None:
+            buffer = self.dormant_replay.get(room_id)
+            if buffer is not None:
+                self.dormant_replay.invalidate(room_id)
+            else:
+                # 新的緩衝區：從現在起這個房間的訊息都會被記錄
+                buffer = ReplayBuffer(self.replay_size, floor=self.last_seq or None)
+            self.replay_buffers[room_id] = buffer
+        return buffer
+
+    def _record(self, room_id: str, seq: int, message: dict) -> None:
+        """記錄房間訊息；本 worker 沒有人在這個房間時也要記錄，重連的客戶端可能會被分到這裡。"""
+        if room_id in self.registry.rooms:
+            self._live_buffer(room_id).append(seq, message)
+            return
+        buffer = self.dormant_replay.get(room_id)
+        if buffer is None:
+            buffer = ReplayBuffer(self.replay_size, floor=self.last_seq or None)
+        buffer.append(seq, message)
+        self.dormant_replay.set(room_id, buffer)
+
+    def _register(self, connection: ClientConnection, last_seq: Optional[int]) -> Optional[List[dict]]:
+        """加入索引並取出要補送的訊息；缺口超出緩衝區 (或沒有帶 last_seq) 時回傳 None。"""
+        # 從加入索引到取出補送內容之間沒有 await，之後的新訊息一定會進入這條連線的佇列
+        self.registry.add(connection)
+        self._enforce_limits(connection.user_id, connection.institution_id, registered=connection)
+        if connection.room_id not in self.room_stats:
+            self.room_stats[connection.room_id] = RoomStats()
+        buffer = self._live_buffer(connection.room_id)
+        if last_seq is not None and last_seq <= self.last_seq:
+            return buffer.since(last_seq)
+        return None
+
+    async def _resume_messages(
+        self, backlog: Optional[List[dict]], last_seq: Optional[int], snapshot: Optional[SnapshotProvider]
+    ) -> List[dict]:
+        """重連時要先送出的訊息：補送的差異，或是一則快照 / resync_required。"""
+        if last_seq is None:
+            return []
+        if backlog is not None:
+            resumes_total.inc(result="replayed")
+            replayed_messages_total.inc(len(backlog))
+            return backlog
+        resumes_total.inc(result="snapshot")
+        # 先記下序號再讀取資料：快照至少包含到這個序號為止的變更，之後的差異仍會從佇列送出
+        seq = self.last_seq
+        if snapshot is None:
+            return [{"type": "resync_required", "seq": seq}]
+        return [{"type": "snapshot", "seq": seq, **(await snapshot())}]
 
+    async def _stream(
+        self, connection: "StreamConnection", last_seq: Optional[int], snapshot: Optional[SnapshotProvider]
+    ) -> AsyncIterator[str]:
+        try:
+            backlog = self._register(connection, last_seq)
+        except ConnectionLimitExceeded:
+            # 回應已經開始，無法再回 503：直接結束串流，客戶端會在 retry 之後重連
+            return
+        try:
+            for message in await self._resume_messages(backlog, last_seq, snapshot):
+                yield ws_codec.encode(message, ws_codec.ENCODING_SSE)
+            while True:
+                delivery = await connection.queue.get()
+                if delivery is None:
+                    # 被伺服器關閉 (連線上限或停機)
+                    return
+                try:
+                    frame, size = delivery.frame(ws_codec.ENCODING_SSE)
+                    sent_bytes_total.inc(size, encoding=ws_codec.ENCODING_SSE)
+                    yield frame
+                finally:
+                    self._mark_done(delivery)
+        finally:
+            # 客戶端斷線時 StreamingResponse 會取消產生器，這裡負責清理
+            self.disconnect(connection)
+
+    @staticmethod
+    async def _send_frame(connection: ClientConnection, frame: ws_codec.Frame, size: int) -> None:
+        if isinstance(frame, bytes):
+            await connection.websocket.send_bytes(frame)
+        else:
+            await connection.websocket.send_text(frame)
+        sent_bytes_total.inc(size, encoding=connection.encoding)
+
+    def _fan_out(self, message: dict, connections: list, room_id: Optional[str]):
+        if not connections:
+            return
+        delivery = _Delivery(message, room_id, len(connections))
+        for connection in connections:
+            self._enqueue(connection, delivery)
+
+    def _enqueue(self, connection: ClientConnection, delivery: _Delivery):
+        try:
+            connection.queue.put_nowait(delivery)
+            return
+        except asyncio.QueueFull:
+            pass
+
+        connection.dropped += 1
+        dropped_messages_total.inc(policy=self.slow_consumer_policy)
+        if self.slow_consumer_policy == SLOW_CONSUMER_DISCONNECT:
+            logger.warning("WebSocket 接收者消化太慢，主動斷線。房間: %s, 使用者 ID: %s", connection.room_id, connection.user_id)
+            slow_consumers_disconnected_total.inc()
+            self._mark_done(delivery)
+            self.disconnect(connection)
+            asyncio.create_task(self._close(connection, status.WS_1013_TRY_AGAIN_LATER))
+        else:
+            # 降級：丟掉最舊的一則，讓最新的狀態仍能送達
+            self._mark_done(connection.queue.get_nowait())
+            connection.queue.put_nowait(delivery)
+
+    async def _writer(self, connection: ClientConnection):
+        try:
+            while True:
+                delivery = await connection.queue.get()
+                try:
+                    await self._send_frame(connection, *delivery.frame(connection.encoding))
+                finally:
+                    self._mark_done(delivery)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # 連線已經斷了 (或送出失敗)：只影響這一條連線，不會中斷其他人的廣播
+            send_failures_total.inc()
+            self.disconnect(connection)
+
+    def _mark_done(self, delivery: _Delivery):
+        delivery.remaining -= 1
+        if delivery.remaining > 0:
+            return
+        latency = time.perf_counter() - delivery.created_at
+        fanout_latency_seconds.observe(latency)
+        room_stats = self.room_stats.get(delivery.room_id) if delivery.room_id is not None else None
+        if room_stats is not None:
+            room_stats.record(latency)
+
+    async def _close(self, connection: ClientConnection, code: int):
+        if connection.websocket is None:
+            return
+        try:
+            await connection.websocket.close(code=code)
+        except Exception:
+            pass
+
+manager = ConnectionManager()
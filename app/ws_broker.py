@@ -0,0 +1,241 @@
+# 檔案路徑: app/ws_broker.py
+# WebSocket 跨 worker 扇出的 pub/sub 後端。
+#
+# ConnectionManager 不直接把廣播送給本地連線，而是先 publish 到 broker；
+# broker 把訊息 (附上序號) 送回「每一個」worker 的 deliver 回呼，再由各 worker 送給自己手上的連線。
+# 序號由 broker 統一分配，不保證連續；每個後端都要保證各 worker 收到訊息的順序與序號一致 (單調遞增)，
+# 重連補送 (ReplayBuffer) 與客戶端判斷是否漏接訊息都依賴這一點。
+
+import asyncio
+import itertools
+import json
+import os
+import socket
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Callable, Optional
+
+from .core.config import settings
+from .core.logging_config import get_logger
+from .database import to_libpq_dsn
+
+logger = get_logger(__name__)
+
+# deliver(topic, seq, message)：必須是不會阻塞的同步函式 (通常只是把訊息放進佇列)
+DeliverCallback = Callable[[str, int, dict], None]
+
+class Broker(ABC):
+    """pub/sub 後端的介面。"""
+    name = "base"
+
+    @abstractmethod
+    async def start(self, deliver: DeliverCallback) -> None:
+        ...
+
+    async def stop(self) -> None:
+        pass
+
+    @abstractmethod
+    async def publish(self, topic: str, message: dict) -> int:
+        """發布訊息並回傳它的序號。"""
+
+class InProcessBroker(Broker):
+    """單一 worker 使用：直接在本行程內遞送。"""
+    name = "memory"
+
+    def __init__(self):
+        self._deliver: Optional[DeliverCallback] = None
+        self._seq = itertools.count(1)
+
+    async def start(self, deliver: DeliverCallback) -> None:
+        self._deliver = deliver
+
+    async def publish(self, topic: str, message: dict) -> int:
+        seq = next(self._seq)
+        if self._deliver is not None:
+            self._deliver(topic, seq, message)
+        return seq
+
+class PostgresBroker(Broker):
+    """
+    使用 PostgreSQL 的 LISTEN/NOTIFY 在多個 worker (甚至多台機器) 之間扇出。
+
+    - 每個 worker 持有一條專用的 LISTEN 連線 (asyncpg)，斷線時會自動重連。
+    - 序號來自資料庫的 SEQUENCE，所有 worker 共用。
+    - NOTIFY 在交易 commit 時才送出，且依 commit 的順序遞送；publish 在同一個交易中先取得
+      這個頻道的 advisory lock，再取序號並 NOTIFY，鎖到 commit 才釋放，
+      所以序號的分配順序就是 commit 順序，也就是各 worker 收到的順序。
+    - NOTIFY 的 payload 上限約 8000 bytes，超過的訊息會被拒絕並記錄錯誤。
+    """
+    name = "postgres"
+    CHANNEL = "pickup_ws"
+    MAX_PAYLOAD_BYTES = 7900
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self._deliver: Optional[DeliverCallback] = None
+        self._listen_conn = None
+        self._publish_pool = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def start(self, deliver: DeliverCallback) -> None:
+        import asyncpg  # 只有選用這個後端時才需要安裝
+
+        self._deliver = deliver
+        self._publish_pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=2)
+        async with self._publish_pool.acquire() as conn:
+            await conn.execute("CREATE SEQUENCE IF NOT EXISTS ws_message_seq")
+        await self._listen()
+
+    async def _listen(self) -> None:
+        import asyncpg
+
+        self._listen_conn = await asyncpg.connect(self.dsn)
+        self._listen_conn.add_termination_listener(self._on_terminated)
+        await self._listen_conn.add_listener(self.CHANNEL, self._on_notify)
+
+    def _on_terminated(self, _conn) -> None:
+        if self._stopping:
+            return
+        logger.warning("PostgreSQL LISTEN 連線中斷，準備重新連線。")
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        delay = 0.5
+        while not self._stopping:
+            try:
+                await self._listen()
+                logger.info("PostgreSQL LISTEN 連線已恢復。")
+                return
+            except Exception as e:
+                logger.warning("重新連線 PostgreSQL LISTEN 失敗: %s，%.1f 秒後重試。", e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    def _on_notify(self, _conn, _pid, _channel, payload: str) -> None:
+        seq_text, _, body = payload.partition(" ")
+        try:
+            envelope = json.loads(body)
+            self._deliver(envelope["topic"], int(seq_text), envelope["message"])
+        except Exception:
+            logger.exception("無法處理 NOTIFY 訊息: %.200s", payload)
+
+    async def publish(self, topic: str, message: dict) -> int:
+        body = json.dumps({"topic": topic, "message": message}, ensure_ascii=False, separators=(",", ":"))
+        if len(body.encode("utf-8")) > self.MAX_PAYLOAD_BYTES:
+            raise ValueError(f"訊息太大，超過 NOTIFY 的上限 ({self.MAX_PAYLOAD_BYTES} bytes)")
+        async with self._publish_pool.acquire() as conn:
+            async with conn.transaction():
+                # 若只是 nextval 與 pg_notify 各自執行，先取號的交易可能較晚 commit，訊息就會亂序
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", self.CHANNEL)
+                seq = await conn.fetchval("SELECT nextval('ws_message_seq')")
+                await conn.execute("SELECT pg_notify($1, $2)", self.CHANNEL, f"{seq} {body}")
+            return seq
+
+    async def stop(self) -> None:
+        self._stopping = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        if self._listen_conn is not None:
+            await self._listen_conn.close()
+        if self._publish_pool is not None:
+            await self._publish_pool.close()
+
+class UnixSocketBroker(Broker):
+    """
+    本機多 worker 的替身後端 (測試用，不需要資料庫)。
+
+    每個 worker 在共用目錄下綁定一個 Unix datagram socket (`<pid>.sock`)；
+    publish 時把訊息送給目錄中所有的 socket (包含自己)，已失效的 socket 檔案會被清除。
+    序號存在同一目錄的 `seq` 檔案中，以 fcntl 檔案鎖保護。只支援 POSIX 系統。
+    每則訊息是一個 datagram，超過 MAX_DATAGRAM_BYTES 的在 publish 時就拒絕，接收端不會讀到被截斷的訊息。
+    """
+    name = "unix"
+    MAX_DATAGRAM_BYTES = 65536
+    SEND_TIMEOUT_SECONDS = 1.0
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self._deliver: Optional[DeliverCallback] = None
+        self._sock: Optional[socket.socket] = None
+        self._path: Optional[Path] = None
+
+    async def start(self, deliver: DeliverCallback) -> None:
+        self._deliver = deliver
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._path = self.directory / f"{os.getpid()}.sock"
+        if self._path.exists():
+            self._path.unlink()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(str(self._path))
+        self._sock.setblocking(False)
+        asyncio.get_running_loop().add_reader(self._sock.fileno(), self._on_readable)
+
+    def _on_readable(self) -> None:
+        while True:
+            try:
+                data = self._sock.recv(self.MAX_DATAGRAM_BYTES)
+            except BlockingIOError:
+                return
+            try:
+                envelope = json.loads(data)
+                self._deliver(envelope["topic"], envelope["seq"], envelope["message"])
+            except Exception:
+                logger.exception("無法處理 broker 訊息")
+
+    async def publish(self, topic: str, message: dict) -> int:
+        # 檔案鎖與 sendto 都可能阻塞 (對方的接收緩衝區滿了)，放到執行緒池，不佔用事件迴圈
+        return await asyncio.get_running_loop().run_in_executor(None, self._publish_blocking, topic, message)
+
+    def _publish_blocking(self, topic: str, message: dict) -> int:
+        import fcntl
+
+        with open(self.directory / "seq", "a+") as f:
+            # 鎖一直持有到送完：取號與送出的順序一致，各 worker 收到的序號才會遞增
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            seq = int(f.read() or 0) + 1
+            data = json.dumps({"topic": topic, "seq": seq, "message": message}, ensure_ascii=False).encode("utf-8")
+            if len(data) > self.MAX_DATAGRAM_BYTES:
+                raise ValueError(f"訊息太大，超過 datagram 的上限 ({self.MAX_DATAGRAM_BYTES} bytes)")
+            f.seek(0)
+            f.truncate()
+            f.write(str(seq))
+            f.flush()
+            self._send_to_all(data)
+            return seq
+
+    def _send_to_all(self, data: bytes) -> None:
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sender.settimeout(self.SEND_TIMEOUT_SECONDS)
+        try:
+            for peer in self.directory.glob("*.sock"):
+                try:
+                    sender.sendto(data, str(peer))
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # 對方 worker 已經結束，清掉殘留的 socket 檔案
+                    peer.unlink(missing_ok=True)
+                except socket.timeout:
+                    logger.warning("broker 訊息送往 %s 逾時 (對方的接收緩衝區已滿)，略過。", peer.name)
+        finally:
+            sender.close()
+
+    async def stop(self) -> None:
+        if self._sock is not None:
+            asyncio.get_running_loop().remove_reader(self._sock.fileno())
+            self._sock.close()
+        if self._path is not None:
+            self._path.unlink(missing_ok=True)
+
+def create_broker() -> Broker:
+    """依 settings.WS_BROKER_BACKEND 建立對應的後端。"""
+    backend = settings.WS_BROKER_BACKEND
+    if backend == "memory":
+        return InProcessBroker()
+    if backend == "postgres":
+        return PostgresBroker(to_libpq_dsn(settings.DATABASE_URL))
+    if backend == "unix":
+        return UnixSocketBroker(settings.WS_BROKER_UNIX_DIR)
+    raise ValueError(f"未知的 WS_BROKER_BACKEND: {backend}")
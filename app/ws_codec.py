@@ -0,0 +1,70 @@
+# 檔案路徑: app/ws_codec.py
+# WebSocket 訊框的編碼。
+#
+# 預設是 JSON 文字訊框 (與 send_json 相同的輸出)；客戶端可以在握手時要求
+# Sec-WebSocket-Protocol: pickup.msgpack.v1，改用 MessagePack 二進位訊框，體積較小、解析也較快。
+# 一則廣播對每種編碼只會序列化一次，再把同一份內容送給所有接收者。
+# Server-Sent Events 的串流也共用同一套扇出，只是編碼成 text/event-stream 的事件格式。
+
+import json
+from typing import Iterable, Optional, Union
+
+try:
+    import msgpack
+except ImportError:  # 沒有安裝時只提供 JSON
+    msgpack = None
+
+ENCODING_JSON = "json"
+ENCODING_MSGPACK = "msgpack"
+ENCODING_SSE = "sse"
+
+MSGPACK_SUBPROTOCOL = "pickup.msgpack.v1"
+
+Frame = Union[str, bytes]
+
+# decode() 遇到格式錯誤的訊框時拋出的例外 (JSON 與 MessagePack 的解析錯誤都是 ValueError)
+DecodeError = (ValueError, msgpack.UnpackException) if msgpack is not None else (ValueError,)
+
+def negotiate(requested: Iterable[str]) -> Optional[str]:
+    """從客戶端要求的子協定中挑出伺服器支援的一個；都不支援時回傳 None (使用預設的 JSON)。"""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in requested:
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+def encoding_for(subprotocol: Optional[str]) -> str:
+    return ENCODING_MSGPACK if subprotocol == MSGPACK_SUBPROTOCOL else ENCODING_JSON
+
+def encode(message: dict, encoding: str) -> Frame:
+    if encoding == ENCODING_MSGPACK:
+        return msgpack.packb(message, use_bin_type=True)
+    # 與 Starlette 的 send_json 相同的格式
+    data = json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+    if encoding == ENCODING_SSE:
+        return encode_sse_event(data, event=message.get("type"), event_id=message.get("seq"))
+    return data
+
+def encode_sse_event(data: str, event: Optional[str] = None, event_id: Optional[int] = None) -> str:
+    """
+    一個 text/event-stream 事件。id 使用訊息序號，瀏覽器重連時會放在 Last-Event-ID 標頭帶回來；
+    event 使用訊息的 type (沒有 type 的訊息會觸發 EventSource 的 onmessage)。
+    json.dumps 的輸出不含換行，所以 data 只需要一行。
+    """
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {data}")
+    return "\n".join(lines) + "\n\n"
+
+def frame_size(frame: Frame) -> int:
+    """訊框在線路上的位元組數 (文字訊框以 UTF-8 計算)。"""
+    return len(frame) if isinstance(frame, bytes) else len(frame.encode("utf-8"))
+
+def decode(frame: Frame):
+    """二進位訊框以 MessagePack 解碼，文字訊框以 JSON 解碼 (MessagePack 客戶端也可以送 JSON 文字)。"""
+    if isinstance(frame, bytes):
+        if msgpack is None:
+            raise ValueError("伺服器未安裝 msgpack，無法解碼二進位訊框")
+        return msgpack.unpackb(frame, raw=False)
+    return json.loads(frame)
@@ -0,0 +1,50 @@
+# 檔案路徑: scripts/bench_auth.py
+# 微基準測試：比較每個請求的 Token 驗證成本 (直接 jwt.decode vs. 經過 claims 快取)
+#
+# 用法: python scripts/bench_auth.py [迭代次數]
+
+import os
+import sys
+import time
+from datetime import timedelta
+
+# --- 導入 ---
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(CURRENT_DIR)
+sys.path.append(ROOT_DIR)
+
+from jose import jwt
+
+from app import security
+
+def _bench(label: str, fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    elapsed = time.perf_counter() - start
+    per_call_us = elapsed / iterations * 1_000_000
+    print(f"{label:<32} {iterations:>8} 次  總計 {elapsed:8.3f}s  每次 {per_call_us:8.2f} µs")
+    return per_call_us
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    token = security.create_access_token(
+        data={"sub": "0912345678"}, expires_delta=timedelta(minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+
+    before = _bench(
+        "jwt.decode (修改前)",
+        lambda: jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM]),
+        iterations,
+    )
+
+    security.token_claims_cache.clear()
+    security.decode_access_token(token)  # 預熱：第一次仍需要完整驗證
+    after = _bench("decode_access_token (快取命中)", lambda: security.decode_access_token(token), iterations)
+
+    print(f"加速倍數: {before / after:.1f}x")
+    print(f"快取統計: {security.token_claims_cache.stats()}")
+
+# --- 腳本入口 ---
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# 檔案路徑: scripts/bench_logging.py
+# 基準測試：請求執行緒呼叫 logger.info 的成本
+# 比較兩種作法：
+#   1. 直接掛 StreamHandler + TimedRotatingFileHandler (修改前)：呼叫端自己格式化並寫檔
+#   2. NonBlockingQueueHandler + QueueListener：呼叫端只放進佇列，由背景執行緒寫檔
+#
+# 用法: python scripts/bench_logging.py [執行緒數] [每條執行緒的筆數]
+
+import logging
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from logging.handlers import QueueListener, TimedRotatingFileHandler
+
+# --- 導入 ---
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(CURRENT_DIR)
+sys.path.append(ROOT_DIR)
+
+from app.core.logging_config import LOG_FORMAT, ContextFilter, NonBlockingQueueHandler
+
+def _file_handler(directory: str, name: str) -> logging.Handler:
+    handler = TimedRotatingFileHandler(os.path.join(directory, name), when="D", encoding="utf-8")
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    return handler
+
+def _run(logger: logging.Logger, threads: int, per_thread: int):
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(n: int):
+        local = []
+        for i in range(per_thread):
+            started = time.perf_counter()
+            logger.info("學生狀態更新。學生 ID: %s, 姓名: %s, 狀態從 [%s] 更新為 [%s]。", n * per_thread + i, "王小明", "ARRIVED", "READY_FOR_PICKUP")
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    total = threads * per_thread
+
+    with tempfile.TemporaryDirectory() as directory:
+        direct = logging.getLogger("bench.direct")
+        direct.propagate = False
+        direct.addHandler(_file_handler(directory, "direct.log"))
+        results = [("同步寫檔 (修改前)", _run(direct, threads, per_thread))]
+
+        queued = logging.getLogger("bench.queued")
+        queued.propagate = False
+        log_queue = queue.Queue(maxsize=total)
+        handler = NonBlockingQueueHandler(log_queue)
+        handler.addFilter(ContextFilter())
+        queued.addHandler(handler)
+        listener = QueueListener(log_queue, _file_handler(directory, "queued.log"))
+        listener.start()
+        results.append(("QueueHandler", _run(queued, threads, per_thread)))
+        drain_started = time.perf_counter()
+        listener.stop()
+        drain = time.perf_counter() - drain_started
+
+    print(f"{threads} 條執行緒 x {per_thread} 筆")
+    for name, (elapsed, p50, p99) in results:
+        print(f"  {name:<18} 呼叫端 p50 {p50 * 1e6:7.1f} µs   p99 {p99 * 1e6:8.1f} µs   總時間 {elapsed:6.2f} s")
+    print(f"  背景執行緒寫完剩餘紀錄另外花了 {drain:.2f} s (丟棄 {handler.dropped} 筆)")
+
+# --- 腳本入口 ---
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# 檔案路徑: scripts/bench_middleware.py
+# 基準測試：每個請求經過中介軟體的額外成本
+# 比較三種作法 (都是同一個回傳小 JSON 的路由，以 httpx 的 ASGITransport 直接呼叫，不經過網路)：
+#   1. 沒有中介軟體 (基準線)
+#   2. @app.middleware("http") (修改前，BaseHTTPMiddleware)：只做 try/except 500
+#   3. RequestMetricsMiddleware (純 ASGI)：500 處理 + 請求上下文 + 延遲直方圖 + 狀態碼計數
+#
+# 用法: python scripts/bench_middleware.py [請求數] [輪數]
+
+import asyncio
+import logging
+import os
+import sys
+import time
+
+# --- 導入 ---
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(CURRENT_DIR)
+sys.path.append(ROOT_DIR)
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from app.core.request_metrics import RequestMetricsMiddleware
+
+def _app() -> FastAPI:
+    app = FastAPI()
+
+    # async 路由：避免執行緒池的排程雜訊蓋過中介軟體本身的成本
+    @app.get("/api/v1/students/{student_id}")
+    async def get_student(student_id: int):
+        return {"id": student_id, "status": "READY_FOR_PICKUP"}
+
+    return app
+
+def plain_app() -> FastAPI:
+    return _app()
+
+def base_http_middleware_app() -> FastAPI:
+    app = _app()
+
+    @app.middleware("http")
+    async def global_exception_handler(request: Request, call_next):
+        try:
+            return await call_next(request)
+        except Exception:
+            return JSONResponse(status_code=500, content={"detail": "Internal Server Error"})
+
+    return app
+
+def pure_asgi_app() -> FastAPI:
+    app = _app()
+    app.add_middleware(RequestMetricsMiddleware)
+    return app
+
+async def bench(app: FastAPI, requests: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for i in range(200):  # 暖身
+            await client.get(f"/api/v1/students/{i}")
+        started = time.perf_counter()
+        for i in range(requests):
+            await client.get(f"/api/v1/students/{i}")
+        return (time.perf_counter() - started) / requests
+
+async def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    # 存取日誌的成本與中介軟體的作法無關，測量時關掉
+    logging.getLogger("app.access").setLevel(logging.WARNING)
+
+    variants = (
+        ("沒有中介軟體", plain_app()),
+        ("BaseHTTPMiddleware (修改前)", base_http_middleware_app()),
+        ("純 ASGI + 指標", pure_asgi_app()),
+    )
+    # 輪流執行、各取最好的一次，降低機器負載波動的影響
+    best = {name: float("inf") for name, _ in variants}
+    for _ in range(rounds):
+        for name, app in variants:
+            best[name] = min(best[name], await bench(app, requests))
+
+    baseline = best["沒有中介軟體"]
+    print(f"{requests} 個請求 x {rounds} 輪 (取最佳)")
+    for name, _ in variants:
+        per_request = best[name]
+        print(f"  {name:<28} {per_request * 1e6:8.1f} µs/請求   中介軟體額外成本 {(per_request - baseline) * 1e6:7.1f} µs")
+
+# --- 腳本入口 ---
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+# 檔案路徑: scripts/bench_push.py
+# 基準測試：推播送出的方式對請求延遲與吞吐量的影響 (使用 FakePushProvider，不需要網路)
+# 比較兩種作法：
+#   1. 同步逐則送出 (修改前)：請求執行緒自己呼叫供應商，每則推播都等一次網路往返
+#   2. PushDispatcher：請求只負責排入佇列，背景執行緒池依批次送出
+#
+# 用法: python scripts/bench_push.py [推播則數] [供應商延遲毫秒] [暫時失敗比例]
+
+import os
+import sys
+import time
+
+# --- 導入 ---
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(CURRENT_DIR)
+sys.path.append(ROOT_DIR)
+
+from app.push import FakePushProvider, PushDispatcher, PushMessage, make_dedup_key
+
+def _messages(count: int):
+    return [
+        PushMessage(recipient_id=i, title="可以接送了", body=f"學生 {i} 已準備好", dedup_key=make_dedup_key(i, "可以接送了", str(i)))
+        for i in range(count)
+    ]
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+def bench_inline(count: int, latency: float):
+    provider = FakePushProvider(latency_seconds=latency, seed=1)
+    started = time.perf_counter()
+    for message in _messages(count):
+        provider.send_batch([message])
+    elapsed = time.perf_counter() - started
+    # 修改前，請求要等到推播送完才返回：每則的「請求阻塞時間」就是它的送達延遲
+    return elapsed, elapsed / count, provider
+
+def bench_dispatcher(count: int, latency: float, failure_rate: float, workers: int, batch_size: int):
+    provider = FakePushProvider(latency_seconds=latency, failure_rate=failure_rate, seed=1, max_batch_size=batch_size)
+    dispatcher = PushDispatcher(
+        provider=provider,
+        workers=workers,
+        queue_size=count,
+        batch_size=batch_size,
+        batch_wait_seconds=0.01,
+        retry_base_seconds=0.05,
+        retry_max_seconds=0.5,
+        outbox_enabled=False,
+    )
+    dispatcher.start()
+    messages = _messages(count)
+    started = time.perf_counter()
+    enqueue_started = time.perf_counter()
+    dispatcher.submit(messages)
+    enqueue_cost = (time.perf_counter() - enqueue_started) / count
+    while provider.delivered + dispatcher.stats()["failed"] < count:
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - started
+    dispatcher.stop()
+    return elapsed, enqueue_cost, provider, dispatcher.stats()
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 20) / 1000
+    failure_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+
+    inline_count = min(count, 200)
+    elapsed, per_request, _ = bench_inline(inline_count, latency)
+    print(f"同步逐則送出 ({inline_count} 則，供應商延遲 {latency * 1000:.0f} ms)")
+    print(f"  每則阻塞請求 {per_request * 1000:8.2f} ms   吞吐量 {inline_count / elapsed:8.0f} 則/秒")
+
+    for workers, batch_size in ((1, 100), (2, 100), (4, 500)):
+        elapsed, enqueue_cost, provider, stats = bench_dispatcher(count, latency, failure_rate, workers, batch_size)
+        print(f"\nPushDispatcher ({count} 則，{workers} 個工作執行緒，批次 {batch_size}，暫時失敗 {failure_rate:.0%})")
+        print(f"  每則阻塞請求 {enqueue_cost * 1e6:8.2f} µs   吞吐量 {count / elapsed:8.0f} 則/秒   批次數 {stats['batches']}   重試 {stats['retries']}")
+        print(
+            f"  送達延遲 p50 {_percentile(provider.latencies, 0.50) * 1000:7.1f} ms   "
+            f"p99 {_percentile(provider.latencies, 0.99) * 1000:7.1f} ms   失敗 {stats['failed']}"
+        )
+
+# --- 腳本入口 ---
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# 檔案路徑: scripts/bench_ws_framing.py
+# 基準測試：一則廣播送給 1k 位接收者時，線路上的位元組數與 CPU 時間
+# 比較三種作法：
+#   1. send_json (修改前)：每位接收者各自 json.dumps 一次
+#   2. JSON 文字，編碼一次 (ConnectionManager 預設)
+#   3. MessagePack，編碼一次 (pickup.msgpack.v1 子協定)
+#
+# 用法: python scripts/bench_ws_framing.py [接收者數] [廣播次數]
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+# --- 導入 ---
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(CURRENT_DIR)
+sys.path.append(ROOT_DIR)
+
+from app import ws_codec
+from app.websocket import ConnectionManager
+from app.ws_broker import InProcessBroker
+
+STATUS_EVENT = {
+    "type": "student_status",
+    "student_id": 1234,
+    "class_id": 56,
+    "old": "ARRIVED",
+    "new": "READY_FOR_PICKUP",
+    "operator": 78,
+    "ts": "2025-03-01T08:30:00.123+00:00",
+}
+ETA_BATCH = {
+    "type": "eta",
+    "updates": [
+        {"student_id": 1000 + i, "class_id": 56, "minutes_remaining": i % 15, "parent": 2000 + i, "ts": "2025-03-01T08:30:00.123+00:00"}
+        for i in range(20)
+    ],
+    "collapsed": 37,
+    "ts": "2025-03-01T08:30:01.000+00:00",
+}
+
+class FakeWebSocket:
+    """只計算送出的位元組數；send_json 的實作與 Starlette 相同 (每次呼叫都序列化)。"""
+    def __init__(self, subprotocols=()):
+        self.scope = {"subprotocols": list(subprotocols)}
+        self.bytes_sent = 0
+        self.frames = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_json(self, data):
+        await self.send_text(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+    async def send_text(self, text):
+        self.bytes_sent += len(text.encode("utf-8"))
+        self.frames += 1
+
+    async def send_bytes(self, data):
+        self.bytes_sent += len(data)
+        self.frames += 1
+
+    async def close(self, code=1000):
+        pass
+
+async def bench_send_json(message: dict, recipients: int, rounds: int):
+    sockets = [FakeWebSocket() for _ in range(recipients)]
+    started = time.process_time()
+    for _ in range(rounds):
+        for websocket in sockets:
+            await websocket.send_json(message)
+    cpu = time.process_time() - started
+    return cpu, sum(ws.bytes_sent for ws in sockets)
+
+async def bench_manager(message: dict, recipients: int, rounds: int, subprotocols):
+    manager = ConnectionManager(broker=InProcessBroker(), queue_size=rounds + 1)
+    manager.max_per_user = manager.max_per_institution = 0
+    sockets = [FakeWebSocket(subprotocols) for _ in range(recipients)]
+    for i, websocket in enumerate(sockets):
+        await manager.connect(websocket, "bench", user_id=i)
+    started = time.process_time()
+    for _ in range(rounds):
+        await manager.broadcast_to_room(message, "bench")
+    # 等所有寫入任務把佇列送完
+    while any(ws.frames < rounds for ws in sockets):
+        await asyncio.sleep(0)
+    cpu = time.process_time() - started
+    await manager.stop()
+    return cpu, sum(ws.bytes_sent for ws in sockets)
+
+async def main():
+    recipients = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    if ws_codec.msgpack is None:
+        print("未安裝 msgpack，只比較 JSON。")
+
+    for label, message in (("狀態事件", STATUS_EVENT), ("ETA 合併訊框 (20 筆)", ETA_BATCH)):
+        print(f"\n{label}：{recipients} 位接收者 x {rounds} 次廣播")
+        results = [("send_json (修改前)", await bench_send_json(message, recipients, rounds))]
+        results.append(("JSON 編碼一次", await bench_manager(message, recipients, rounds, ())))
+        if ws_codec.msgpack is not None:
+            results.append(("MessagePack 編碼一次", await bench_manager(message, recipients, rounds, (ws_codec.MSGPACK_SUBPROTOCOL,))))
+        for name, (cpu, total_bytes) in results:
+            per_broadcast_ms = cpu / rounds * 1000
+            per_frame = total_bytes / (recipients * rounds)
+            print(f"  {name:<22} CPU {per_broadcast_ms:8.2f} ms/廣播   每個訊框 {per_frame:7.1f} bytes")
+
+# --- 腳本入口 ---
+if __name__ == "__main__":
+    asyncio.run(main())
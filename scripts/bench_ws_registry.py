@@ -0,0 +1,80 @@
+# 檔案路徑: scripts/bench_ws_registry.py
+# 基準測試：10k 條模擬連線加入、離開 WebSocket 連線索引的成本
+# 比較舊版 Dict[str, List[WebSocket]] 的作法與新版 ConnectionRegistry (集合 + 自動刪除空房間)。
+#
+# 用法: python scripts/bench_ws_registry.py [連線數] [房間數]
+
+import os
+import random
+import sys
+import time
+
+# --- 導入 ---
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(CURRENT_DIR)
+sys.path.append(ROOT_DIR)
+
+from app.websocket import ConnectionRegistry
+
+class FakeConnection:
+    __slots__ = ("room_id", "user_id", "institution_id")
+
+    def __init__(self, room_id: str, user_id: int, institution_id: int):
+        self.room_id = room_id
+        self.user_id = user_id
+        self.institution_id = institution_id
+
+class ListRegistry:
+    """舊版 ConnectionManager 的索引方式 (in + list.remove，且從不刪除空房間)。"""
+    def __init__(self):
+        self.room_connections = {}
+        self.user_connections = {}
+
+    def add(self, connection):
+        if connection.room_id not in self.room_connections: self.room_connections[connection.room_id] = []
+        self.room_connections[connection.room_id].append(connection)
+        if connection.user_id not in self.user_connections: self.user_connections[connection.user_id] = []
+        self.user_connections[connection.user_id].append(connection)
+
+    def remove(self, connection):
+        if connection.room_id in self.room_connections and connection in self.room_connections[connection.room_id]:
+            self.room_connections[connection.room_id].remove(connection)
+        if connection.user_id in self.user_connections and connection in self.user_connections[connection.user_id]:
+            self.user_connections[connection.user_id].remove(connection)
+
+def _run(label: str, registry, connections, leave_order):
+    start = time.perf_counter()
+    for connection in connections:
+        registry.add(connection)
+    joined = time.perf_counter()
+    for connection in leave_order:
+        registry.remove(connection)
+    left = time.perf_counter()
+    rooms_left = len(getattr(registry, "rooms", getattr(registry, "room_connections", {})))
+    print(
+        f"{label:<20} 加入 {(joined - start) * 1000:8.2f} ms  "
+        f"離開 {(left - joined) * 1000:8.2f} ms  殘留房間數 {rooms_left}"
+    )
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    room_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    rng = random.Random(42)
+    connections = [
+        FakeConnection(
+            room_id=f"notification-{rng.randrange(room_count)}",
+            user_id=rng.randrange(total // 2),
+            institution_id=rng.randrange(20),
+        )
+        for _ in range(total)
+    ]
+    leave_order = connections[:]
+    rng.shuffle(leave_order)
+
+    print(f"{total} 條連線，分布在 {room_count} 個房間")
+    _run("List (修改前)", ListRegistry(), connections, leave_order)
+    _run("ConnectionRegistry", ConnectionRegistry(), connections, leave_order)
+
+# --- 腳本入口 ---
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+# 檔案路徑: scripts/trace_to_chrome.py
+# 把請求追蹤的 JSONL 檔 (logs/traces/trace.<pid>.jsonl) 合併成 Chrome Trace 格式，
+# 輸出的檔案可以直接用 Perfetto (https://ui.perfetto.dev) 或 chrome://tracing 開啟。
+#
+# 用法: python scripts/trace_to_chrome.py [輸出檔] [追蹤檔 ...]
+#   不指定追蹤檔時合併 logs/traces 下所有的 .jsonl；輸出檔預設為 logs/traces/trace.chrome.json
+
+import json
+import os
+import sys
+from pathlib import Path
+
+# --- 導入 ---
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(CURRENT_DIR)
+sys.path.append(ROOT_DIR)
+
+from app.core.tracing import TRACES_DIR, to_chrome_trace, trace_files
+
+def main():
+    output = Path(sys.argv[1]) if len(sys.argv) > 1 else TRACES_DIR / "trace.chrome.json"
+    inputs = [Path(arg) for arg in sys.argv[2:]] or trace_files()
+    if not inputs:
+        print(f"{TRACES_DIR} 下沒有追蹤檔 (需要設定 TRACE_SAMPLE_RATE > 0)")
+        return 1
+    document = to_chrome_trace(inputs)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(document, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+    print(f"已合併 {len(inputs)} 個追蹤檔、{len(document['traceEvents'])} 個事件到 {output}")
+    return 0
+
+# --- 腳本入口 ---
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+# 檔案路徑: tests/conftest.py
+# 測試共用的設定：每次測試執行使用一個暫存的 SQLite 檔案資料庫 (日誌也寫在同一個暫存目錄)，不會碰到 .env 中的資料庫。
+# DATABASE_URL 必須在匯入 app 之前設定 (settings 在匯入時就會讀取環境變數)。
+
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+
+_DB_DIR = tempfile.mkdtemp(prefix="pickup-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_DB_DIR}/test.db"
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import database, models, security
+from app.core import logging_config
+from app.main import app
+
+# 測試期間的日誌寫到暫存目錄：匯入 app 時開啟的 logs/app.log 在版本控制中，不要在測試時改動它
+_test_log_handler = logging.FileHandler(os.path.join(_DB_DIR, "app.log"), encoding="utf-8")
+_test_log_handler.setFormatter(logging_config.make_formatter())
+logging_config.listener.handlers = (logging_config.stream_handler, _test_log_handler)
+logging_config.file_handler.close()
+
+@pytest.fixture(scope="session", autouse=True)
+def _schema():
+    models.Base.metadata.create_all(database.engine)
+    yield
+    database.engine.dispose()
+    _test_log_handler.close()
+    shutil.rmtree(_DB_DIR, ignore_errors=True)
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+@pytest.fixture
+def db():
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+# 以下的 fixture 都用自己的短暫會話建立資料，並在關閉前載入需要的欄位，
+# 測試過程中不會有 fixture 佔著連線池的連線。
+
+@pytest.fixture
+def institution():
+    with database.SessionLocal() as session:
+        inst = models.Institution(name="測試幼兒園", code=f"T{uuid.uuid4().hex[:8]}")
+        session.add(inst)
+        session.commit()
+        session.refresh(inst)
+    return inst
+
+@pytest.fixture
+def make_user(institution):
+    """建立一位使用者，回傳 (User, 新版 Token)；手機號碼每次都不同，避免身分快取互相干擾。"""
+    def _make_user(role: models.UserRole = models.UserRole.parent, **fields) -> tuple:
+        with database.SessionLocal() as session:
+            user = models.User(
+                phone_number=f"09{uuid.uuid4().int % 10**8:08d}",
+                full_name=f"{role.value}-user",
+                role=role,
+                status=fields.pop("status", models.UserStatus.active),
+                institution_id=institution.id,
+                hashed_password=security.get_password_hash("password1"),
+                **fields,
+            )
+            session.add(user)
+            session.commit()
+            session.refresh(user)
+            token = security.create_user_access_token(user)
+        return user, token
+    return _make_user
+
+@pytest.fixture
+def make_student(institution):
+    """在機構中建立一個班級與一位學生，並綁定指定的家長；回傳學生 id。"""
+    def _make_student(teacher=None, parents=(), status: models.StudentStatus = models.StudentStatus.ARRIVED,
+                      name: str = "小明", institution_id=None) -> int:
+        with database.SessionLocal() as session:
+            class_ = models.Class(
+                name=f"班級-{uuid.uuid4().hex[:6]}",
+                institution_id=institution_id or institution.id,
+                teacher_id=teacher.id if teacher else None,
+            )
+            session.add(class_)
+            session.flush()
+            student = models.Student(full_name=name, class_id=class_.id, status=status)
+            student.parents.extend(session.get(models.User, parent.id) for parent in parents)
+            session.add(student)
+            session.commit()
+            return student.id
+    return _make_student
+
+def auth(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
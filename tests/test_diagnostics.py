@@ -0,0 +1,67 @@
+# 檔案路徑: tests/test_diagnostics.py
+# 跨機構的診斷端點只開放給平台維運人員 (settings.PLATFORM_OPERATOR_IDS)，一般的機構管理員會被拒絕。
+# Prometheus 的 /metrics 則需要 METRICS_TOKEN，沒有設定權杖時預設關閉。
+
+import time
+
+import pytest
+
+from app import models
+from app.core import profiling
+from app.core.config import settings
+from tests.conftest import auth
+
+OPERATOR_ONLY = [
+    ("GET", "/api/v1/admin/diagnostics/slow-queries"),
+    ("DELETE", "/api/v1/admin/diagnostics/slow-queries"),
+    ("GET", "/api/v1/admin/diagnostics/profiles"),
+    ("GET", "/api/v1/admin/diagnostics/logging"),
+    ("GET", "/api/v1/admin/diagnostics/push"),
+    ("GET", "/api/v1/admin/diagnostics/token-cache"),
+    ("GET", "/api/v1/admin/diagnostics/principal-cache"),
+    ("GET", "/api/v1/admin/diagnostics/websockets"),
+    ("GET", "/api/v1/admin/diagnostics/db-pool"),
+    ("GET", "/api/v1/admin/diagnostics/metrics"),
+]
+
+@pytest.mark.parametrize("method, url", OPERATOR_ONLY)
+def test_institution_admins_cannot_read_process_wide_diagnostics(client, make_user, method, url):
+    _, token = make_user(models.UserRole.admin)
+    assert client.request(method, url, headers=auth(token)).status_code == 403
+
+@pytest.mark.parametrize("method, url", OPERATOR_ONLY)
+def test_platform_operators_can_read_diagnostics(client, make_user, monkeypatch, method, url):
+    operator, token = make_user(models.UserRole.admin)
+    monkeypatch.setattr(settings, "PLATFORM_OPERATOR_IDS", [operator.id])
+    assert client.request(method, url, headers=auth(token)).status_code in (200, 204)
+
+def test_only_platform_operators_can_start_a_profile(client, make_user, monkeypatch, tmp_path):
+    operator, operator_token = make_user(models.UserRole.admin)
+    _, admin_token = make_user(models.UserRole.admin)
+    monkeypatch.setattr(settings, "PLATFORM_OPERATOR_IDS", [operator.id])
+    monkeypatch.setattr(profiling, "_last_started", float("-inf"))
+    monkeypatch.setattr(profiling, "PROFILES_DIR", tmp_path)
+
+    response = client.get("/api/v1/users/me", headers={**auth(admin_token), "X-Profile": "1"})
+    assert "x-profile-id" not in response.headers
+    response = client.get("/api/v1/users/me", headers={**auth(operator_token), "X-Profile": "1"})
+    assert "x-profile-id" in response.headers
+    # 等分析執行緒寫完檔案 (寫到 tmp_path)，再還原 PROFILES_DIR
+    deadline = time.monotonic() + 5
+    while profiling._active and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert profiling.profile_path(response.headers["x-profile-id"]) is not None
+
+def test_metrics_endpoint_requires_a_token_by_default(client, monkeypatch):
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "")
+    assert client.get("/metrics").status_code == 404
+    monkeypatch.setattr(settings, "METRICS_PUBLIC", True)
+    assert client.get("/metrics").status_code == 200
+
+    monkeypatch.setattr(settings, "METRICS_PUBLIC", False)
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "scrape-secret")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers=auth("wrong")).status_code == 401
+    response = client.get("/metrics", headers=auth("scrape-secret"))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
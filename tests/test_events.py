@@ -0,0 +1,92 @@
+# 檔案路徑: tests/test_events.py
+# 學生狀態事件只在 commit 成功之後發布；ETA 合併器在時間窗內同一位學生只送出最新的一筆，
+# 同一個房間的學生合併成一個訊框。
+
+import asyncio
+
+from app import database, events, models
+
+class _FakeManager:
+    """只記錄發布的訊息；loop 指向測試中正在執行的事件迴圈。"""
+    def __init__(self, loop):
+        self.loop = loop
+        self.published = []
+
+    def publish_threadsafe(self, message, room_id):
+        self.published.append((room_id, message))
+
+def _coalesce(monkeypatch, submissions, window_seconds=0.05):
+    async def scenario():
+        manager = _FakeManager(asyncio.get_running_loop())
+        monkeypatch.setattr(events, "manager", manager)
+        coalescer = events.EtaCoalescer(window_seconds)
+        for student_id, rooms, minutes in submissions:
+            coalescer.submit(student_id, rooms, {"student_id": student_id, "minutes_remaining": minutes})
+        # 時間窗結束前什麼都還沒送出
+        await asyncio.sleep(window_seconds / 2)
+        assert manager.published == []
+        await asyncio.sleep(window_seconds)
+        return manager.published, coalescer.stats()
+    return asyncio.run(scenario())
+
+def test_updates_within_the_window_collapse_to_the_latest(monkeypatch):
+    published, stats = _coalesce(monkeypatch, [
+        (1, ("n-1",), 10),
+        (1, ("n-1",), 9),
+        (1, ("n-1",), 8),
+        (2, ("n-1",), 5),
+    ])
+
+    assert len(published) == 1
+    room_id, frame = published[0]
+    assert room_id == "n-1"
+    assert frame["type"] == "eta"
+    assert frame["updates"] == [
+        {"student_id": 1, "minutes_remaining": 8},
+        {"student_id": 2, "minutes_remaining": 5},
+    ]
+    assert frame["collapsed"] == 2
+    assert stats == {"window_seconds": 0.05, "pending": 0, "submitted": 4, "collapsed": 2, "frames": 1}
+
+def test_each_room_gets_its_own_frame(monkeypatch):
+    published, stats = _coalesce(monkeypatch, [(1, ("n-1", "class:3"), 7), (2, ("n-2",), 4)])
+
+    frames = dict(published)
+    assert set(frames) == {"n-1", "class:3", "n-2"}
+    assert frames["class:3"]["updates"] == [{"student_id": 1, "minutes_remaining": 7}]
+    assert all(frame["collapsed"] == 0 for frame in frames.values())
+    assert stats["frames"] == 3
+
+def test_updates_are_dropped_before_the_manager_starts(monkeypatch):
+    monkeypatch.setattr(events, "manager", _FakeManager(None))
+    coalescer = events.EtaCoalescer(0.05)
+    coalescer.submit(1, ("n-1",), {"student_id": 1})
+    assert coalescer.stats()["submitted"] == 0
+
+def test_status_events_are_published_only_after_commit(monkeypatch, make_student, institution):
+    manager = _FakeManager(None)
+    monkeypatch.setattr(events, "manager", manager)
+    student_id = make_student()
+
+    with database.SessionLocal() as session:
+        student = session.get(models.Student, student_id)
+        class_id = student.class_id
+        transition = dict(
+            student=student,
+            institution_id=institution.id,
+            old_status=models.StudentStatus.ARRIVED,
+            new_status=models.StudentStatus.READY_FOR_PICKUP,
+            operator_id=None,
+        )
+        events.publish_student_status(session, **transition)
+        session.rollback()
+        assert manager.published == []
+
+        events.publish_student_status(session, **transition)
+        assert manager.published == []
+        session.commit()
+
+    rooms = [room_id for room_id, _ in manager.published]
+    assert rooms == [events.institution_room(institution.id), events.class_room(class_id)]
+    message = manager.published[0][1]
+    assert (message["type"], message["student_id"], message["new"]) == ("student_status", student_id, "READY_FOR_PICKUP")
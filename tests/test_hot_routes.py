@@ -0,0 +1,126 @@
+# 檔案路徑: tests/test_hot_routes.py
+# 改為 async 的熱門路由：家長發起接送、儀表板列表，以及非同步的授權依賴項。
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app import models, security
+from tests.conftest import auth
+
+def test_parent_starts_pickup(client, make_user, make_student):
+    parent, parent_token = make_user()
+    _, other_token = make_user()
+    student_id = make_student(parents=[parent], status=models.StudentStatus.READY_FOR_PICKUP)
+    url = f"/api/v1/users/me/children/{student_id}/pickup"
+
+    response = client.post(url, headers=auth(parent_token))
+    assert response.status_code == 200, response.text
+    assert response.json()["status"] == "PARENT_EN_ROUTE"
+    # 重複點擊不會出錯
+    assert client.post(url, headers=auth(parent_token)).status_code == 200
+    assert client.post(url, headers=auth(other_token)).status_code == 403
+
+def test_pickup_rejects_students_not_at_school(client, make_user, make_student):
+    parent, token = make_user()
+    student_id = make_student(parents=[parent], status=models.StudentStatus.NOT_ARRIVED)
+    response = client.post(f"/api/v1/users/me/children/{student_id}/pickup", headers=auth(token))
+    assert response.status_code == 400
+
+def test_dashboard_lists_own_institution_in_priority_order(client, make_user, make_student, db):
+    teacher, teacher_token = make_user(models.UserRole.teacher)
+    _, parent_token = make_user()
+    completed = make_student(teacher, status=models.StudentStatus.PICKUP_COMPLETED, name="甲")
+    arrived = make_student(teacher, status=models.StudentStatus.ARRIVED, name="乙")
+    en_route = make_student(teacher, status=models.StudentStatus.PARENT_EN_ROUTE, name="丙")
+    other_institution = models.Institution(name="其他機構", code="OTHER-DASH")
+    db.add(other_institution)
+    db.commit()
+    make_student(status=models.StudentStatus.PARENT_EN_ROUTE, institution_id=other_institution.id)
+
+    response = client.get("/api/v1/dashboard/students", headers=auth(teacher_token))
+    assert response.status_code == 200, response.text
+    assert [student["id"] for student in response.json()] == [en_route, arrived, completed]
+
+    filtered = client.get("/api/v1/dashboard/students?status=ARRIVED", headers=auth(teacher_token))
+    assert [student["id"] for student in filtered.json()] == [arrived]
+    assert client.get("/api/v1/dashboard/students", headers=auth(parent_token)).status_code == 403
+
+def test_async_principal_stays_on_the_event_loop(make_user, monkeypatch):
+    user, token = make_user()
+    security.record_token_version(user.id, user.token_version or 0)
+
+    async def no_threadpool(*args, **kwargs):
+        raise AssertionError("版本表命中時不應該使用執行緒池")
+
+    monkeypatch.setattr(security, "run_in_threadpool", no_threadpool)
+    principal = asyncio.run(security.get_current_principal_async(token))
+    assert principal.id == user.id
+
+    # 修改密碼後 (版本號遞增)，舊 Token 立即失效
+    security.record_token_version(user.id, (user.token_version or 0) + 1)
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(security.get_current_principal_async(token))
+    assert excinfo.value.status_code == 401
+
+def test_async_principal_falls_back_for_legacy_tokens(make_user):
+    user, _ = make_user()
+    legacy_token = security.create_access_token({"sub": user.phone_number})
+    principal = asyncio.run(security.get_current_principal_async(legacy_token))
+    assert principal.id == user.id
+
+def _forbid_sync_hashing(monkeypatch):
+    def blocking_run(*args, **kwargs):
+        raise AssertionError("async 路由不應該以 run() 佔住執行緒等待 bcrypt")
+
+    monkeypatch.setattr(security.password_pool, "run", blocking_run)
+
+def test_login_awaits_the_password_pool(client, make_user, monkeypatch):
+    user, _ = make_user()
+    _forbid_sync_hashing(monkeypatch)
+
+    response = client.post("/api/v1/auth/token", data={"username": user.phone_number, "password": "password1"})
+    assert response.status_code == 200, response.text
+    assert response.json()["token_type"] == "bearer"
+    wrong = client.post("/api/v1/auth/token", data={"username": user.phone_number, "password": "wrong-pass"})
+    assert wrong.status_code == 401
+
+def test_parent_activation_awaits_the_password_pool(client, make_user, make_student, institution, monkeypatch):
+    parent, _ = make_user(status=models.UserStatus.invited)
+    make_student(parents=[parent], name="小華")
+    _forbid_sync_hashing(monkeypatch)
+    payload = {
+        "phone_number": parent.phone_number,
+        "password": "new-password",
+        "institution_code": institution.code,
+        "student_full_name": "小美",
+    }
+
+    assert client.post("/api/v1/auth/activate-parent", json=payload).status_code == 400
+    response = client.post("/api/v1/auth/activate-parent", json={**payload, "student_full_name": "小華"})
+    assert response.status_code == 200, response.text
+    assert response.json()["status"] == "active"
+    login = client.post("/api/v1/auth/token", data={"username": parent.phone_number, "password": "new-password"})
+    assert login.status_code == 200, login.text
+
+def test_password_pool_sheds_load_when_full():
+    from concurrent.futures import Future
+
+    from app.core.password_pool import PasswordHashPool
+
+    pool = PasswordHashPool(workers=1, max_pending=0, retry_after_seconds=3)
+    gate = Future()
+
+    async def scenario():
+        first = asyncio.ensure_future(pool.run_async("verify", gate.result))
+        await asyncio.sleep(0.05)
+        with pytest.raises(HTTPException) as excinfo:
+            await pool.run_async("verify", lambda: True)
+        gate.set_result(True)
+        return excinfo.value, await first
+
+    error, result = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert error.headers["Retry-After"] == "3"
+    assert result is True
@@ -0,0 +1,86 @@
+# 檔案路徑: tests/test_logging_pipeline.py
+# 非同步日誌管線：請求執行緒只把紀錄放進有界佇列，佇列滿了就丟棄並計數，不會卡住。
+# 多 worker 時經由日誌匯集行程寫檔，匯集行程連不上時改寫各 worker 自己的 app.<pid>.log。
+
+import logging
+import os
+import queue
+import time
+
+from app.core.log_format import make_formatter
+from app.core.log_sink import LogSink, SinkHandler
+from app.core.logging_config import NonBlockingQueueHandler
+
+def _logger_with(handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger(f"test-pipeline-{id(handler)}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    return logger
+
+def test_full_queue_drops_and_counts_instead_of_blocking():
+    log_queue = queue.Queue(maxsize=2)
+    handler = NonBlockingQueueHandler(log_queue)
+    logger = _logger_with(handler)
+
+    started = time.perf_counter()
+    for i in range(5):
+        logger.info("第 %d 筆", i)
+    assert time.perf_counter() - started < 1
+
+    assert handler.dropped == 3
+    assert log_queue.qsize() == 2
+    # 佇列有空位後照常排入
+    log_queue.get_nowait()
+    logger.info("又有空位了")
+    assert handler.dropped == 3
+    assert log_queue.qsize() == 2
+
+def test_prepared_records_carry_the_formatted_message():
+    log_queue = queue.Queue(maxsize=10)
+    logger = _logger_with(NonBlockingQueueHandler(log_queue))
+    payload = {"status": "ARRIVED"}
+
+    logger.info("學生狀態 %s", payload)
+    payload["status"] = "PICKUP_COMPLETED"
+
+    record = log_queue.get_nowait()
+    # 參數在請求執行緒中就合併成字串，之後物件改變也不影響紀錄
+    assert record.msg == "學生狀態 {'status': 'ARRIVED'}"
+    assert record.args is None
+    assert record.getMessage() == record.msg
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+def test_sink_handler_falls_back_to_a_per_process_file(tmp_path):
+    socket_path = str(tmp_path / "sink.sock")
+    handler = SinkHandler(socket_path, fallback_dir=tmp_path)
+    handler.setFormatter(make_formatter())
+    logger = _logger_with(handler)
+    try:
+        # 匯集行程還沒啟動：寫到本行程專屬的備援檔案
+        logger.info("匯集行程離線")
+        fallback = tmp_path / f"app.{os.getpid()}.log"
+        assert handler.fallback_records == 1
+        assert "匯集行程離線" in fallback.read_text(encoding="utf-8")
+
+        sink = LogSink(socket_path, log_file=tmp_path / "app.log", batch_size=10)
+        sink.start()
+        try:
+            # 略過 SocketHandler 的重連退避，下一筆就嘗試連線
+            handler.retryTime = None
+            logger.info("匯集行程上線")
+            assert _wait_for(lambda: sink.written == 1)
+        finally:
+            handler.close()
+            sink.stop()
+        assert "匯集行程上線" in (tmp_path / "app.log").read_text(encoding="utf-8")
+        assert handler.fallback_records == 1
+        assert "匯集行程上線" not in fallback.read_text(encoding="utf-8")
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
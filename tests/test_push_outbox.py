@@ -0,0 +1,129 @@
+# 檔案路徑: tests/test_push_outbox.py
+# 推播外寄匣的認領：同一則推播在認領過期前只會被一個 worker 排入。
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import database, models, push
+
+@pytest.fixture
+def outbox_rows(make_user):
+    recipient, _ = make_user()
+    with database.SessionLocal() as session:
+        rows = [
+            models.PushOutbox(
+                recipient_id=recipient.id,
+                title="接送通知",
+                body=f"第 {i} 則",
+                dedup_key=push.make_dedup_key(recipient.id, "接送通知", f"第 {i} 則", "outbox-test"),
+            )
+            for i in range(3)
+        ]
+        session.add_all(rows)
+        session.commit()
+        ids = [row.id for row in rows]
+    yield ids
+    with database.SessionLocal() as session:
+        session.query(models.PushOutbox).filter(models.PushOutbox.id.in_(ids)).delete(synchronize_session=False)
+        session.commit()
+
+def make_dispatcher(monkeypatch, throttle=None) -> tuple:
+    dispatcher = push.PushDispatcher(
+        provider=push.LoggingPushProvider(), outbox_enabled=True, outbox_claim_seconds=60, throttle=throttle
+    )
+    enqueued = []
+    # 只記錄排入的推播，不啟動工作執行緒
+    monkeypatch.setattr(dispatcher, "_enqueue", lambda messages: enqueued.extend(messages) or len(messages))
+    return dispatcher, enqueued
+
+def test_each_row_is_claimed_by_one_worker(outbox_rows, monkeypatch):
+    first, first_enqueued = make_dispatcher(monkeypatch)
+    second, second_enqueued = make_dispatcher(monkeypatch)
+
+    assert first.recover_outbox() == 3
+    assert [message.outbox_id for message in first_enqueued] == outbox_rows
+    # 認領還沒過期：其他 worker 補送時不會再排入
+    assert second.recover_outbox() == 0
+
+    # 第一個 worker 送到一半停止，認領過期後才由其他 worker 接手
+    with database.SessionLocal() as session:
+        session.query(models.PushOutbox).filter(models.PushOutbox.id == outbox_rows[0]).update(
+            {"claimed_at": datetime.utcnow() - timedelta(seconds=61)}, synchronize_session=False
+        )
+        session.commit()
+    assert second.recover_outbox() == 1
+    assert [message.outbox_id for message in second_enqueued] == outbox_rows[:1]
+
+    with database.SessionLocal() as session:
+        statuses = {
+            status for (status,) in
+            session.query(models.PushOutbox.status).filter(models.PushOutbox.id.in_(outbox_rows))
+        }
+    assert statuses == {"sending"}
+
+def test_throttle_runs_after_commit(make_user, monkeypatch):
+    recipient, _ = make_user()
+    throttle = push.PushThrottle(burst=1, per_minute=0.001, content_dedup_seconds=300, rules={})
+    dispatcher, enqueued = make_dispatcher(monkeypatch, throttle)
+
+    def message(event_key: str, body: str = "小明已到校") -> push.PushMessage:
+        return push.PushMessage(
+            recipient_id=recipient.id, title="到校通知", body=body,
+            dedup_key=push.make_dedup_key(recipient.id, "到校通知", body, event_key),
+        )
+
+    # rollback 的交易不會消耗 token 與內容去重時間窗
+    with database.SessionLocal() as session:
+        dispatcher.submit_after_commit(session, [message("rolled-back")])
+        session.rollback()
+    assert enqueued == [] and throttle.suppressed["rate_limited"] == 0
+
+    with database.SessionLocal() as session:
+        first, duplicate = message("first"), message("second")
+        dispatcher.submit_after_commit(session, [first, duplicate])
+        session.commit()
+    assert enqueued == [first]
+
+    # 被擋下的推播標記為 suppressed，補送時不會再被認領
+    with database.SessionLocal() as session:
+        statuses = dict(
+            session.query(models.PushOutbox.id, models.PushOutbox.status)
+            .filter(models.PushOutbox.id.in_([first.outbox_id, duplicate.outbox_id]))
+        )
+    assert statuses == {first.outbox_id: "sending", duplicate.outbox_id: "suppressed"}
+    assert dispatcher.recover_outbox() == 0
+
+def test_sent_status_is_rewritten_after_a_failed_update(outbox_rows, monkeypatch):
+    dispatcher, enqueued = make_dispatcher(monkeypatch)
+    assert dispatcher.recover_outbox() == 3
+    write = dispatcher._write_outbox_update
+    calls = []
+
+    def flaky_write(update):
+        calls.append(update)
+        if len(calls) == 1:
+            raise RuntimeError("資料庫暫時無法連線")
+        write(update)
+
+    monkeypatch.setattr(dispatcher, "_write_outbox_update", flaky_write)
+    dispatcher._send(enqueued[:1])
+    assert dispatcher.stats()["outbox_unsaved_batches"] == 1
+
+    # 認領過期時，補送不會再排入這個 worker 已經送出的那一則
+    with database.SessionLocal() as session:
+        session.query(models.PushOutbox).filter(models.PushOutbox.id.in_(outbox_rows)).update(
+            {"claimed_at": datetime.utcnow() - timedelta(seconds=61)}, synchronize_session=False
+        )
+        session.commit()
+    enqueued.clear()
+    assert dispatcher.recover_outbox() == 2
+    assert [message.outbox_id for message in enqueued] == outbox_rows[1:]
+
+    # 退避結束後由工作執行緒重寫，狀態變成 sent 並保留原本的送出時間
+    dispatcher._next_unsaved_flush = 0.0
+    dispatcher._flush_outbox_updates()
+    assert dispatcher.stats()["outbox_unsaved_batches"] == 0
+    with database.SessionLocal() as session:
+        row = session.get(models.PushOutbox, outbox_rows[0])
+        assert (row.status, row.sent_at) == ("sent", calls[0].sent_at)
@@ -0,0 +1,69 @@
+# 檔案路徑: tests/test_push_throttle.py
+# 推播節流規則：依狀態變更找出規則，內容去重與每位收件人的 token bucket。
+
+import pytest
+
+from app import push
+
+def _message(recipient_id=1, body="小明已到校", category=None) -> push.PushMessage:
+    return push.PushMessage(
+        recipient_id=recipient_id, title="到校通知", body=body,
+        dedup_key=push.make_dedup_key(recipient_id, "到校通知", body), category=category,
+    )
+
+def test_rule_lookup_prefers_the_most_specific_key():
+    throttle = push.PushThrottle(rules={
+        "ARRIVED->READY_FOR_PICKUP": push.RULE_MUTE,
+        "*->PICKUP_COMPLETED": push.RULE_ALWAYS,
+        "HOMEWORK_PENDING->*": push.RULE_MUTE,
+        "*->*": push.RULE_LIMITED,
+    })
+    assert throttle.rule_for("ARRIVED->READY_FOR_PICKUP") == push.RULE_MUTE
+    assert throttle.rule_for("HOMEWORK_PENDING->PICKUP_COMPLETED") == push.RULE_ALWAYS
+    assert throttle.rule_for("HOMEWORK_PENDING->ARRIVED") == push.RULE_MUTE
+    assert throttle.rule_for("ARRIVED->HOMEWORK_PENDING") == push.RULE_LIMITED
+    assert throttle.rule_for(None) == push.RULE_LIMITED
+    assert push.PushThrottle(rules={}).rule_for("ARRIVED->HOMEWORK_PENDING") == push.RULE_LIMITED
+
+def test_invalid_rules_are_rejected():
+    with pytest.raises(ValueError):
+        push.PushThrottle(rules={"*->ARRIVED": "sometimes"})
+
+def test_muted_and_duplicate_content_are_suppressed():
+    throttle = push.PushThrottle(burst=10, per_minute=60, content_dedup_seconds=300, rules={"*->ARRIVED": push.RULE_MUTE})
+    assert throttle.admit([_message(category="NOT_ARRIVED->ARRIVED")]) == []
+
+    first, other_recipient = _message(), _message(recipient_id=2)
+    assert throttle.admit([first, _message(), other_recipient]) == [first, other_recipient]
+    assert throttle.suppressed == {"muted": 1, "duplicate_content": 1, "rate_limited": 0}
+
+def test_always_bypasses_limits_but_still_registers_content():
+    throttle = push.PushThrottle(burst=1, per_minute=0.001, content_dedup_seconds=300, rules={"*->PICKUP_COMPLETED": push.RULE_ALWAYS})
+    completed = [_message(body=f"接送完成 {i}", category="PARENT_EN_ROUTE->PICKUP_COMPLETED") for i in range(3)]
+    assert throttle.admit(completed) == completed
+    # 緊接著同內容的一般推播會被去重，而 always 沒有消耗 token
+    assert throttle.admit([_message(body="接送完成 0")]) == []
+    assert len(throttle.admit([_message(body="其他內容")])) == 1
+
+def test_token_bucket_refills_over_time(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(push.time, "monotonic", lambda: now[0])
+    throttle = push.PushThrottle(burst=2, per_minute=1, content_dedup_seconds=0, rules={})
+
+    bodies = iter(f"第 {i} 則" for i in range(10))
+    def admit_one(recipient_id=1) -> bool:
+        return bool(throttle.admit([_message(recipient_id, next(bodies))]))
+
+    assert [admit_one(), admit_one(), admit_one()] == [True, True, False]
+    # 其他收件人有自己的 bucket
+    assert admit_one(recipient_id=2)
+    now[0] += 30
+    assert not admit_one()
+    now[0] += 30
+    assert admit_one()
+    assert throttle.suppressed["rate_limited"] == 2
+
+def test_zero_burst_disables_rate_limiting():
+    throttle = push.PushThrottle(burst=0, per_minute=0, content_dedup_seconds=0, rules={})
+    messages = [_message(body=f"第 {i} 則") for i in range(20)]
+    assert throttle.admit(messages) == messages
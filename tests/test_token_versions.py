@@ -0,0 +1,24 @@
+# 檔案路徑: tests/test_token_versions.py
+# Token 版本表只能往前走：在修改密碼之前讀到舊版本的執行緒晚一步寫回快取，也不能讓舊 Token 重新生效。
+
+from app import security
+
+def test_stale_reader_cannot_restore_old_token_version(db, make_user, monkeypatch):
+    user, old_token = make_user()
+    security.token_versions.invalidate(user.id)
+    original_get = security.token_versions.get
+
+    def miss_then_password_changed(key):
+        # 讀取端查快取未命中之後、寫回之前，另一個請求完成了修改密碼 (版本 0 -> 1)
+        value = original_get(key)
+        security.record_token_version(user.id, 1)
+        return value
+
+    monkeypatch.setattr(security.token_versions, "get", miss_then_password_changed)
+    # 資料庫中仍是版本 0 (模擬讀取端在提交之前查詢)，但快取必須保留較新的 1
+    assert security.get_token_version(db, user.id) == 1
+    monkeypatch.undo()
+
+    assert security.token_versions.get(user.id) == 1
+    claims = security.decode_access_token(old_token)
+    assert security.principal_from_claims(db, claims) is None
@@ -0,0 +1,27 @@
+# 檔案路徑: tests/test_tracing.py
+# 追蹤檔是 JSON Lines (每行一個事件)，並且可以轉換成 Chrome Trace 的 JSON 物件格式。
+
+import json
+
+from app.core import tracing
+
+def test_trace_file_is_jsonl_and_converts_to_chrome_format(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACES_DIR", tmp_path)
+    writer = tracing._TraceWriter()
+    first = [
+        {"name": "thread_name", "ph": "M", "pid": 1, "tid": 1, "args": {"name": "GET /a"}},
+        {"name": "GET /a", "cat": "http", "ph": "X", "ts": 1.0, "dur": 2.0, "pid": 1, "tid": 1},
+    ]
+    second = [{"name": "db.SELECT", "cat": "db", "ph": "X", "ts": 1.5, "dur": 0.5, "pid": 1, "tid": 2}]
+    writer.submit(first)
+    writer.submit(second)
+    writer.stop()
+
+    lines = writer.path.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line) for line in lines] == first + second
+
+    # 行程在寫到一半時結束，最後一行不完整：轉換時略過
+    with open(writer.path, "a", encoding="utf-8") as f:
+        f.write('{"name": "db.UPD')
+    document = tracing.to_chrome_trace(tracing.trace_files(tmp_path))
+    assert document["traceEvents"] == first + second
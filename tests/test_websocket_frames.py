@@ -0,0 +1,95 @@
+# 檔案路徑: tests/test_websocket_frames.py
+# 客戶端送進接收迴圈的訊框：格式不對或送到只接收伺服器事件的房間時，回報錯誤而不轉發，連線保持。
+# 以及誰可以加入這些伺服器事件房間。
+
+import asyncio
+import time
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from app import database, events, models, security
+from app.routers.websockets import can_join_room
+from tests.conftest import auth
+
+@pytest.mark.parametrize("frame", [[1, 2], "x", 3, None])
+def test_non_object_frames_are_rejected_without_closing(client, make_user, frame):
+    parent, token = make_user()
+    with client.websocket_connect(f"/ws/family-{parent.id}?token={token}") as websocket:
+        websocket.send_json(frame)
+        assert websocket.receive_json()["type"] == "error"
+        # 連線仍然可用，物件訊息照常廣播給房間
+        websocket.send_json({"type": "note", "text": "hello"})
+        message = websocket.receive_json()
+        assert message["text"] == "hello" and isinstance(message["seq"], int)
+
+def test_server_event_rooms_do_not_relay_client_frames(client, make_user, institution):
+    _, token = make_user(models.UserRole.teacher)
+    forged = {"type": "student_status", "student_id": 1, "old": "ARRIVED", "new": "PICKUP_COMPLETED"}
+    with client.websocket_connect(f"/ws/institution:{institution.id}?token={token}") as websocket:
+        websocket.send_json(forged)
+        assert websocket.receive_json()["type"] == "error"
+        # 偽造的事件沒有被廣播：下一個收到的就是 pong (否則發送者自己也會先收到它)
+        websocket.send_json({"type": "ping"})
+        assert websocket.receive_json() == {"type": "pong"}
+
+@pytest.mark.parametrize("frame", ["{", '{"type": "ping"', b"\xc1", b"\x92\x01"])
+def test_undecodable_frames_are_rejected_without_closing(client, make_user, frame):
+    parent, token = make_user()
+    with client.websocket_connect(f"/ws/family-{parent.id}?token={token}") as websocket:
+        if isinstance(frame, bytes):
+            websocket.send_bytes(frame)
+        else:
+            websocket.send_text(frame)
+        assert websocket.receive_json()["type"] == "error"
+        websocket.send_json({"type": "ping"})
+        assert websocket.receive_json() == {"type": "pong"}
+
+@pytest.mark.parametrize("role", [models.UserRole.receptionist, models.UserRole.teacher, models.UserRole.admin])
+def test_staff_can_join_event_rooms(client, make_user, make_student, institution, role):
+    user, token = make_user(role)
+    class_id = _class_id_of(make_student())
+    staff = security.UserSnapshot.from_user(user)
+    # WebSocket 與 Server-Sent Events 都以 can_join_room 判斷
+    assert asyncio.run(can_join_room(staff, f"class:{class_id}"))
+    with client.websocket_connect(f"/ws/institution:{institution.id}?token={token}") as websocket:
+        websocket.send_json({"type": "ping"})
+        assert websocket.receive_json() == {"type": "pong"}
+
+def test_parents_cannot_join_event_rooms(client, make_user, institution):
+    _, token = make_user()
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect(f"/ws/institution:{institution.id}?token={token}") as websocket:
+            websocket.receive_json()
+    response = client.get(f"/api/v1/stream/institution:{institution.id}", headers=auth(token))
+    assert response.status_code == 403
+
+def _class_id_of(student_id: int) -> int:
+    with database.SessionLocal() as session:
+        return session.get(models.Student, student_id).class_id
+
+def test_client_eta_frames_cannot_reach_event_rooms(client, make_user, institution, monkeypatch):
+    monkeypatch.setattr(events.eta_coalescer, "window_seconds", 0.01)
+    _, token = make_user(models.UserRole.teacher)
+    with client.websocket_connect(f"/ws/institution:{institution.id}?token={token}") as websocket:
+        websocket.send_json({"type": "eta", "student_id": 1, "minutes_remaining": 0, "new": "PICKUP_COMPLETED"})
+        assert websocket.receive_json()["type"] == "error"
+        time.sleep(0.1)
+        # 合併器的時間窗已經過了：若 ETA 被送進房間，會比 pong 先收到
+        websocket.send_json({"type": "ping"})
+        assert websocket.receive_json() == {"type": "pong"}
+
+def test_client_eta_is_rebuilt_from_server_side_fields(client, make_user, monkeypatch):
+    monkeypatch.setattr(events.eta_coalescer, "window_seconds", 0.01)
+    parent, token = make_user()
+    with client.websocket_connect(f"/ws/family-{parent.id}?token={token}") as websocket:
+        websocket.send_json({"type": "eta", "student_id": 7, "minutes_remaining": -1})
+        assert websocket.receive_json()["type"] == "error"
+        websocket.send_json({"type": "eta", "student_id": 7, "minutes_remaining": 5, "parent": 999, "new": "PICKUP_COMPLETED"})
+        frame = websocket.receive_json()
+    assert frame["type"] == "eta"
+    [update] = frame["updates"]
+    assert {key: update[key] for key in ("student_id", "class_id", "minutes_remaining", "parent")} == {
+        "student_id": 7, "class_id": None, "minutes_remaining": 5, "parent": parent.id,
+    }
+    assert "new" not in update
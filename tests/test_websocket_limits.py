@@ -0,0 +1,78 @@
+# 檔案路徑: tests/test_websocket_limits.py
+# 連線上限：並行的握手都通過了 accept 前的預先檢查時，加入房間時的複檢仍要守住上限。
+
+import asyncio
+
+from app.websocket import ConnectionLimitExceeded, ConnectionManager
+from app.ws_broker import InProcessBroker
+
+class _FakeWebSocket:
+    """accept() 會讓出事件迴圈，模擬握手期間其他連線插隊的情況。"""
+    def __init__(self):
+        self.scope = {"subprotocols": []}
+        self.closed_with = None
+
+    async def accept(self, subprotocol=None):
+        await asyncio.sleep(0.01)
+
+    async def send_text(self, frame):
+        pass
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+def _manager(max_per_user=0, max_per_institution=0) -> ConnectionManager:
+    manager = ConnectionManager(broker=InProcessBroker())
+    manager.max_per_user = max_per_user
+    manager.max_per_institution = max_per_institution
+    return manager
+
+def test_concurrent_handshakes_cannot_exceed_the_institution_cap():
+    async def scenario():
+        manager = _manager(max_per_institution=2)
+        results = await asyncio.gather(
+            *(manager.connect(_FakeWebSocket(), "room", user_id=i, institution_id=7) for i in range(5)),
+            return_exceptions=True,
+        )
+        live = len(manager.registry.in_institution(7))
+        await manager.stop()
+        return results, live
+
+    results, live = asyncio.run(scenario())
+    assert live == 2
+    assert sum(isinstance(r, ConnectionLimitExceeded) for r in results) == 3
+
+def test_concurrent_handshakes_of_one_user_keep_only_the_newest():
+    async def scenario():
+        manager = _manager(max_per_user=1)
+        sockets = [_FakeWebSocket() for _ in range(3)]
+        connections = await asyncio.gather(*(manager.connect(ws, "room", user_id=1) for ws in sockets))
+        await asyncio.sleep(0)  # 讓關閉被擠掉連線的任務執行
+        live = list(manager.registry.for_user(1))
+        tasks = [c.writer_task for c in connections]
+        await manager.stop()
+        return connections, sockets, live, tasks
+
+    connections, sockets, live, tasks = asyncio.run(scenario())
+    assert live == [connections[-1]]
+    assert [ws.closed_with for ws in sockets[:-1]] == [1008, 1008]
+    # 被擠掉的連線不會留下還在執行的寫入任務
+    assert all(task is None or task.cancelled() for task in tasks[:-1])
+
+def test_streams_over_the_cap_end_instead_of_registering():
+    async def scenario():
+        manager = _manager(max_per_institution=1)
+        # 兩條串流都在預先檢查時通過，第二條開始迭代時才超出上限
+        first = await manager.open_stream("room", user_id=1, institution_id=7)
+        second = await manager.open_stream("room", user_id=2, institution_id=7)
+        first_task = asyncio.ensure_future(first.__anext__())
+        await asyncio.sleep(0)
+        leftover = [event async for event in second]
+        live = len(manager.registry.in_institution(7))
+        first_task.cancel()
+        await manager.stop()
+        return leftover, live
+
+    leftover, live = asyncio.run(scenario())
+    assert leftover == []
+    assert live == 1
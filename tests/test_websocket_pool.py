@@ -0,0 +1,30 @@
+# 檔案路徑: tests/test_websocket_pool.py
+# WebSocket 連線在握手驗證後就會歸還資料庫連線 (見 dependencies.get_current_user_from_token)：
+# 連線保持開啟期間，連線池的借出數必須回到 0。
+
+from app import database, security
+
+def _open(client, room: str, token: str):
+    websocket = client.websocket_connect(f"/ws/{room}?token={token}")
+    session = websocket.__enter__()
+    # 一來一回確認已經進入接收迴圈 (身分驗證與加入房間都已完成)
+    session.send_json({"type": "ping"})
+    assert session.receive_json() == {"type": "pong"}
+    return websocket
+
+def test_open_sockets_hold_no_pool_connections(client, make_user):
+    parent, token = make_user()
+    legacy_parent, _ = make_user()
+    # 舊版 Token 只有 sub，驗證時必須查詢資料庫 (經由身分快取)
+    legacy_token = security.create_access_token({"sub": legacy_parent.phone_number})
+    security.invalidate_principal(legacy_parent.phone_number)
+
+    sockets = [
+        _open(client, f"family-{parent.id}", token),
+        _open(client, f"family-{legacy_parent.id}", legacy_token),
+    ]
+    try:
+        assert database.engine.pool.checkedout() == 0
+    finally:
+        for websocket in sockets:
+            websocket.__exit__(None, None, None)
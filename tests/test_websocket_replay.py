@@ -0,0 +1,67 @@
+# 檔案路徑: tests/test_websocket_replay.py
+# 重連補送：last_seq 仍在房間緩衝區內時只補送差異，缺口太舊 (或這個 worker 沒有紀錄) 時改送快照。
+
+import asyncio
+import json
+
+from app.websocket import ConnectionManager, ReplayBuffer
+from app.ws_broker import InProcessBroker
+
+class _RecordingWebSocket:
+    def __init__(self):
+        self.scope = {"subprotocols": []}
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, frame):
+        self.sent.append(json.loads(frame))
+
+    async def close(self, code=1000):
+        pass
+
+def test_buffer_floor_tracks_what_is_still_replayable():
+    buffer = ReplayBuffer(size=2, floor=None)
+    # 還沒收到任何訊息：無法判斷漏了什麼
+    assert buffer.since(0) is None
+
+    buffer.append(5, {"n": 5})
+    assert buffer.floor == 4
+    assert buffer.since(4) == [{"n": 5}]
+    assert buffer.since(5) == []
+    assert buffer.since(3) is None
+
+    # 超過容量時最舊的被擠出，floor 跟著往前
+    buffer.append(6, {"n": 6})
+    buffer.append(7, {"n": 7})
+    assert buffer.floor == 5
+    assert buffer.since(5) == [{"n": 6}, {"n": 7}]
+    assert buffer.since(4) is None
+
+def _resume(last_seq, snapshot=None, replay_size=3):
+    async def scenario():
+        manager = ConnectionManager(broker=InProcessBroker(), replay_size=replay_size)
+        await manager.start()
+        for n in range(1, 6):
+            await manager.broadcast_to_room({"n": n}, "room")
+        websocket = _RecordingWebSocket()
+        await manager.connect(websocket, "room", user_id=1, last_seq=last_seq, snapshot=snapshot)
+        await manager.stop()
+        return websocket.sent
+    return asyncio.run(scenario())
+
+def test_reconnect_within_the_buffer_replays_only_the_gap():
+    assert _resume(last_seq=3) == [{"n": 4, "seq": 4}, {"n": 5, "seq": 5}]
+    assert _resume(last_seq=5) == []
+
+def test_reconnect_past_the_buffer_falls_back_to_a_snapshot():
+    async def snapshot():
+        return {"students": ["小明"]}
+
+    # 緩衝區只保留 3 則 (序號 3~5)，last_seq=1 之後的序號 2 已經不在了
+    assert _resume(last_seq=1, snapshot=snapshot) == [{"type": "snapshot", "seq": 5, "students": ["小明"]}]
+    assert _resume(last_seq=1) == [{"type": "resync_required", "seq": 5}]
+
+def test_first_connection_without_last_seq_gets_nothing_replayed():
+    assert _resume(last_seq=None) == []
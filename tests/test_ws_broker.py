@@ -0,0 +1,53 @@
+# 檔案路徑: tests/test_ws_broker.py
+# Unix datagram 後端：訊息依序號順序遞送、大訊息不會被截斷、超過上限的在 publish 時就拒絕。
+
+import asyncio
+
+import pytest
+
+from app import ws_broker
+from app.ws_broker import UnixSocketBroker
+
+def _run(directory, scenario):
+    async def main():
+        delivered = []
+        broker = UnixSocketBroker(str(directory))
+        await broker.start(lambda topic, seq, message: delivered.append((topic, seq, message)))
+        try:
+            await scenario(broker)
+            # 等 datagram 被事件迴圈讀完
+            await asyncio.sleep(0.1)
+        finally:
+            await broker.stop()
+        return delivered
+    return asyncio.run(main())
+
+def test_concurrent_publishes_arrive_in_sequence_order(tmp_path):
+    async def scenario(broker):
+        seqs = await asyncio.gather(*(broker.publish("room:a", {"n": i}) for i in range(20)))
+        assert sorted(seqs) == list(range(1, 21))
+
+    delivered = _run(tmp_path, scenario)
+    assert [seq for _, seq, _ in delivered] == list(range(1, 21))
+
+def test_large_messages_are_delivered_whole_and_oversize_rejected(tmp_path):
+    payload = "x" * (UnixSocketBroker.MAX_DATAGRAM_BYTES - 100)
+
+    async def scenario(broker):
+        await broker.publish("room:a", {"text": payload})
+        with pytest.raises(ValueError):
+            await broker.publish("room:a", {"text": payload + "x" * 200})
+
+    delivered = _run(tmp_path, scenario)
+    assert delivered == [("room:a", 1, {"text": payload})]
+
+@pytest.mark.parametrize("database_url", [
+    "postgresql://pickup:secret@db:5432/pickup",
+    "postgres://pickup:secret@db:5432/pickup",
+    "postgresql+psycopg2://pickup:secret@db:5432/pickup",
+    "postgresql+psycopg://pickup:secret@db:5432/pickup",
+])
+def test_postgres_broker_gets_a_plain_dsn(database_url, monkeypatch):
+    monkeypatch.setattr(ws_broker.settings, "WS_BROKER_BACKEND", "postgres")
+    monkeypatch.setattr(ws_broker.settings, "DATABASE_URL", database_url)
+    assert ws_broker.create_broker().dsn == "postgresql://pickup:secret@db:5432/pickup"
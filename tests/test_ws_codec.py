@@ -0,0 +1,81 @@
+# 檔案路徑: tests/test_ws_codec.py
+# 訊框編碼：握手時協商 MessagePack 子協定，一則廣播對每種編碼只序列化一次。
+
+import asyncio
+import json
+
+import msgpack
+
+from app import ws_codec
+from app.websocket import ConnectionManager
+from app.ws_broker import InProcessBroker
+
+def test_negotiation_picks_msgpack_only_when_requested():
+    assert ws_codec.negotiate(["chat", ws_codec.MSGPACK_SUBPROTOCOL]) == ws_codec.MSGPACK_SUBPROTOCOL
+    assert ws_codec.negotiate(["chat"]) is None
+    assert ws_codec.negotiate([]) is None
+    assert ws_codec.encoding_for(ws_codec.MSGPACK_SUBPROTOCOL) == ws_codec.ENCODING_MSGPACK
+    assert ws_codec.encoding_for(None) == ws_codec.ENCODING_JSON
+
+def test_msgpack_clients_get_binary_frames(client, make_user):
+    parent, token = make_user()
+    url = f"/ws/family-{parent.id}?token={token}"
+    with client.websocket_connect(url, subprotocols=[ws_codec.MSGPACK_SUBPROTOCOL]) as websocket:
+        assert websocket.accepted_subprotocol == ws_codec.MSGPACK_SUBPROTOCOL
+        websocket.send_bytes(msgpack.packb({"type": "ping"}))
+        assert msgpack.unpackb(websocket.receive_bytes()) == {"type": "pong"}
+        # MessagePack 客戶端也可以送 JSON 文字，回覆仍是二進位
+        websocket.send_text(json.dumps({"type": "note", "text": "嗨"}))
+        message = msgpack.unpackb(websocket.receive_bytes())
+        assert message["text"] == "嗨" and isinstance(message["seq"], int)
+
+    with client.websocket_connect(url) as websocket:
+        assert websocket.accepted_subprotocol is None
+        websocket.send_json({"type": "ping"})
+        assert websocket.receive_text() == '{"type":"pong"}'
+
+class _RecordingWebSocket:
+    def __init__(self, subprotocols):
+        self.scope = {"subprotocols": subprotocols}
+        self.frames = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, frame):
+        self.frames.append(frame)
+
+    async def send_bytes(self, frame):
+        self.frames.append(frame)
+
+    async def close(self, code=1000):
+        pass
+
+def test_a_broadcast_is_encoded_once_per_encoding(monkeypatch):
+    encoded = []
+    encode = ws_codec.encode
+
+    def counting_encode(message, encoding):
+        encoded.append(encoding)
+        return encode(message, encoding)
+
+    monkeypatch.setattr(ws_codec, "encode", counting_encode)
+
+    async def scenario():
+        manager = ConnectionManager(broker=InProcessBroker())
+        sockets = [_RecordingWebSocket([]) for _ in range(3)]
+        sockets += [_RecordingWebSocket([ws_codec.MSGPACK_SUBPROTOCOL]) for _ in range(2)]
+        for user_id, websocket in enumerate(sockets):
+            await manager.connect(websocket, "room", user_id=user_id)
+        await manager.broadcast_to_room({"type": "note", "text": "放學了"}, "room")
+        await asyncio.sleep(0.05)
+        await manager.stop()
+        return sockets
+
+    sockets = asyncio.run(scenario())
+    assert sorted(encoded) == [ws_codec.ENCODING_JSON, ws_codec.ENCODING_MSGPACK]
+    json_frames = [websocket.frames for websocket in sockets[:3]]
+    msgpack_frames = [websocket.frames for websocket in sockets[3:]]
+    assert json_frames == [[json_frames[0][0]]] * 3 and isinstance(json_frames[0][0], str)
+    assert msgpack_frames == [[msgpack_frames[0][0]]] * 2
+    assert msgpack.unpackb(msgpack_frames[0][0]) == {"type": "note", "text": "放學了", "seq": 1}